@@ -0,0 +1,68 @@
+# ========================== #
+# ⏱️ Phụ đề từ timestamp của API
+# ========================== #
+# Endpoint /with-timestamps trả về thời điểm bắt đầu/kết thúc của từng ký tự ngay
+# trong lần tổng hợp. Lưu lại cạnh mỗi đoạn (segN.json) rồi dựng SRT theo đúng
+# thời gian thật, không cần giải mã âm thanh.
+import json
+import os
+
+CJK_LANGS = ('ja', 'zh', 'ko')
+
+
+def alignment_path(audio_path):
+    return os.path.splitext(audio_path)[0] + ".json"
+
+
+def empty_alignment():
+    return {"characters": [], "character_start_times_seconds": [], "character_end_times_seconds": []}
+
+
+# Gộp alignment của một chunk streaming vào alignment tích lũy
+def extend_alignment(acc, chunk):
+    if not chunk:
+        return acc
+    for name in ("characters", "character_start_times_seconds", "character_end_times_seconds"):
+        acc[name].extend(chunk.get(name) or [])
+    return acc
+
+
+def save_alignment(audio_path, alignment):
+    with open(alignment_path(audio_path), "w", encoding="utf-8") as f:
+        json.dump(alignment, f, ensure_ascii=False)
+
+
+def load_alignment(audio_path):
+    try:
+        with open(alignment_path(audio_path), encoding="utf-8") as f:
+            data = json.load(f)
+        return data if data.get("characters") else None
+    except (OSError, ValueError):
+        return None
+
+
+# Gom ký tự thành các dòng phụ đề giống ultra_split: `unit` từ mỗi dòng,
+# hoặc `unit` ký tự với tiếng Nhật/Trung/Hàn. Trả về [(text, start, end)].
+def alignment_cues(alignment, unit=3, lang='en'):
+    chars = alignment["characters"]
+    starts = alignment["character_start_times_seconds"]
+    ends = alignment["character_end_times_seconds"]
+    tokens, word = [], []
+    for c, s, e in zip(chars, starts, ends):
+        if lang in CJK_LANGS:
+            if not c.isspace():
+                tokens.append((c, s, e))
+        elif c.isspace():
+            if word:
+                tokens.append((''.join(w[0] for w in word), word[0][1], word[-1][2]))
+                word = []
+        else:
+            word.append((c, s, e))
+    if word:
+        tokens.append((''.join(w[0] for w in word), word[0][1], word[-1][2]))
+    sep = '' if lang in CJK_LANGS else ' '
+    cues = []
+    for k in range(0, len(tokens), max(1, unit)):
+        group = tokens[k:k + max(1, unit)]
+        cues.append((sep.join(t[0] for t in group), group[0][1], group[-1][2]))
+    return cues
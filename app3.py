@@ -1,10 +1,14 @@
 # @title 🔊 Giao diện tạo giọng nói + phụ đề chính xác đa ngôn ngữ (SSML)
-import os, re, requests, time, random
-from pydub import AudioSegment
-from datetime import datetime
-from IPython.display import display, Audio, FileLink, clear_output
+from IPython.display import display, clear_output
 import ipywidgets as widgets
-from google.colab import files
+from synth_cache import SynthCache
+import audio_formats
+import metrics
+from dashboard import Dashboard
+from job_queue import JobQueue
+from key_health import CreditLedger
+from segment_planner import LatencyModel
+from tts_engine import run_job
 
 # ==== Giao diện ====
 api_input = widgets.Textarea(value='', placeholder='Nhập các API key, mỗi dòng một key', description='🔑 API Key:', layout={'width': '100%', 'height': '100px'})
@@ -17,105 +21,37 @@ slider_style = widgets.FloatSlider(value=0.0, min=0, max=1.0, step=0.05, descrip
 slider_speed = widgets.FloatSlider(value=1.0, min=0.7, max=1.2, step=0.05, description='⏩ Speed')
 chk_boost = widgets.Checkbox(value=False, description='⚡ Optimize Streaming')
 chk_ssml = widgets.Checkbox(value=False, description='🧠 Sử dụng SSML (SSML Mode)')
+chk_stream = widgets.Checkbox(value=False, description='📡 Streaming (ghi dần ra file)')
+chk_align = widgets.Checkbox(value=True, description='⏱️ Phụ đề theo timestamp của API')
+chk_live = widgets.Checkbox(value=False, description='📡 Nghe dần trong lúc tạo')
 split_length = widgets.IntText(value=500, description='✂️ Split limit:')
+chk_balance = widgets.Checkbox(value=True, description='⚖️ Chia đoạn cân bằng theo số luồng')
+chk_rebalance = widgets.Checkbox(value=False, description='🔀 Chạy tiếp: chia lại đoạn theo số key/luồng mới')
+format_dropdown = widgets.Dropdown(options=audio_formats.CHOICES, value=audio_formats.DEFAULT_FORMAT, description='🎚️ Định dạng:')
+chk_incremental = widgets.Checkbox(value=False, description='✏️ Chỉ tạo lại đoạn đã sửa')
+cache_mb = widgets.IntText(value=2048, description='💾 Cache (MB):')
+workers_input = widgets.IntText(value=4, description='🧵 Luồng tổng:')
+per_key_input = widgets.IntText(value=2, description='🔑 Luồng/key:')
+rate_input = widgets.FloatText(value=0, description='⏱️ Req/s/key:')
+hedge_input = widgets.FloatText(value=0, description='🪁 Hedge (%):')
 subtitle_limit = widgets.IntText(value=3, description='📜 SRT từ/ký tự dòng:')
 lang_dropdown = widgets.Dropdown(options=[("🇬🇧 English", "en"), ("🇻🇳 Vietnamese", "vi"), ("🇯🇵 Japanese", "ja"), ("🇨🇳 Chinese", "zh"), ("🇰🇷 Korean", "ko"), ("🇫🇷 French", "fr"), ("🇩🇪 German", "de"), ("🇮🇹 Italian", "it"), ("🇷🇺 Russian", "ru"), ("🇪🇸 Spanish", "es")], value="en", description='🌐 Ngôn ngữ phụ đề:')
-text_stats = widgets.HTML(value="")
+# Một widget duy nhất cho tiến độ, log, credit và trình phát, vẽ lại tại chỗ
+dash = Dashboard()
 btn_generate = widgets.Button(description="🚀 Bắt đầu tạo giọng nói", button_style='success')
 btn_download_segs = widgets.Button(description="⬇️ Tải đoạn lẻ", button_style='primary')
 btn_download_srt = widgets.Button(description="📜 Tải phụ đề", button_style='info')
 btn_download_full = widgets.Button(description="🎧 Tải đoạn gộp", button_style='primary')
-
-# ==== Tiện ích ====
-def convert_time(t):
-    ms = int((t - int(t)) * 1000)
-    h, m, s = int(t // 3600), int(t % 3600 // 60), int(t % 60)
-    return f"{h:02}:{m:02}:{s:02},{ms:03}"
-
-def ultra_split(text, max_unit=5, lang='en'):
-    items = list(text.strip()) if lang in ['ja', 'zh', 'ko'] else text.strip().split()
-    chunks, temp = [], []
-    for item in items:
-        temp.append(item)
-        if len(temp) >= max_unit:
-            chunks.append(''.join(temp) if lang in ['ja', 'zh', 'ko'] else ' '.join(temp))
-            temp = []
-    if temp:
-        chunks.append(''.join(temp) if lang in ['ja', 'zh', 'ko'] else ' '.join(temp))
-    return chunks
-
-def split_text(text, maxlen=500):
-    sents = re.split(r'(?<=[.!?。！？])\s*', text)
-    out, tmp = [], ""
-    for s in sents:
-        if len(tmp) + len(s) <= maxlen:
-            tmp += s
-        else:
-            out.append(tmp.strip())
-            tmp = s
-    if tmp: out.append(tmp.strip())
-    return out
-
-def check_credit(api_key):
-    try:
-        r = requests.get("https://api.elevenlabs.io/v1/user", headers={"xi-api-key": api_key})
-        return r.json()['subscription']['character_limit'] - r.json()['subscription']['character_count']
-    except: return None
-
-def gen_audio(text, api_key, voice_id, model_id, settings, outname):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    payload = {
-        "text": text,
-        "model_id": model_id,
-        "voice_settings": settings,
-        "text_type": "ssml" if chk_ssml.value or text.strip().lower().startswith("<speak>") else "plain"
-    }
-    r = requests.post(url, headers={"xi-api-key": api_key, "Content-Type": "application/json"}, json=payload)
-    if r.status_code == 200:
-        with open(outname, "wb") as f: f.write(r.content)
-        return True
-    else:
-        try: return False, r.json().get("detail", {}).get("message", "Unknown error")
-        except: return False, "Unknown error"
-
-def generate_subtitles(paragraphs, folder="output_audio", file="output.srt", lang="en", unit=3):
-    srt_path = os.path.join(folder, file)
-    files = sorted([f for f in os.listdir(folder) if f.startswith("seg") and f.endswith(".mp3")])
-    with open(srt_path, "w", encoding="utf-8") as srt:
-        current_time, index = 0.0, 1
-        for para, fname in zip(paragraphs, files):
-            audio = AudioSegment.from_mp3(os.path.join(folder, fname))
-            duration = audio.duration_seconds
-            units = ultra_split(para, unit, lang)
-            total_chars = sum(len(u) for u in units)
-            for u in units:
-                du = duration * (len(u) / total_chars)
-                srt.write(f"{index}\n{convert_time(current_time)} --> {convert_time(current_time + du)}\n{u}\n\n")
-                current_time += du
-                index += 1
-    return srt_path
+btn_enqueue = widgets.Button(description="📥 Thêm vào hàng đợi", button_style='warning')
+priority_input = widgets.IntText(value=0, description='⭐ Ưu tiên:')
 
 # ==== Xử lý chính ====
 def on_generate(b):
     clear_output()
     display(api_input, voice_id_input, text_input, model_dropdown,
             slider_stability, slider_similarity, slider_style, slider_speed,
-            chk_boost, chk_ssml, split_length, subtitle_limit, lang_dropdown,
-            text_stats, btn_generate, btn_download_segs, btn_download_srt, btn_download_full)
-
-    apis = api_input.value.strip().splitlines()
-    voice_id = voice_id_input.value.strip()
-    fulltext = text_input.value.strip()
-    lang = lang_dropdown.value
-    paragraphs = split_text(fulltext, split_length.value)
-    text_stats.value = f"<b>📊 Đoạn:</b> {len(paragraphs)} | <b>Ký tự:</b> {sum(len(p) for p in paragraphs):,}"
-
-    print("🔍 Kiểm tra API:")
-    credit_pool = []
-    for i, key in enumerate(apis):
-        credit = check_credit(key)
-        credit_pool.append([key, credit])
-        print(f"🔑 API #{i+1}: {credit:,} ký tự" if credit else f"❌ API #{i+1} lỗi")
+            chk_boost, chk_ssml, chk_stream, chk_align, chk_live, split_length, chk_balance, chk_rebalance, chk_incremental, format_dropdown, cache_mb, workers_input, per_key_input, rate_input, hedge_input, subtitle_limit, lang_dropdown,
+            dash.view, btn_generate, priority_input, btn_enqueue, btn_download_segs, btn_download_srt, btn_download_full)
 
     settings = {
         "stability": slider_stability.value,
@@ -124,59 +60,70 @@ def on_generate(b):
         "speed": slider_speed.value,
         "optimize_streaming_latency": 4 if chk_boost.value else 0
     }
-
-    os.makedirs("output_audio", exist_ok=True)
-    for f in os.listdir("output_audio"):
-        if f.endswith(".mp3") or f.endswith(".srt") or f.endswith(".txt"):
-            os.remove(os.path.join("output_audio", f))
-
-    error_count = 0
-    for i, para in enumerate(paragraphs):
-        print(f"\n📘 Đoạn {i+1}: {para[:40]}...")
-        for j, (key, credit) in enumerate(credit_pool):
-            if credit and len(para) <= credit:
-                success = gen_audio(para, key, voice_id, model_dropdown.value, settings, f"output_audio/seg{i+1}.mp3")
-                if success is True:
-                    credit_pool[j][1] -= len(para)
-                    display(Audio(filename=f"output_audio/seg{i+1}.mp3"))
-                    time.sleep(random.uniform(5, 10))
-                    error_count = 0
-                    break
-                else:
-                    print(f"❌ API #{j+1} lỗi: {success[1]}")
-                    credit_pool[j][1] = 0
-                    error_count += 1
-                    if error_count >= 3:
-                        print("⚠️ Gặp nhiều lỗi liên tiếp. Nghỉ 30 giây...")
-                        time.sleep(30)
-                        error_count = 0
-            if j == len(credit_pool) - 1:
-                print("⛔ Không còn API đủ quota!")
-                return
-
-    with open("output_audio/list.txt", "w") as f:
-        for fmp3 in sorted(os.listdir("output_audio")):
-            if fmp3.startswith("seg") and fmp3.endswith(".mp3"):
-                f.write(f"file '{fmp3}'\n")
-    os.system("ffmpeg -loglevel error -f concat -safe 0 -i output_audio/list.txt -c copy output_audio/full.mp3 -y")
-
-    if os.path.exists("output_audio/full.mp3"):
-        print("\n✅ Đã tạo file âm thanh:")
-        display(Audio(filename="output_audio/full.mp3"))
+    cache = SynthCache("tts_cache", max_bytes=cache_mb.value * 1024 * 1024)
+    # Số liệu của job này: bảng trực tiếp trong dashboard, sự kiện ghi nối vào tts_metrics.jsonl
+    metrics.REGISTRY.reset()
+    metrics.REGISTRY.events_path = "tts_metrics.jsonl"
+    dash.reset()
+    dash.set_status("🔄 Đang tạo giọng nói...")
+
+    def on_segment(i, para, path):
+        dash.note = cache.summary()
+        dash.segment(i, para, path, format_dropdown.value)
+
+    result = run_job(text_input.value, api_input.value.strip().splitlines(), voice_id_input.value.strip(),
+                     model_dropdown.value, settings, folder="output_audio", maxlen=split_length.value,
+                     ssml=chk_ssml.value, stream=chk_stream.value, align=chk_align.value,
+                     workers=workers_input.value, per_key=per_key_input.value, rate=rate_input.value or None,
+                     cache=cache, lang=lang_dropdown.value, unit=subtitle_limit.value,
+                     log=dash.log, on_plan=dash.plan, on_segment=on_segment, on_keys=dash.keys,
+                     balance=chk_balance.value, latency=LatencyModel("tts_latency.json"),
+                     incremental=chk_incremental.value, output_format=format_dropdown.value,
+                     ledger=CreditLedger("tts_credit_ledger.json"), hedge=hedge_input.value / 100,
+                     live=chk_live.value, on_live=dash.live_stream, rebalance=chk_rebalance.value)
+    metrics.REGISTRY.write_prometheus("tts_metrics.prom")
+    if result["stopped"]:
+        dash.set_status("⛔ Không còn API đủ quota, tiến độ đã lưu — chạy lại để tiếp tục")
+        return
+
+    srt = result["srt"]
+    if result["audio"]:
+        dash.play(result["audio"], f"✅ File gộp: {result['audio']}")
+        dash.set_status("✅ Hoàn thành" + (" (có phụ đề)" if srt else ""), 100)
     else:
-        print("❌ Lỗi tạo full.mp3")
-
-    srt = generate_subtitles(paragraphs, folder="output_audio", file="output.srt", lang=lang, unit=subtitle_limit.value)
-    print("✅ Đã tạo phụ đề")
+        dash.set_status("❌ Lỗi tạo file gộp")
 
-    btn_download_full.on_click(lambda b: files.download("output_audio/full.mp3"))
+    from google.colab import files
+    btn_download_full.on_click(lambda b: files.download(result["audio"]))
     btn_download_srt.on_click(lambda b: files.download(srt))
-    btn_download_segs.on_click(lambda b: [files.download(os.path.join("output_audio", f)) for f in sorted(os.listdir("output_audio")) if f.startswith("seg") and f.endswith(".mp3")])
+    btn_download_segs.on_click(lambda b: [files.download(f) for f in result["files"]])
 
 btn_generate.on_click(on_generate)
 
+# ==== Hàng đợi: job chạy bởi `python job_queue.py work`, không cần giữ notebook mở ====
+# Job mang cùng tùy chọn với nút tạo; cache, số luồng và req/s là cấu hình của worker
+# (--cache-mb, --workers, --per-key, --rate)
+def on_enqueue(b):
+    settings = {
+        "stability": slider_stability.value,
+        "similarity_boost": slider_similarity.value,
+        "style": slider_style.value,
+        "speed": slider_speed.value,
+        "optimize_streaming_latency": 4 if chk_boost.value else 0
+    }
+    queue = JobQueue("tts_jobs.db")
+    job_id = queue.submit(text_input.value, voice_id_input.value.strip(), model_dropdown.value, settings,
+                          priority=priority_input.value, maxlen=split_length.value, ssml=chk_ssml.value,
+                          stream=chk_stream.value, align=chk_align.value, lang=lang_dropdown.value,
+                          unit=subtitle_limit.value, balance=chk_balance.value, output_format=format_dropdown.value,
+                          incremental=chk_incremental.value, rebalance=chk_rebalance.value, hedge=hedge_input.value / 100)
+    counts = queue.counts()
+    dash.set_status(f"📥 Đã thêm job #{job_id} — đang chờ: {counts.get('queued', 0)}, đang chạy: {counts.get('running', 0)}")
+
+btn_enqueue.on_click(on_enqueue)
+
 # ==== Hiển thị giao diện ====
 display(api_input, voice_id_input, text_input, model_dropdown,
         slider_stability, slider_similarity, slider_style, slider_speed,
-        chk_boost, chk_ssml, split_length, subtitle_limit, lang_dropdown,
-        text_stats, btn_generate, btn_download_segs, btn_download_srt, btn_download_full)
+        chk_boost, chk_ssml, chk_stream, chk_align, chk_live, split_length, chk_balance, chk_rebalance, chk_incremental, format_dropdown, cache_mb, workers_input, per_key_input, rate_input, hedge_input, subtitle_limit, lang_dropdown,
+        dash.view, btn_generate, priority_input, btn_enqueue, btn_download_segs, btn_download_srt, btn_download_full)
@@ -1,198 +1,39 @@
-from IPython.display import display, HTML, clear_output, Audio
+from IPython.display import display, HTML, clear_output
 import ipywidgets as widgets
-import requests
 import os
-import re
-import zipfile
-from pydub import AudioSegment
 import traceback
-import base64
-from IPython.display import Javascript
-import time
-
-# ========================== #
-# 🔉 Hàm gọi API ElevenLabs
-# ========================== #
-def generate_voice(text, api_key, voice_id, model_version, stability=0.3, similarity=0.75, style=None, speed=None, speaker_boost=True):
-    # Xác định model dựa trên phiên bản đã chọn
-    models = {
-        "Zilankhulo zambiri v2": "eleven_multilingual_v2",
-        "Zilankhulo zambiri v2": "eleven_v3",
-        "Turbo v2.5": "eleven_turbo_v2"
-    }
-    model_id = models.get(model_version, "eleven_multilingual_v2")
-    
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {
-        "xi-api-key": api_key,
-        "Content-Type": "application/json"
-    }
-
-    voice_settings = {
-        "stability": float(stability),
-        "similarity_boost": float(similarity),
-        "use_speaker_boost": bool(speaker_boost)
-    }
-
-    if style is not None and 0.0 <= style <= 1.0:
-        voice_settings["style"] = float(style)
-    if speed is not None and 0.5 <= speed <= 2.0:
-        voice_settings["speed"] = float(speed)
-
-    payload = {
-        "text": text,
-        "model_id": model_id,
-        "voice_settings": voice_settings
-    }
-
-    try:
-        start_time = time.time()
-        response = requests.post(url, headers=headers, json=payload)
-        elapsed_time = time.time() - start_time
-        
-        if response.status_code != 200:
-            error_msg = f"Lỗi API ({response.status_code}): "
-            try:
-                error_data = response.json()
-                error_msg += error_data.get('detail', {}).get('message', 'Unknown error')
-            except:
-                error_msg += response.text[:200]
-            print(error_msg)
-            
-            if response.status_code == 401:
-                print("\n⚠️ QUAN TRỌNG: API key của bạn có thể đã bị chặn")
-                print("→ Giải pháp: Tạo API key mới hoặc nâng cấp tài khoản trả phí")
-            
-            return None
-            
-        print(f"✅ Tạo thành công trong {elapsed_time:.2f}s")
-        return response.content
-    except Exception as e:
-        print(f"Lỗi kết nối: {str(e)}")
-        return None
-
-# ========================== #
-# 📊 Lấy thông tin credits
-# ========================== #
-def get_credits(api_key):
-    try:
-        res = requests.get("https://api.elevenlabs.io/v1/user", headers={"xi-api-key": api_key})
-        if res.status_code == 200:
-            data = res.json().get("subscription", {})
-            return data.get("character_limit", 0) - data.get("character_count", 0)
-        else:
-            print(f"Lỗi khi lấy credit: {res.status_code} - {res.text[:200]}")
-            return None
-    except Exception as e:
-        print(f"Lỗi kết nối khi lấy credit: {str(e)}")
-        return None
-
-# ========================== #
-# 📝 Tự động tách đoạn < max_chars
-# ========================== #
-def split_text_to_blocks(text, max_chars=5000):
-    cleaned_text = re.sub(r'[^\w\s.,!?;:\'"-]', '', text.strip())
-    
-    sentences = re.split(r'(?<=[.!?])\s+', cleaned_text)
-    blocks = []
-    current_block = ""
-
-    for sentence in sentences:
-        if len(current_block) + len(sentence) + 1 <= max_chars:
-            current_block += sentence + " "
-        else:
-            if current_block:
-                blocks.append(current_block.strip())
-            current_block = sentence + " "
-    if current_block:
-        blocks.append(current_block.strip())
-    return blocks
-
-# ========================== #
-# 🗜️ Tạo file ZIP
-# ========================== #
-def create_zip(files, zip_filename="voices.zip"):
-    with zipfile.ZipFile(zip_filename, 'w') as zipf:
-        for file in files:
-            if os.path.exists(file):
-                zipf.write(file, os.path.basename(file))
-    return zip_filename
-
-# ========================== #
-# 🔊 Gộp file âm thanh
-# ========================== #
-def merge_audio_files(files, output_file="merged_voice.mp3"):
-    combined = AudioSegment.empty()
-    for file in files:
-        sound = AudioSegment.from_mp3(file)
-        combined += sound
-    combined.export(output_file, format="mp3")
-    return output_file
+import file_server
+from synth_cache import SynthCache
+import audio_formats
+import metrics
+from dashboard import Dashboard
+from key_health import CreditLedger
+from segment_planner import LatencyModel
+from tts_engine import run_voices
 
 # ========================== #
 # 🚀 Chạy xử lý
 # ========================== #
-def run_tool(api_keys, voice_id, model_version, text_raw, st, sm, sty, spd, boost, max_chars):
-    api_keys = [key.strip() for key in api_keys.splitlines() if key.strip()]
-    voice_id = voice_id.strip()
-    text_raw = text_raw.strip()
-    
-    if not api_keys or not voice_id or not text_raw:
-        print("❌ Vui lòng nhập đầy đủ thông tin")
-        return None
-    
-    print("🔐 Tín dụng còn lại:")
-    credit_list = []
-    for key in api_keys:
-        r = get_credits(key)
-        if r is None:
-            print(f"- {key[:6]}...: lỗi")
-        else:
-            print(f"- {key[:6]}...: {r}")
-        credit_list.append((key, r))
-
-    texts = split_text_to_blocks(text_raw, max_chars)
-    print(f"\n📄 Phát hiện {len(texts)} đoạn văn cần xử lý.")
-    
-    # Hiển thị thông tin phiên bản đã chọn
-    model_info = {
-        "Zilankhulo zambiri v2": "Đa ngôn ngữ, chất lượng cao",
-        "Flash v2.5": "Tốc độ cực nhanh, độ trễ thấp",
-        "Turbo v2.5": "Cân bằng giữa tốc độ và chất lượng"
-    }
-    print(f"⚡ Phiên bản: {model_version} - {model_info[model_version]}\n")
-    
-    os.makedirs("voices", exist_ok=True)
-    generated_files = []
-
-    for i, text in enumerate(texts):
-        used = False
-        print(f"⏳ Đang xử lý đoạn {i+1}/{len(texts)}...")
-        for key, r in credit_list:
-            if r is None or r <= 0:
-                continue
-                
-            print(f"  Sử dụng API key: {key[:6]}...")
-            audio = generate_voice(text, key, voice_id, model_version, st, sm, sty, spd, boost)
-            
-            if audio:
-                fname = f"voices/voice_{i+1}.mp3"
-                with open(fname, "wb") as f:
-                    f.write(audio)
-                print(f"✅ Đoạn {i+1} tạo thành công!")
-                display(Audio(fname))
-                generated_files.append(fname)
-                used = True
-                break
-                
-        if not used:
-            print(f"❌ Đoạn {i+1} lỗi: không có API hoạt động hoặc tạo thất bại.")
-            print("  → Gợi ý khắc phục:")
-            print("    1. Kiểm tra lại Voice ID")
-            print("    2. Giảm Stability/Similarity")
-            print("    3. Tạo API key mới hoặc nâng cấp tài khoản")
-    
-    return generated_files
+# Tiến độ, log và trình phát đoạn mới nhất đều hiển thị trong dashboard (một widget)
+def run_tool(api_keys, voice_id, model_version, text_raw, st, sm, sty, spd, boost, max_chars, workers=4, per_key=2, stream=False, cache=None, rate=None, zip_filename="voices.zip", merged_filename="merged_voice.mp3", balance=True, latency=None,
+             output_format=None, hedge=0, live=False, rebalance=False):
+    texts = []
+
+    def on_plan(items):
+        texts[:] = items
+        dash.plan(items)
+
+    def on_segment(i, fname):
+        if cache:
+            dash.note = cache.summary()
+        dash.segment(i, texts[i] if i < len(texts) else "", fname, output_format)
+
+    return run_voices(api_keys, voice_id, model_version, text_raw, st, sm, sty, spd, boost, max_chars,
+                      workers=workers, per_key=per_key, stream=stream, cache=cache, rate=rate,
+                      zip_filename=zip_filename, merged_filename=merged_filename, balance=balance, latency=latency,
+                      log=dash.log, on_plan=on_plan, on_segment=on_segment, on_keys=dash.keys,
+                      output_format=output_format, ledger=CreditLedger("tts_credit_ledger.json"), hedge=hedge,
+                      live=live, on_live=dash.live_stream, rebalance=rebalance)
 
 # ========================== #
 # 🎨 Tạo giao diện đẹp
@@ -492,6 +333,70 @@ max_chars = widgets.IntText(
     style={'description_width': 'initial'}
 )
 
+workers_input = widgets.IntText(
+    value=4,
+    description="Số luồng tổng:",
+    style={'description_width': 'initial'}
+)
+
+per_key_input = widgets.IntText(
+    value=2,
+    description="Số luồng mỗi key:",
+    style={'description_width': 'initial'}
+)
+
+rate_input = widgets.FloatText(
+    value=0,
+    description="Req/s mỗi key (0 = không giới hạn):",
+    style={'description_width': 'initial'}
+)
+
+hedge_input = widgets.FloatText(
+    value=0,
+    description="Gửi thêm cho đoạn chậm (% ký tự, 0 = tắt):",
+    style={'description_width': 'initial'}
+)
+
+cache_mb = widgets.IntText(
+    value=2048,
+    description="Cache (MB):",
+    style={'description_width': 'initial'}
+)
+
+# Một widget duy nhất cho tiến độ, tốc độ, ETA, credit, log và bảng số liệu
+dash = Dashboard()
+
+stream_chk = widgets.Checkbox(
+    value=False,
+    description='Streaming (ghi dần ra file)',
+    style={'description_width': 'initial'}
+)
+
+live_chk = widgets.Checkbox(
+    value=False,
+    description='Nghe dần trong lúc tạo (MP3/PCM)',
+    style={'description_width': 'initial'}
+)
+
+format_dropdown = widgets.Dropdown(
+    options=audio_formats.CHOICES,
+    value=audio_formats.DEFAULT_FORMAT,
+    description="Định dạng:",
+    style={'description_width': 'initial'}
+)
+
+balance_chk = widgets.Checkbox(
+    value=True,
+    description='Chia đoạn cân bằng theo số luồng',
+    style={'description_width': 'initial'}
+)
+
+rebalance_chk = widgets.Checkbox(
+    value=False,
+    description='Chạy tiếp: chia lại đoạn theo số key/luồng mới (tạo lại đoạn bị đổi ranh giới)',
+    style={'description_width': 'initial'}
+)
+
 # Tạo nút bấm
 run_btn = widgets.Button(
     description="🎧 Tạo giọng nói",
@@ -515,12 +420,11 @@ selected_model = widgets.RadioButtons(
 )
 
 # Hàm tải file bằng JavaScript
+# Link tới máy chủ file cục bộ, file được đọc từ đĩa theo từng khối khi tải
 def create_download_link(filename):
-    with open(filename, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    
+    url = file_server.file_url(filename)
     display(HTML(
-        f'<a class="download-link" href="data:application/octet-stream;base64,{b64}" download="{filename}">'
+        f'<a class="download-link" href="{url}" target="_blank" download="{os.path.basename(filename)}">'
         f'📥 Tải file {os.path.basename(filename)}'
         '</a>'
     ))
@@ -530,23 +434,12 @@ def on_run_click(b):
     with output:
         clear_output()
         try:
-            # Tạo thanh tiến trình
-            progress_html = """
-            <div class="progress-container">
-                <div class="progress-bar" id="progress-bar" style="width: 0%"></div>
-            </div>
-            <div class="status-text" id="status-text">Đang chuẩn bị...</div>
-            """
-            display(HTML(progress_html))
-            
-            # Hàm cập nhật tiến trình
-            def update_progress(percent, message):
-                display(Javascript(f"""
-                    document.getElementById('progress-bar').style.width = '{percent}%';
-                    document.getElementById('status-text').innerText = '{message}';
-                """))
-            
-            update_progress(10, "Đang kiểm tra API keys...")
+            # Số liệu của job này: bảng trực tiếp trong dashboard, sự kiện ghi nối vào tts_metrics.jsonl
+            metrics.REGISTRY.reset()
+            metrics.REGISTRY.events_path = "tts_metrics.jsonl"
+            dash.reset()
+            dash.set_status("Đang kiểm tra API keys...")
+            cache = SynthCache("tts_cache", max_bytes=cache_mb.value * 1024 * 1024)
             generated_files = run_tool(
                 api_input.value,
                 voice_input.value,
@@ -557,29 +450,44 @@ def on_run_click(b):
                 sty=style_slider.value,
                 spd=speed.value,
                 boost=boost.value,
-                max_chars=max_chars.value
+                max_chars=max_chars.value,
+                workers=workers_input.value,
+                per_key=per_key_input.value,
+                stream=stream_chk.value,
+                cache=cache,
+                rate=rate_input.value or None,
+                zip_filename="voices.zip",
+                merged_filename="merged_voice.mp3",
+                balance=balance_chk.value,
+                rebalance=rebalance_chk.value,
+                latency=LatencyModel("tts_latency.json"),
+                output_format=format_dropdown.value,
+                hedge=hedge_input.value / 100,
+                live=live_chk.value
             )
+            dash.note = cache.summary()
+            metrics.REGISTRY.write_prometheus("tts_metrics.prom")
             
-            update_progress(80, "Đang tạo file kết quả...")
+            dash.set_status("Đang tạo file kết quả...")
             # Hiển thị nút tải về nếu có file được tạo
             if generated_files:
-                # Tạo file ZIP
-                zip_file = create_zip(generated_files)
+                # File ZIP đã được ghi dần trong run_tool
+                zip_file = "voices.zip"
                 
-                # Tạo file gộp nếu có nhiều file
-                if len(generated_files) > 1:
-                    merged_file = merge_audio_files(generated_files)
+                # File gộp cũng đã được nối dần trong run_tool
+                merged_file = "merged_voice" + audio_formats.final_extension(format_dropdown.value)
                 
                 with download_container:
                     clear_output()
                     # Hiển thị nút tải về
                     display(widgets.HTML("<div class='download-title'>TẢI KẾT QUẢ:</div>"))
                     
-                    # Tạo liên kết tải file ZIP
-                    create_download_link(zip_file)
+                    # Tạo liên kết tải file ZIP (không có nếu ZIP lỗi hoặc không đoạn nào vào được)
+                    if os.path.exists(zip_file):
+                        create_download_link(zip_file)
                     
                     # Tạo liên kết tải file gộp nếu có
-                    if len(generated_files) > 1:
+                    if len(generated_files) > 1 and os.path.exists(merged_file):
                         create_download_link(merged_file)
                     
                     # Hướng dẫn thêm
@@ -590,13 +498,15 @@ def on_run_click(b):
                         "</div>"
                     ))
             
-            update_progress(100, "Hoàn thành!")
+            if generated_files and len(generated_files) > 1 and os.path.exists(merged_file):
+                dash.play(merged_file, f"File gộp: {merged_file}")
+            dash.set_status("Hoàn thành!" if generated_files else "Không tạo được đoạn nào", 100)
             
         except Exception as e:
             print("❌ Lỗi xảy ra:", e)
             import traceback
             traceback.print_exc()
-            update_progress(0, "Đã xảy ra lỗi!")
+            dash.set_status("Đã xảy ra lỗi!", 0)
 
 # Gán sự kiện cho nút run_btn
 run_btn.on_click(on_run_click)
@@ -699,6 +609,16 @@ main_container = widgets.VBox([
     speed,
     boost,
     max_chars,
+    balance_chk,
+    rebalance_chk,
+    workers_input,
+    per_key_input,
+    rate_input,
+    hedge_input,
+    stream_chk,
+    live_chk,
+    format_dropdown,
+    cache_mb,
     widgets.HTML("""
             </div>
         </div>
@@ -726,6 +646,7 @@ main_container = widgets.VBox([
     run_btn,
     
     # Khu vực kết quả
+    dash.view,
     output,
     
     # Khu vực tải về
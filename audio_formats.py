@@ -0,0 +1,281 @@
+# ========================== #
+# 🎚️ Định dạng âm thanh trả về từ API
+# ========================== #
+# output_format của ElevenLabs: MP3 nhiều bitrate, Opus (Ogg) và PCM 16-bit mono.
+# Với PCM, thời lượng chỉ là số byte chia cho tốc độ mẫu, nối file là chép byte từ
+# mmap vào một WAV, rồi mã hóa một lần duy nhất ở cuối (ffmpeg nếu có).
+# Bitrate thấp hơn thì mỗi đoạn nhẹ hơn, đỡ băng thông khi tải nhiều đoạn song song.
+import io
+import mmap
+import os
+import shutil
+import subprocess
+import wave
+import zlib
+
+from mp3_tools import duration_of as mp3_duration_of, Mp3Concat
+
+DEFAULT_FORMAT = "mp3_44100_128"
+FORMATS = (
+    "mp3_22050_32", "mp3_44100_64", "mp3_44100_96", "mp3_44100_128", "mp3_44100_192",
+    "opus_48000_32", "opus_48000_64", "opus_48000_96", "opus_48000_128",
+    "pcm_16000", "pcm_22050", "pcm_24000", "pcm_44100",
+)
+# (nhãn, giá trị) cho Dropdown của app3/app4
+CHOICES = [
+    ("MP3 128 kbps (mặc định)", "mp3_44100_128"),
+    ("MP3 192 kbps", "mp3_44100_192"),
+    ("MP3 96 kbps", "mp3_44100_96"),
+    ("MP3 64 kbps (nhẹ)", "mp3_44100_64"),
+    ("MP3 32 kbps / 22 kHz (rất nhẹ)", "mp3_22050_32"),
+    ("Opus 64 kbps", "opus_48000_64"),
+    ("Opus 32 kbps (rất nhẹ)", "opus_48000_32"),
+    ("PCM 24 kHz (nối nhanh, mã hóa 1 lần cuối)", "pcm_24000"),
+    ("PCM 44.1 kHz", "pcm_44100"),
+]
+
+
+def codec(fmt):
+    return (fmt or DEFAULT_FORMAT).split("_", 1)[0]
+
+
+# Phần mở rộng của file từng đoạn
+def extension(fmt):
+    return {"mp3": ".mp3", "opus": ".opus", "pcm": ".pcm"}[codec(fmt)]
+
+
+# Phần mở rộng của file gộp: PCM được gói thành WAV trước khi mã hóa
+def merged_extension(fmt):
+    return ".wav" if codec(fmt) == "pcm" else extension(fmt)
+
+
+# Phần mở rộng của file gộp cuối cùng, sau bước mã hóa một lần (xem encode_final)
+def final_extension(fmt):
+    if codec(fmt) == "pcm":
+        return ".mp3" if shutil.which("ffmpeg") else ".wav"
+    return extension(fmt)
+
+
+def pcm_rate(fmt):
+    return int(fmt.split("_")[1]) if codec(fmt) == "pcm" else None
+
+
+# Tham số query gửi kèm request; None giữ mặc định của API (MP3 128 kbps)
+def request_params(fmt):
+    return {"output_format": fmt} if fmt and fmt != DEFAULT_FORMAT else None
+
+
+# ========================== #
+# ⏱️ Thời lượng
+# ========================== #
+# Opus: granule position của trang Ogg cuối (mẫu 48 kHz) trừ pre-skip trong OpusHead
+def opus_duration(path):
+    if os.path.getsize(path) == 0:
+        return 0.0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        head = buf.find(b"OpusHead")
+        last = buf.rfind(b"OggS")
+        if head < 0 or last < 0:
+            return 0.0
+        pre_skip = int.from_bytes(buf[head + 10:head + 12], "little")
+        granule = int.from_bytes(buf[last + 6:last + 14], "little", signed=True)
+    return max(0, granule - pre_skip) / 48000
+
+
+def duration(path, fmt=None):
+    kind = codec(fmt)
+    if kind == "pcm":
+        return os.path.getsize(path) / (2 * pcm_rate(fmt))
+    if kind == "opus":
+        return opus_duration(path)
+    return mp3_duration_of(path)
+
+
+# ========================== #
+# 🔗 Nối file theo định dạng
+# ========================== #
+# PCM thô -> một WAV duy nhất, chép thẳng byte qua mmap
+class PcmConcat:
+    def __init__(self, output_file, rate):
+        self.output_file = output_file
+        self.out = wave.open(output_file, "wb")
+        self.out.setnchannels(1)
+        self.out.setsampwidth(2)
+        self.out.setframerate(rate)
+
+    def append(self, path):
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            view = memoryview(buf)[:len(buf) - len(buf) % 2]
+            try:
+                self.out.writeframesraw(view)
+            finally:
+                view.release()
+
+    def close(self):
+        self.out.close()
+        return self.output_file
+
+    def discard(self):
+        self.out.close()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+# CRC của trang Ogg: CRC-32 đa thức 0x04C11DB7 không đảo bit, khởi tạo 0, không XOR cuối.
+# zlib.crc32 dùng cùng đa thức ở dạng đảo bit, nên đảo bit từng byte đầu vào và đảo
+# 32 bit kết quả là ra cùng giá trị, nhưng chạy bằng C thay vì vòng lặp Python từng byte.
+_BITREV = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def ogg_crc(data):
+    crc = zlib.crc32(data.translate(_BITREV), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+# Số mẫu 48 kHz của một gói Opus, đọc từ byte TOC (RFC 6716 mục 3.1)
+def opus_packet_samples(head):
+    if not head:
+        return 0
+    toc = head[0]
+    config = toc >> 3
+    if config < 12:
+        size = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        size = (480, 960)[config % 2]
+    else:
+        size = (120, 240, 480, 960)[config % 4]
+    code = toc & 3
+    frames = 1 if code == 0 else 2 if code < 3 else (head[1] & 0x3F if len(head) > 1 else 0)
+    return size * frames
+
+
+# Ogg Opus -> một luồng logic duy nhất (không phải chuỗi Ogg nối tiếp, vốn nhiều trình phát
+# chỉ phát link đầu). Giữ OpusHead/OpusTags của file đầu, bỏ header của các file sau, đánh
+# lại serial, số thứ tự trang và granule position theo số mẫu của từng gói; phần đệm cuối
+# chỉ được cắt ở trang cuối cùng (EOS). Pre-skip và phần đệm của các đoạn giữa được phát
+# (vài ms). Không giải mã/mã hóa lại.
+class OggConcat:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.out = open(output_file, "wb")
+        self.serial = zlib.crc32(os.path.basename(output_file).encode("utf-8"))
+        self.seq = 0
+        self.granule = 0        # số mẫu 48 kHz đã ghi, kể cả pre-skip
+        self.trim = 0           # mẫu đệm ở cuối file vừa nối
+        self.pending = None     # trang cuối đã đọc, chờ biết có phải trang cuối của cả luồng
+
+    def _emit(self, page, granule):
+        page = bytearray(page)
+        page[5] = (page[5] & 0x01) | (0x02 if self.seq == 0 else 0)
+        page[6:14] = granule.to_bytes(8, "little", signed=True)
+        page[14:18] = self.serial.to_bytes(4, "little")
+        page[18:22] = self.seq.to_bytes(4, "little")
+        self.seq += 1
+        if self.pending:
+            self._write(self.pending)
+        self.pending = page
+
+    def _write(self, page):
+        page[22:26] = bytes(4)
+        page[22:26] = ogg_crc(page).to_bytes(4, "little")
+        self.out.write(page)
+
+    def append(self, path):
+        if os.path.getsize(path) == 0:
+            return
+        headers, head, samples, last = 0, b"", 0, 0
+        keep_headers = self.seq == 0
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = buf.find(b"OggS")
+            while 0 <= pos and pos + 27 <= len(buf):
+                nseg = buf[pos + 26]
+                lacing = buf[pos + 27:pos + 27 + nseg]
+                size = 27 + nseg + sum(lacing)
+                # Gói âm thanh đầu tiên luôn bắt đầu ở trang mới (RFC 7845), nên trang header chỉ chứa header
+                header_page = headers < 2
+                off, ended = pos + 27 + nseg, False
+                for lv in lacing:
+                    if len(head) < 2:
+                        head += buf[off:off + min(lv, 2 - len(head))]
+                    off += lv
+                    if lv < 255:
+                        if headers < 2:
+                            headers += 1
+                        else:
+                            n = opus_packet_samples(head)
+                            samples += n
+                            self.granule += n
+                            ended = True
+                        head = b""
+                if header_page:
+                    if keep_headers:
+                        self._emit(buf[pos:pos + size], 0)
+                else:
+                    granule = int.from_bytes(buf[pos + 6:pos + 14], "little", signed=True)
+                    if granule >= 0:
+                        last = granule
+                    self._emit(buf[pos:pos + size], self.granule if ended else -1)
+                pos += size
+        self.trim = max(0, samples - last)
+
+    def close(self):
+        if self.pending:
+            page = self.pending
+            page[5] |= 0x04
+            if int.from_bytes(page[6:14], "little", signed=True) >= 0:
+                page[6:14] = (self.granule - self.trim).to_bytes(8, "little", signed=True)
+            self._write(page)
+            self.pending = None
+        self.out.close()
+        return self.output_file
+
+    def discard(self):
+        self.out.close()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+def open_concat(fmt, output_file):
+    kind = codec(fmt)
+    if kind == "pcm":
+        return PcmConcat(output_file, pcm_rate(fmt))
+    if kind == "opus":
+        return OggConcat(output_file)
+    return Mp3Concat(output_file)
+
+
+# ========================== #
+# 🎛️ Mã hóa một lần ở cuối
+# ========================== #
+# WAV gộp từ PCM -> MP3 bằng ffmpeg (một lần cho cả job). Trả về file MP3, hoặc
+# giữ nguyên WAV nếu máy không có ffmpeg / mã hóa lỗi.
+def encode_final(path, bitrate="128k", log=print):
+    if not path or not path.endswith(".wav"):
+        return path
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        log("ℹ️ Không có ffmpeg, giữ file gộp dạng WAV")
+        return path
+    target = os.path.splitext(path)[0] + ".mp3"
+    r = subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-i", path, "-codec:a", "libmp3lame", "-b:a", bitrate, target],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if r.returncode != 0:
+        log(f"❌ Lỗi mã hóa MP3: {r.stderr.decode('utf-8', 'replace')[-200:]}")
+        return path
+    os.remove(path)
+    return target
+
+
+# File/bytes để nghe thử một đoạn: PCM thô được bọc header WAV trong bộ nhớ
+def preview(path, fmt=None):
+    if codec(fmt) != "pcm":
+        return path
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w, open(path, "rb") as f:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(pcm_rate(fmt))
+        w.writeframes(f.read())
+    return out.getvalue()
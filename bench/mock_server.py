@@ -0,0 +1,305 @@
+# ========================== #
+# 🧪 Server giả lập ElevenLabs để đo hiệu năng
+# ========================== #
+# Trả lời /v1/user, HEAD /v1/models và /v1/text-to-speech/{voice_id}
+# (kể cả /stream, /with-timestamps, /stream/with-timestamps) bằng âm thanh tổng hợp
+# theo ?output_format= (MP3 các bitrate, Ogg Opus, PCM 16-bit), với độ trễ, băng thông
+# và tỉ lệ lỗi 429/5xx, tỉ lệ request treo lâu (--p-slow/--slow) điều chỉnh được. Key bắt đầu bằng "revoked" luôn bị trả 401.
+#   python bench/mock_server.py --port 8765 --latency 0.3 --p429 0.05
+# In ra "MOCK_URL http://127.0.0.1:PORT" khi sẵn sàng.
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECONDS_PER_CHAR = 0.065        # ~15 ký tự/giây giọng đọc
+DEFAULT_FORMAT = "mp3_44100_128"
+REVOKED = "revoked"             # tiền tố key giả lập bị thu hồi
+_MP3_KBPS = {1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+             2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]}
+_MP3_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000]}
+
+
+# Frame MPEG Layer III rỗng: (bytes, số giây mỗi frame)
+def mp3_frame(rate=44100, kbps=128):
+    version = 1 if rate in _MP3_RATES[1] else 2
+    b1 = 0xFB if version == 1 else 0xF3
+    b2 = _MP3_KBPS[version].index(kbps) << 4 | _MP3_RATES[version].index(rate) << 2
+    samples = 1152 if version == 1 else 576
+    length = samples // 8 * kbps * 1000 // rate
+    return bytes([0xFF, b1, b2, 0x44]) + bytes(length - 4), samples / rate
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else r << 1
+        table.append(r & 0xFFFFFFFF)
+    return table
+
+
+_CRC = _crc_table()
+
+
+def _ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC[(crc >> 24) ^ byte]
+    return crc
+
+
+def _ogg_page(serial, seq, granule, packets, flags=0):
+    lacing = b"".join(bytes([255] * (len(p) // 255) + [len(p) % 255]) for p in packets)
+    page = bytearray(b"OggS" + bytes([0, flags]) + granule.to_bytes(8, "little") + serial.to_bytes(4, "little")
+                     + seq.to_bytes(4, "little") + bytes(4) + bytes([len(lacing)]) + lacing + b"".join(packets))
+    page[22:26] = _ogg_crc(page).to_bytes(4, "little")
+    return bytes(page)
+
+
+# Ogg Opus mono: OpusHead, OpusTags rồi mỗi trang 1 giây gồm 50 packet 20 ms
+def synthetic_opus(seconds, kbps=64, pre_skip=312):
+    serial = 0x5EED
+    head = b"OpusHead" + bytes([1, 1]) + pre_skip.to_bytes(2, "little") + (48000).to_bytes(4, "little") + bytes(3)
+    tags = b"OpusTags" + (4).to_bytes(4, "little") + b"mock" + bytes(4)
+    pages = [_ogg_page(serial, 0, 0, [head], flags=2), _ogg_page(serial, 1, 0, [tags])]
+    packet = b"\x08" + bytes(max(1, kbps * 1000 // 8 // 50 - 1))
+    total = max(1, math.ceil(seconds * 50))
+    for k in range(0, total, 50):
+        n = min(50, total - k)
+        last = k + n >= total
+        pages.append(_ogg_page(serial, len(pages), pre_skip + (k + n) * 960, [packet] * n, flags=4 if last else 0))
+    return b"".join(pages)
+
+
+# Âm thanh cho `chars` ký tự theo output_format, trả về (bytes, thời lượng giây)
+def synthetic_audio(chars, fmt=None):
+    seconds = chars * SECONDS_PER_CHAR
+    parts = (fmt or DEFAULT_FORMAT).split("_")
+    if parts[0] == "pcm":
+        rate = int(parts[1])
+        samples = max(1, int(rate * seconds))
+        return bytes(2 * samples), samples / rate
+    if parts[0] == "opus":
+        audio = synthetic_opus(seconds, int(parts[2]))
+        return audio, max(1, math.ceil(seconds * 50)) / 50
+    rate, kbps = int(parts[1]), int(parts[2])
+    frame, frame_seconds = mp3_frame(rate, kbps)
+    frames = max(1, math.ceil(seconds / frame_seconds))
+    return frame * frames, frames * frame_seconds
+
+
+# Thời gian từng ký tự trải đều trên thời lượng đoạn âm thanh
+def synthetic_alignment(text, duration):
+    step = duration / max(1, len(text))
+    return {"characters": list(text),
+            "character_start_times_seconds": [round(i * step, 3) for i in range(len(text))],
+            "character_end_times_seconds": [round((i + 1) * step, 3) for i in range(len(text))]}
+
+
+class MockConfig:
+    def __init__(self, latency=0.3, per_char=0.002, throughput=2_000_000, p429=0.0, p5xx=0.0,
+                 retry_after=1.0, credit=10_000_000, seed=None, p_slow=0.0, slow=0.0):
+        self.latency = latency          # giây trước byte đầu tiên
+        self.per_char = per_char        # giây thêm cho mỗi ký tự
+        self.throughput = throughput    # byte/giây khi gửi thân response (0 = không giới hạn)
+        self.p429 = p429
+        self.p5xx = p5xx
+        self.retry_after = retry_after
+        self.p_slow = p_slow            # tỉ lệ request rơi vào node chậm, chờ thêm slow giây
+        self.slow = slow
+        self.credit = credit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.used = {}                  # api key -> số ký tự đã dùng
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"requests": 0, "chars": 0, "bytes": 0, "status": {}}
+
+    def count(self, status, chars=0, size=0):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["chars"] += chars
+            self.stats["bytes"] += size
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+
+    def roll(self):
+        with self.lock:
+            x = self.random.random()
+        if x < self.p429:
+            return 429
+        if x < self.p429 + self.p5xx:
+            return 503
+        return 200
+
+    def stall(self):
+        with self.lock:
+            x = self.random.random()
+        return self.slow if x < self.p_slow else 0.0
+
+
+def make_handler(cfg):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="application/json", headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self._write(body)
+
+        # Gửi thân response theo từng khối với tốc độ cfg.throughput
+        def _write(self, body, chunk=16384):
+            start = time.time()
+            for k in range(0, len(body), chunk):
+                try:
+                    self.wfile.write(body[k:k + chunk])
+                except (BrokenPipeError, ConnectionResetError):
+                    return          # client đã hủy request (ví dụ bản thua của hedging)
+                if cfg.throughput:
+                    ahead = (k + chunk) / cfg.throughput - (time.time() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        def _json(self, status, data, headers=None):
+            self._send(status, json.dumps(data).encode("utf-8"), headers=headers)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == "/_stats":
+                with cfg.lock:
+                    return self._json(200, cfg.stats)
+            if self.path == "/v1/user":
+                key = self.headers.get("xi-api-key", "")
+                if key.startswith(REVOKED):
+                    return self._json(401, {"detail": {"message": "invalid_api_key"}})
+                with cfg.lock:
+                    used = cfg.used.get(key, 0)
+                return self._json(200, {"subscription": {"character_limit": cfg.credit, "character_count": used}})
+            self._json(404, {"detail": {"message": "not found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path == "/_reset":
+                cfg.reset()
+                return self._json(200, {})
+            url = urlsplit(self.path)
+            fmt = parse_qs(url.query).get("output_format", [DEFAULT_FORMAT])[0]
+            m = re.match(r"^/v1/text-to-speech/[^/]+(/stream)?(/with-timestamps)?$", url.path)
+            if not m:
+                return self._json(404, {"detail": {"message": "not found"}})
+            stream, timestamps = bool(m.group(1)), bool(m.group(2))
+            text = json.loads(body or b"{}").get("text", "")
+            key = self.headers.get("xi-api-key", "")
+            if key.startswith(REVOKED):
+                cfg.count(401)
+                return self._json(401, {"detail": {"message": "invalid_api_key"}})
+            status = cfg.roll()
+            time.sleep(cfg.latency + cfg.per_char * len(text) + cfg.stall())
+            if status == 429:
+                cfg.count(429)
+                return self._json(429, {"detail": {"message": "too_many_concurrent_requests"}},
+                                  {"Retry-After": str(cfg.retry_after)})
+            if status != 200:
+                cfg.count(status)
+                return self._json(status, {"detail": {"message": "service unavailable"}})
+            with cfg.lock:
+                used = cfg.used.get(key, 0)
+                if used + len(text) > cfg.credit:
+                    status = 401
+                else:
+                    cfg.used[key] = used + len(text)
+            if status == 401:
+                cfg.count(401)
+                return self._json(401, {"detail": {"message": "quota_exceeded"}})
+            try:
+                audio, duration = synthetic_audio(len(text), fmt)
+            except (ValueError, IndexError):
+                cfg.count(400)
+                return self._json(400, {"detail": {"message": f"invalid output_format {fmt}"}})
+            if timestamps and stream:
+                out = self._ndjson(text, audio, duration)
+                ctype = "application/x-ndjson"
+            elif timestamps:
+                out = json.dumps({"audio_base64": base64.b64encode(audio).decode(),
+                                  "alignment": synthetic_alignment(text, duration)}).encode("utf-8")
+                ctype = "application/json"
+            else:
+                out = audio
+                ctype = {"pcm": "audio/pcm", "opus": "audio/ogg"}.get(fmt.split("_")[0], "audio/mpeg")
+            cfg.count(200, len(text), len(out))
+            self._send(200, out, ctype)
+
+        # Mỗi dòng NDJSON mang một phần âm thanh và alignment của các ký tự tương ứng
+        def _ndjson(self, text, audio, duration, parts=4):
+            align = synthetic_alignment(text, duration)
+            lines = []
+            for p in range(parts):
+                a0, a1 = len(audio) * p // parts, len(audio) * (p + 1) // parts
+                c0, c1 = len(text) * p // parts, len(text) * (p + 1) // parts
+                lines.append(json.dumps({
+                    "audio_base64": base64.b64encode(audio[a0:a1]).decode(),
+                    "alignment": {k: v[c0:c1] for k, v in align.items()},
+                }))
+            return ("\n".join(lines) + "\n").encode("utf-8")
+
+    return Handler
+
+
+def start(port=0, **config):
+    cfg = MockConfig(**config)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.3, help="giây trước byte đầu tiên")
+    parser.add_argument("--per-char", type=float, default=0.002, help="giây thêm mỗi ký tự")
+    parser.add_argument("--throughput", type=float, default=2_000_000, help="byte/giây, 0 = không giới hạn")
+    parser.add_argument("--p429", type=float, default=0.0, help="tỉ lệ trả 429")
+    parser.add_argument("--p5xx", type=float, default=0.0, help="tỉ lệ trả 503")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--credit", type=int, default=10_000_000, help="credit mỗi key")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--p-slow", type=float, default=0.0, help="tỉ lệ request bị treo thêm --slow giây")
+    parser.add_argument("--slow", type=float, default=0.0)
+
+
+def config_from(args):
+    return dict(latency=args.latency, per_char=args.per_char, throughput=args.throughput, p429=args.p429,
+                p5xx=args.p5xx, retry_after=args.retry_after, credit=args.credit, seed=args.seed,
+                p_slow=args.p_slow, slow=args.slow)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server giả lập ElevenLabs")
+    parser.add_argument("--port", type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, url = start(args.port, **config_from(args))
+    print(f"MOCK_URL {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,184 @@
+# ========================== #
+# 📈 Đo hiệu năng cả job trên server giả lập
+# ========================== #
+# Chạy pipeline của app3 (tts_engine.run_job) và app4 (tts_engine.run_voices) từ đầu
+# đến cuối với bench/mock_server.py, mỗi pipeline trong một tiến trình riêng để đo
+# peak RSS sạch. Báo cáo số đoạn/giây, p50/p95/p99 độ trễ request, peak RSS và thời
+# gian hậu xử lý còn lại sau khi đoạn cuối xong, cùng số MB server đã gửi.
+#   python bench/run_bench.py --pipeline both --segments 40 --workers 8 --p429 0.05
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import mock_server  # noqa: E402
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua").split()
+
+
+def make_text(chars, seed=0):
+    rnd = random.Random(seed)
+    out, size = [], 0
+    while size < chars:
+        s = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 24))).capitalize() + rnd.choice(".!?")
+        out.append(s)
+        size += len(s) + 1
+    return " ".join(out)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def _mock(url, path, method="GET"):
+    import urllib.request
+    req = urllib.request.Request(url + path, data=b"" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(req) as r:
+        return json.loads(r.read() or b"{}")
+
+
+# Chạy một pipeline trong tiến trình hiện tại, trả về dict kết quả. Thư mục làm việc
+# (file đoạn, file gộp) bị xóa sau khi đo, trừ khi có --keep.
+def run_one(args):
+    work = tempfile.mkdtemp(prefix=f"bench-{args.worker}-")
+    try:
+        return _measure(args, work)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def _measure(args, work):
+    os.environ["ELEVENLABS_API_BASE"] = args.url
+    from segment_planner import LatencyModel
+    from tts_engine import run_job, run_voices
+
+    keys = [f"bench-key-{k}" for k in range(args.keys)]
+    text = make_text(args.segments * args.maxlen, args.seed or 0)
+    latency = LatencyModel(os.path.join(work, "latency.json"), keep=10 ** 9)
+    quiet = lambda *a: None
+    done_at = []
+
+    t0 = time.time()
+    if args.worker == "app3":
+        settings = {"stability": 0.3, "similarity_boost": 0.75, "style": 0.0, "speed": 1.0,
+                    "optimize_streaming_latency": 0}
+        result = run_job(text, keys, "bench-voice", "eleven_flash_v2_5", settings,
+                         folder=os.path.join(work, "output_audio"), maxlen=args.maxlen, stream=args.stream,
+                         align=not args.no_align, workers=args.workers, per_key=args.per_key,
+                         balance=not args.no_balance, latency=latency, log=quiet, output_format=args.format,
+                         hedge=args.hedge,
+                         on_segment=lambda *a: done_at.append(time.time()))
+        segments, ok = len(result["paragraphs"]), result["ok"]
+    else:
+        files = run_voices("\n".join(keys), "bench-voice", "Flash v2.5", text, 0.3, 0.75, 0.0, 1.0, True,
+                           args.maxlen, workers=args.workers, per_key=args.per_key, stream=args.stream,
+                           zip_filename=os.path.join(work, "voices.zip"),
+                           merged_filename=os.path.join(work, "merged_voice.mp3"),
+                           balance=not args.no_balance, latency=latency, folder=os.path.join(work, "voices"),
+                           log=quiet, on_segment=lambda *a: done_at.append(time.time()), output_format=args.format,
+                           hedge=args.hedge)
+        segments, ok = len(files or []), bool(files)
+    end = time.time()
+    wall = end - t0
+
+    samples = [s for rows in latency.samples.values() for _, s in rows]
+    return {
+        "pipeline": args.worker,
+        "ok": ok,
+        "segments": segments,
+        "wall_s": round(wall, 3),
+        "segments_per_s": round(segments / wall, 3) if wall else None,
+        "p50_s": percentile(samples, 50),
+        "p95_s": percentile(samples, 95),
+        "p99_s": percentile(samples, 99),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # Phần hậu xử lý không chồng lên tổng hợp: từ lúc đoạn cuối xong đến khi job trả về
+        "post_s": round(end - done_at[-1], 3) if done_at else None,
+        "work_dir": work if args.keep else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline tạo giọng nói trên server giả lập")
+    parser.add_argument("--pipeline", choices=("app3", "app4", "both"), default="both")
+    parser.add_argument("--segments", type=int, default=20, help="số đoạn xấp xỉ (văn bản dài segments * maxlen)")
+    parser.add_argument("--maxlen", type=int, default=500)
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--per-key", type=int, default=2)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--no-align", action="store_true")
+    parser.add_argument("--no-balance", action="store_true")
+    parser.add_argument("--format", default=None, help="output_format, ví dụ mp3_44100_64, opus_48000_32, pcm_24000")
+    parser.add_argument("--hedge", type=float, default=0, help="tỉ lệ ký tự được gửi thêm cho đoạn chậm, 0 = tắt")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", help="ghi kết quả ra file JSON lines")
+    parser.add_argument("--keep", action="store_true", help="giữ thư mục làm việc trong /tmp để xem file đã tạo")
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", choices=("app3", "app4"), help=argparse.SUPPRESS)
+    mock_server.add_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_one(args)), flush=True)
+        return 0
+
+    mock_args = ["--latency", str(args.latency), "--per-char", str(args.per_char),
+                 "--throughput", str(args.throughput), "--p429", str(args.p429), "--p5xx", str(args.p5xx),
+                 "--retry-after", str(args.retry_after), "--credit", str(args.credit),
+                 "--p-slow", str(args.p_slow), "--slow", str(args.slow)]
+    if args.seed is not None:
+        mock_args += ["--seed", str(args.seed)]
+    mock = subprocess.Popen([sys.executable, os.path.join(HERE, "mock_server.py")] + mock_args,
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        url = mock.stdout.readline().split()[-1]
+        pipelines = ("app3", "app4") if args.pipeline == "both" else (args.pipeline,)
+        rows = []
+        for _ in range(args.repeat):
+            for name in pipelines:
+                _mock(url, "/_reset", "POST")
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name, "--url", url]
+                                     + (argv if argv is not None else sys.argv[1:]),
+                                     stdout=subprocess.PIPE, text=True, check=True)
+                row = json.loads(out.stdout.strip().splitlines()[-1])
+                row["server"] = _mock(url, "/_stats")
+                rows.append(row)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    fmt = lambda v, d=3: "-" if v is None else f"{v:.{d}f}"
+    print(f"{'pipeline':<8} {'ok':<3} {'đoạn':>5} {'wall s':>8} {'đoạn/s':>7} {'p50 s':>7} {'p95 s':>7} "
+          f"{'p99 s':>7} {'RSS MB':>7} {'post s':>7} {'nhận MB':>8} {'429':>4} {'5xx':>4}")
+    for r in rows:
+        status = r["server"]["status"]
+        print(f"{r['pipeline']:<8} {'✓' if r['ok'] else '✗':<3} {r['segments']:>5} {fmt(r['wall_s']):>8} "
+              f"{fmt(r['segments_per_s'], 2):>7} {fmt(r['p50_s']):>7} {fmt(r['p95_s']):>7} {fmt(r['p99_s']):>7} "
+              f"{fmt(r['peak_rss_mb'], 1):>7} {fmt(r['post_s']):>7} {r['server']['bytes'] / 1024 / 1024:>8.1f} "
+              f"{status.get('429', 0):>4} "
+              f"{sum(v for k, v in status.items() if k.startswith('5')):>4}")
+    if args.json:
+        with open(args.json, "a", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r) + "\n")
+    return 0 if all(r["ok"] for r in rows) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+# ========================== #
+# 📟 Bảng tiến độ một widget
+# ========================== #
+# Toàn bộ trạng thái job (tiến độ, tốc độ, ETA, credit từng key, vài dòng log cuối và
+# trình phát đoạn mới nhất) nằm trong một widgets.HTML được ghi đè tại chỗ.
+# Không display() thêm output nào trong lúc chạy: âm thanh được phát qua file_server
+# với preload="none" thay vì nhúng base64, nên output của notebook không lớn dần theo số đoạn.
+# Trình phát nằm trong widget con riêng, chỉ vẽ lại khi đổi nguồn, để việc vẽ lại tiến độ
+# không cắt ngang âm thanh đang phát. Ở chế độ live, trình phát giữ luồng nghe dần của
+# cả job (live_output) thay vì đổi theo từng đoạn.
+import html
+import os
+import threading
+import time
+from collections import deque
+
+import ipywidgets as widgets
+
+import audio_formats
+import file_server
+import metrics
+from job_manifest import mask_key
+
+MIN_INTERVAL = 0.5      # giây tối thiểu giữa hai lần vẽ lại (trừ khi bắt buộc)
+
+
+def _fmt_seconds(s):
+    if s is None:
+        return "-"
+    s = int(s)
+    return f"{s // 3600}:{s % 3600 // 60:02d}:{s % 60:02d}" if s >= 3600 else f"{s // 60}:{s % 60:02d}"
+
+
+class Dashboard:
+    def __init__(self, tail=8, show_metrics=True):
+        self.body = widgets.HTML(value="")
+        self.audio = widgets.HTML(value="")
+        self.view = widgets.VBox([self.body, self.audio])
+        self.lines = deque(maxlen=tail)
+        self.show_metrics = show_metrics
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.lines.clear()
+            self.total = self.done = 0
+            self.total_chars = self.done_chars = 0
+            self.started = time.time()
+            self.credit_pool = None
+            self.initial = {}
+            self.player = None          # (url, nhãn) của đoạn mới nhất
+            self.live = None            # (url luồng, url playlist) khi job chạy chế độ live
+            self.status, self.percent = "Đang chuẩn bị...", None
+            self.note = ""
+            self.drawn = 0.0
+        self.render(force=True)
+        self._draw_player()
+
+    # ==== Callback cho run_job / run_voices ====
+    def plan(self, paragraphs):
+        with self.lock:
+            self.total = len(paragraphs)
+            self.total_chars = sum(len(p) for p in paragraphs)
+        self.render(force=True)
+
+    # credit_pool là danh sách [key, credit] dùng chung với SynthPool, đọc trực tiếp khi vẽ
+    def keys(self, credit_pool):
+        with self.lock:
+            self.credit_pool = credit_pool
+            self.initial = {k: c for k, c in credit_pool}
+        self.render(force=True)
+
+    def log(self, *args):
+        text = " ".join(str(a) for a in args).strip()
+        if text:
+            with self.lock:
+                self.lines.extend(line for line in text.splitlines() if line.strip())
+            self.render()
+
+    def segment(self, i, text, path, output_format=None):
+        url = None if self.live else self._player_url(path, output_format, i)
+        with self.lock:
+            self.done += 1
+            self.done_chars += len(text)
+            if not self.live:
+                self.player = (url, f"Đoạn {i + 1}: {os.path.basename(path)}")
+        self.render(force=True)
+        self._draw_player()
+
+    # on_live của run_job / run_voices: phát luồng nối tiếp của cả job ngay từ đoạn đầu
+    def live_stream(self, live_out):
+        url = file_server.stream_url(live_out, "live" + audio_formats.merged_extension(live_out.output_format)) \
+            if live_out.streamable() else None
+        playlist = file_server.dir_url(live_out.folder, os.path.basename(live_out.playlist)) \
+            if live_out.playlist else None
+        with self.lock:
+            self.live = (url, playlist)
+            if url:
+                self.player = (url, "📡 Nghe dần cả job (phát tiếp khi có đoạn mới)")
+        self._draw_player()
+
+    # Đổi trình phát sang một file khác (ví dụ file gộp khi job xong)
+    def play(self, path, label=None):
+        url = self._player_url(path, None, self.done)
+        with self.lock:
+            self.player = (url, label or os.path.basename(path))
+        self._draw_player()
+
+    def set_status(self, message, percent=None):
+        with self.lock:
+            self.status, self.percent = message, percent
+        self.render(force=True)
+
+    # PCM thô không phát được trực tiếp: ghi bản WAV của đoạn mới nhất đè lên một file cố định
+    def _player_url(self, path, output_format, i):
+        if audio_formats.codec(output_format) == "pcm":
+            preview = os.path.join(os.path.dirname(path) or ".", "_preview.wav")
+            with open(preview, "wb") as f:
+                f.write(audio_formats.preview(path, output_format))
+            path = preview
+        try:
+            return f"{file_server.file_url(path)}?v={i}"
+        except OSError:
+            return None
+
+    # ==== Vẽ ====
+    def render(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.drawn < MIN_INTERVAL:
+                return
+            self.drawn = now
+            value = self._html(now)
+        self.body.value = value
+
+    # Chỉ gán lại khi nguồn đổi: gán cùng giá trị không tạo lại thẻ <audio>
+    def _draw_player(self):
+        with self.lock:
+            parts = []
+            if self.player and self.player[0]:
+                url, label = self.player
+                parts.append(f"<div style='font-family:sans-serif;font-size:13px'>🔊 {html.escape(label)}<br>"
+                             f"<audio controls preload='none' src='{html.escape(url)}'></audio></div>")
+            if self.live and self.live[1]:
+                parts.append(f"<div style='font-family:sans-serif;font-size:12px'>📃 Playlist HLS (Safari/VLC): "
+                             f"<a href='{html.escape(self.live[1])}' target='_blank'>live.m3u8</a></div>")
+            value = "".join(parts)
+        if self.audio.value != value:
+            self.audio.value = value
+
+    def _html(self, now):
+        elapsed = now - self.started
+        if self.percent is not None:
+            percent = self.percent
+        else:
+            percent = 100 * self.done_chars / self.total_chars if self.total_chars else 0
+        rate = self.done_chars / elapsed if elapsed > 0 and self.done_chars else 0
+        eta = (self.total_chars - self.done_chars) / rate if rate else None
+        seg_rate = self.done / elapsed if elapsed > 0 else 0
+        parts = [
+            "<div style='font-family:sans-serif;font-size:13px'>",
+            "<div class='progress-container' style='height:10px;background:rgba(128,128,128,.2);border-radius:5px;overflow:hidden'>"
+            f"<div class='progress-bar' style='height:100%;width:{percent:.1f}%;background:#ff8c00'></div></div>",
+            f"<div class='status-text'><b>{html.escape(self.status)}</b></div>",
+            f"<div>📊 Đoạn <b>{self.done}/{self.total}</b> · ký tự {self.done_chars:,}/{self.total_chars:,}"
+            f" · ⏱️ {_fmt_seconds(elapsed)} · 🚀 {seg_rate:.2f} đoạn/s, {rate:,.0f} ký tự/s"
+            f" · ETA {_fmt_seconds(eta)}</div>",
+        ]
+        if self.credit_pool:
+            rows = "".join(
+                f"<tr><td>{html.escape(mask_key(k) or '-')}</td><td>{'-' if c is None else f'{c:,}'}</td>"
+                f"<td>{'-' if self.initial.get(k) is None or c is None else f'{self.initial[k] - c:,}'}</td></tr>"
+                for k, c in list(self.credit_pool))
+            parts.append("<table style='font-size:12px'><tr><th>Key</th><th>Credit còn</th><th>Đã dùng/giữ</th></tr>"
+                         + rows + "</table>")
+        if self.note:
+            parts.append(f"<div>{html.escape(self.note)}</div>")
+        if self.lines:
+            parts.append("<pre style='font-size:12px;margin:4px 0;white-space:pre-wrap'>"
+                         + html.escape("\n".join(self.lines)) + "</pre>")
+        if self.show_metrics:
+            parts.append(metrics.REGISTRY.summary_html())
+        parts.append("</div>")
+        return "".join(parts)
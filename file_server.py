@@ -0,0 +1,189 @@
+# ========================== #
+# 📥 Máy chủ tải file cục bộ
+# ========================== #
+# Phục vụ file trực tiếp từ đĩa theo từng khối, hỗ trợ Range (206) để trình duyệt
+# có thể tua/tải tiếp. Bộ nhớ dùng không phụ thuộc kích thước file, thay cho
+# việc nhúng cả file dưới dạng base64 vào output của notebook.
+# Ngoài file đơn lẻ còn phục vụ file trong một thư mục đã đăng ký (playlist HLS và các
+# đoạn của nó, /d/) và luồng âm thanh đang lớn dần của job (live_output, /s/).
+import mimetypes
+import os
+import re
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+CHUNK = 64 * 1024
+
+_files = {}             # token -> đường dẫn tuyệt đối
+_dirs = {}              # token -> thư mục tuyệt đối
+_streams = {}           # token -> nguồn có iter_bytes() và content_type()
+_server = None
+_base_url = None
+_lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self):
+        m = re.match(r"^/([fd])/([A-Za-z0-9_-]+)/([^/?]+)", self.path)
+        path = None
+        if m and m.group(1) == "f":
+            path = _files.get(m.group(2))
+        elif m:
+            # Chỉ tên file nằm ngay trong thư mục đã đăng ký, không đi ra ngoài được
+            folder, name = _dirs.get(m.group(2)), unquote(m.group(3))
+            if folder and name == os.path.basename(name) and not name.startswith("."):
+                path = os.path.join(folder, name)
+        if not path or not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        return path
+
+    # Trả về (start, end) theo header Range, None nếu không có hoặc không dùng được (nhiều
+    # khoảng, sai cú pháp: RFC 9110 cho phép bỏ qua và trả 200 cả file), False nếu khoảng
+    # hợp lệ nhưng nằm ngoài file (416)
+    def _range(self, size):
+        header = self.headers.get("Range")
+        m = re.match(r"^bytes=(\d*)-(\d*)$", (header or "").strip())
+        if not m or (not m.group(1) and not m.group(2)):
+            return None
+        if m.group(1):
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else size - 1
+        else:
+            start, end = max(0, size - int(m.group(2))), size - 1
+        if start >= size or start > end:
+            return False
+        return start, min(end, size - 1)
+
+    def _headers(self, path):
+        size = os.path.getsize(path)
+        rng = self._range(size)
+        if rng is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return None
+        start, end = rng or (0, size - 1)
+        self.send_response(206 if rng else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(max(0, end - start + 1)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        if rng:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        name = os.path.basename(path)
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(name)}")
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        path = self._resolve()
+        if path:
+            self._headers(path)
+
+    # Luồng không biết trước độ dài: HTTP/1.0 không Content-Length, đóng kết nối khi hết
+    def _stream(self):
+        m = re.match(r"^/s/([A-Za-z0-9_-]+)/", self.path)
+        source = _streams.get(m.group(1)) if m else None
+        if source is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", source.content_type())
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            for chunk in source.iter_bytes():
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        if self.path.startswith("/s/"):
+            return self._stream()
+        path = self._resolve()
+        if not path:
+            return
+        span = self._headers(path)
+        if not span:
+            return
+        start, end = span
+        remaining = end - start + 1
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+# Trong Colab trình duyệt không truy cập thẳng được localhost của kernel, phải đi qua proxy
+def _public_base(port):
+    try:
+        from google.colab.output import eval_js
+        return eval_js(f"google.colab.kernel.proxyPort({port})").rstrip("/")
+    except ImportError:
+        return f"http://127.0.0.1:{port}"
+
+
+def start(port=0):
+    global _server, _base_url
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            _base_url = _public_base(_server.server_address[1])
+        return _base_url
+
+
+# Đăng ký file và trả về URL tải. Mỗi file có một token ngẫu nhiên, chỉ file đã đăng ký mới được phục vụ.
+def file_url(path):
+    base = start()
+    path = os.path.abspath(path)
+    with _lock:
+        token = next((t for t, p in _files.items() if p == path), None) or secrets.token_urlsafe(12)
+        _files[token] = path
+    return f"{base}/f/{token}/{quote(os.path.basename(path))}"
+
+
+# Đăng ký cả thư mục: URL của file name trong đó, các file cùng thư mục dùng được
+# bằng đường dẫn tương đối (ví dụ đoạn trong playlist .m3u8)
+def dir_url(folder, name):
+    base = start()
+    folder = os.path.abspath(folder)
+    with _lock:
+        token = next((t for t, p in _dirs.items() if p == folder), None) or secrets.token_urlsafe(12)
+        _dirs[token] = folder
+    return f"{base}/d/{token}/{quote(name)}"
+
+
+# Đăng ký một luồng (live_output.LiveOutput) và trả về URL phát
+def stream_url(source, name="live"):
+    base = start()
+    with _lock:
+        token = next((t for t, s in _streams.items() if s is source), None) or secrets.token_urlsafe(12)
+        _streams[token] = source
+    return f"{base}/s/{token}/{quote(name)}"
+
+
+def stop():
+    global _server, _base_url
+    with _lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server, _base_url = None, None
@@ -0,0 +1,136 @@
+# ========================== #
+# 🪁 Gửi thêm request cho đoạn chậm (hedging)
+# ========================== #
+# Một đoạn treo 60s trên node chậm giữ cả file gộp và phụ đề của job. Khi request
+# vượt ngưỡng động (p95 độ trễ đã đo cho đúng độ dài đoạn đó), SynthPool gửi thêm
+# một bản trên key khác còn rảnh và đủ credit; bên nào xong trước thắng, bên kia bị hủy.
+# Tổng ký tự gửi thêm bị giới hạn bởi budget_chars, vì bản thua có thể vẫn bị tính credit.
+import os
+import threading
+import time
+
+from alignment import alignment_path
+from segment_planner import DEFAULT_COEF
+
+QUANTILE = 0.95
+MIN_SAMPLES = 20        # dưới số mẫu này dùng FALLBACK lần thời gian dự đoán
+FALLBACK = 3.0
+MIN_DELAY = 2.0         # không gửi thêm sớm hơn số giây này
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class HedgePolicy:
+    def __init__(self, latency=None, model=None, budget_chars=0, quantile=QUANTILE, min_delay=MIN_DELAY):
+        self.latency = latency          # segment_planner.LatencyModel, được cập nhật trong lúc chạy
+        self.model = model
+        self.budget_chars = budget_chars
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.spent = 0                  # ký tự đã gửi thêm
+        self.launched = 0
+        self.won = 0
+
+    # Ngưỡng chờ cho đoạn chars ký tự: thời gian dự đoán a + b * chars nhân với phân vị
+    # của tỉ lệ (thực tế / dự đoán) trên các mẫu đã đo, nên đoạn dài được chờ lâu hơn.
+    def delay(self, chars):
+        a, b = self.latency.coef(self.model) if self.latency else DEFAULT_COEF
+        expected = a + b * chars
+        rows = list(self.latency.samples.get(self.model, [])) if self.latency else []
+        if len(rows) < MIN_SAMPLES:
+            factor = FALLBACK
+        else:
+            factor = _quantile([s / max(a + b * c, 1e-3) for c, s in rows], self.quantile)
+        return max(self.min_delay, expected * factor)
+
+    # Giữ trước ngân sách cho một bản gửi thêm; False nếu đã hết
+    def reserve(self, chars):
+        with self.lock:
+            if self.spent + chars > self.budget_chars:
+                return False
+            self.spent += chars
+            self.launched += 1
+            return True
+
+    def unreserve(self, chars):
+        with self.lock:
+            self.spent -= chars
+            self.launched -= 1
+
+    def record_win(self):
+        with self.lock:
+            self.won += 1
+
+    def summary(self):
+        return f"🪁 Gửi thêm {self.launched} lần, thắng {self.won}, {self.spent:,}/{self.budget_chars:,} ký tự ngân sách"
+
+
+# Event có thêm hàm gọi lại khi được bật: http_pool đăng ký hàm cắt socket của request
+# đang chạy, để bản thua dừng ngay cả khi còn đang chờ header. on_set trả về hàm gỡ đăng ký.
+class CancelEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_set(self, fn):
+        with self._lock:
+            if not self.is_set():
+                self._callbacks.append(fn)
+                return lambda: self._remove(fn)
+        fn()
+        return lambda: None
+
+    def _remove(self, fn):
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+    def set(self):
+        with self._lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn()
+
+
+# ========================== #
+# 🏁 Cuộc đua giữa các bản của một đoạn
+# ========================== #
+# Mỗi bản ghi ra file tạm riêng; bản thành công đầu tiên được đổi tên thành file đích
+# (kèm file timestamp .json) và bật cancel để các bản còn lại dừng ngay.
+# started là lúc gửi bản đầu tiên: độ trễ của đoạn được tính từ đó, không phải từ lúc
+# gửi bản thắng.
+class Race:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancel = CancelEvent()
+        self.winner = None
+        self.started = time.time()
+
+    def path(self, outname, j):
+        root, ext = os.path.splitext(outname)
+        return f"{root}.hedge{j}{ext}"
+
+    # Kết thúc một bản trên key j. Trả về True nếu kết quả của bản này được dùng (thắng,
+    # hoặc lỗi thật sự không phải do bị hủy), False nếu là bản thua cần bỏ qua.
+    def finish(self, j, ok, tmp, outname):
+        with self.lock:
+            won = ok and self.winner is None
+            if won:
+                self.winner = j
+                self.cancel.set()
+                os.replace(tmp, outname)
+                if os.path.exists(alignment_path(tmp)):
+                    os.replace(alignment_path(tmp), alignment_path(outname))
+                elif os.path.exists(alignment_path(outname)):
+                    os.remove(alignment_path(outname))
+                return True
+        for path in (tmp, alignment_path(tmp)):
+            if os.path.exists(path):
+                os.remove(path)
+        return not ok and not self.cancel.is_set()
@@ -0,0 +1,328 @@
+# ========================== #
+# 🌐 Kết nối HTTP dùng lại cho từng API key
+# ========================== #
+# Mỗi key giữ một requests.Session riêng với pool keep-alive giới hạn kích thước,
+# nên các đoạn sau không phải bắt tay TCP/TLS lại với api.elevenlabs.io.
+import base64
+import json
+import os
+import socket
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+from alignment import empty_alignment, extend_alignment
+from job_manifest import mask_key
+
+# ELEVENLABS_API_BASE trỏ sang server giả lập (bench/mock_server.py) khi đo hiệu năng
+API_BASE = os.environ.get("ELEVENLABS_API_BASE", "https://api.elevenlabs.io").rstrip("/")
+TIMEOUT = (10, 180)     # (kết nối, đọc) tính bằng giây
+POOL_SIZE = 2
+
+_sessions = {}
+_sizes = {}
+_lock = threading.Lock()
+_local = threading.local()      # request có cancel đang chạy trên luồng này (_Inflight)
+
+
+# ========================== #
+# ✂️ Cắt request đang chạy
+# ========================== #
+# Request bị bỏ ngang vì một bản gửi song song đã xong trước (xem hedging)
+class Cancelled(Exception):
+    pass
+
+
+# Kết nối nào đang phục vụ request của luồng được ghi vào _Inflight; khi cancel bật,
+# socket bị shutdown từ luồng khác nên recv() đang chờ header hay body trả về ngay,
+# kết nối bị bỏ khỏi pool và chỗ trong pool được trả lại.
+class _Inflight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.cancelled = False
+
+    def attach(self, conn):
+        with self.lock:
+            self.conn = conn
+            cancelled = self.cancelled
+        if cancelled:
+            _shutdown(conn)
+
+    def abort(self):
+        with self.lock:
+            self.cancelled = True
+            conn = self.conn
+        if conn is not None:
+            _shutdown(conn)
+
+
+def _shutdown(conn):
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _Cancellable:
+    def connect(self):
+        super().connect()
+        inflight = getattr(_local, "inflight", None)
+        if inflight is not None:
+            inflight.attach(self)
+
+    def request(self, *args, **kwargs):
+        inflight = getattr(_local, "inflight", None)
+        if inflight is not None:
+            inflight.attach(self)
+        return super().request(*args, **kwargs)
+
+
+class _HTTPConnection(_Cancellable, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_Cancellable, HTTPSConnection):
+    pass
+
+
+class _HTTPPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+
+# Theo dõi request của luồng hiện tại trong lúc with; cancel không có on_set (Event
+# thường) thì chỉ dừng được giữa các khối dữ liệu
+class _watch:
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+    def __enter__(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled()
+        self.remove = None
+        if hasattr(self.cancel, "on_set"):
+            _local.inflight = inflight = _Inflight()
+            self.remove = self.cancel.on_set(inflight.abort)
+        return self
+
+    def __exit__(self, *exc):
+        if self.remove:
+            self.remove()
+            _local.inflight = None
+
+
+# pool_size chỉ có hiệu lực khi tạo mới hoặc khi khác kích thước đang dùng
+def get_session(api_key, pool_size=None):
+    with _lock:
+        session = _sessions.get(api_key)
+        size = max(1, int(pool_size or _sizes.get(api_key) or POOL_SIZE))
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"xi-api-key": api_key})
+            _sessions[api_key] = session
+        if _sizes.get(api_key) != size:
+            # Đóng pool cũ trước khi thay, nếu không các socket keep-alive của nó bị bỏ lại
+            if api_key in _sizes:
+                session.get_adapter("https://").close()
+                session.get_adapter("http://").close()
+            adapter = _Adapter(pool_connections=1, pool_maxsize=size, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sizes[api_key] = size
+        return session
+
+
+# Ghi số liệu cho một request: status là mã HTTP hoặc "error" khi lỗi kết nối
+def _record(api_key, path, kwargs, status, seconds, size=0, ttfa=None):
+    payload = kwargs.get("json") or {}
+    key, model = mask_key(api_key), payload.get("model_id")
+    tts = path.startswith("/v1/text-to-speech/")
+    endpoint = "tts" if tts else path.strip("/").replace("/", "_")
+    chars = len(payload.get("text", "")) if tts and status == 200 else 0
+    metrics.inc("tts_requests_total", key=key, model=model, endpoint=endpoint, status=status)
+    if tts:
+        metrics.observe("tts_request_seconds", seconds, key=key, model=model)
+        metrics.inc("tts_bytes_received_total", size, key=key, model=model)
+        metrics.inc("tts_chars_billed_total", chars, key=key, model=model)
+        if ttfa is not None:
+            metrics.observe("tts_ttfa_seconds", ttfa, key=key, model=model)
+    variant = path.split("/", 4)[4] if tts and path.count("/") >= 4 else ""
+    metrics.event("request", key=key, model=model, endpoint=endpoint, variant=variant, status=status,
+                  seconds=round(seconds, 4), bytes=size, chars=chars,
+                  ttfa=None if ttfa is None else round(ttfa, 4))
+
+
+# Đọc body theo từng khối để có thể dừng ngay khi cancel được bật, đóng luôn kết nối
+def _read_cancellable(r, cancel, chunk_size=65536):
+    body = bytearray()
+    for chunk in r.iter_content(chunk_size):
+        if cancel.is_set():
+            r.close()
+            raise Cancelled()
+        body += chunk
+    r._content = bytes(body)
+
+
+def _cancelled(e, cancel):
+    return isinstance(e, Cancelled) or (cancel is not None and cancel.is_set())
+
+
+def _timed(method, api_key, path, cancel=None, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    start = time.time()
+    try:
+        with _watch(cancel):
+            r = getattr(get_session(api_key), method)(API_BASE + path, stream=cancel is not None, **kwargs)
+            if cancel is not None:
+                _read_cancellable(r, cancel)
+    except Exception as e:
+        cancelled = _cancelled(e, cancel)
+        _record(api_key, path, kwargs, "cancelled" if cancelled else "error", time.time() - start)
+        if cancelled and not isinstance(e, Cancelled):
+            raise Cancelled() from e
+        raise
+    _record(api_key, path, kwargs, r.status_code, time.time() - start, len(r.content))
+    return r
+
+
+def get(api_key, path, **kwargs):
+    return _timed("get", api_key, path, **kwargs)
+
+
+def post(api_key, path, **kwargs):
+    return _timed("post", api_key, path, **kwargs)
+
+
+# Gọi endpoint streaming và ghi từng chunk xuống outname ngay khi nhận được.
+# Trả về (response, ttfa) với ttfa là thời gian tới byte âm thanh đầu tiên (None nếu lỗi).
+# on_chunk(chunk) được gọi sau mỗi lần ghi để tầng sau có thể xử lý trước khi đoạn hoàn tất.
+def stream_to_file(api_key, path, outname, chunk_size=16384, on_chunk=None, cancel=None, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    start, size, status, ttfa = time.time(), 0, "error", None
+    try:
+        with _watch(cancel), get_session(api_key).post(API_BASE + path, stream=True, **kwargs) as r:
+            status = r.status_code
+            if r.status_code != 200:
+                size = len(r.content)
+                return r, None
+            try:
+                with open(outname, "wb") as f:
+                    for chunk in r.iter_content(chunk_size):
+                        if cancel is not None and cancel.is_set():
+                            raise Cancelled()
+                        if not chunk:
+                            continue
+                        if ttfa is None:
+                            ttfa = time.time() - start
+                        f.write(chunk)
+                        f.flush()
+                        size += len(chunk)
+                        if on_chunk:
+                            on_chunk(chunk)
+            except BaseException as e:
+                status = "cancelled" if isinstance(e, Cancelled) else "error"
+                if os.path.exists(outname):
+                    os.remove(outname)
+                raise
+            return r, ttfa
+    except Exception as e:
+        # Bị cắt từ luồng khác (kể cả lúc còn chờ header) thì báo Cancelled, không phải lỗi mạng
+        if _cancelled(e, cancel):
+            status = "cancelled"
+            if not isinstance(e, Cancelled):
+                raise Cancelled() from e
+        raise
+    finally:
+        _record(api_key, path, kwargs, status, time.time() - start, size, ttfa)
+
+
+# Như stream_to_file nhưng cho endpoint /stream/with-timestamps: mỗi dòng là một JSON
+# chứa audio_base64 và alignment của chunk đó. Trả về (response, ttfa, alignment).
+def stream_timestamps_to_file(api_key, path, outname, on_chunk=None, cancel=None, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    start, size, status, ttfa = time.time(), 0, "error", None
+    try:
+        with _watch(cancel), get_session(api_key).post(API_BASE + path, stream=True, **kwargs) as r:
+            status = r.status_code
+            if r.status_code != 200:
+                size = len(r.content)
+                return r, None, None
+            alignment = empty_alignment()
+            try:
+                with open(outname, "wb") as f:
+                    for line in r.iter_lines():
+                        if cancel is not None and cancel.is_set():
+                            raise Cancelled()
+                        if not line:
+                            continue
+                        size += len(line)
+                        data = json.loads(line)
+                        chunk = base64.b64decode(data.get("audio_base64") or "")
+                        if chunk:
+                            if ttfa is None:
+                                ttfa = time.time() - start
+                            f.write(chunk)
+                            f.flush()
+                            if on_chunk:
+                                on_chunk(chunk)
+                        extend_alignment(alignment, data.get("alignment"))
+            except BaseException as e:
+                status = "cancelled" if isinstance(e, Cancelled) else "error"
+                if os.path.exists(outname):
+                    os.remove(outname)
+                raise
+            return r, ttfa, alignment
+    except Exception as e:
+        # Bị cắt từ luồng khác (kể cả lúc còn chờ header) thì báo Cancelled, không phải lỗi mạng
+        if _cancelled(e, cancel):
+            status = "cancelled"
+            if not isinstance(e, Cancelled):
+                raise Cancelled() from e
+        raise
+    finally:
+        _record(api_key, path, kwargs, status, time.time() - start, size, ttfa)
+
+
+def _warm_one(api_key):
+    try:
+        get_session(api_key).head(API_BASE + "/v1/models", timeout=TIMEOUT)
+    except Exception:
+        pass
+
+
+# Mở sẵn tối đa pool_size kết nối cho mỗi key ở luồng nền, chạy song song với bước kiểm tra credit.
+# Trả về danh sách luồng để có thể join() nếu cần.
+def prewarm(api_keys, pool_size=None):
+    threads = []
+    for key in api_keys:
+        n = max(1, int(pool_size or POOL_SIZE))
+        get_session(key, n)
+        for _ in range(n):
+            t = threading.Thread(target=_warm_one, args=(key,), daemon=True)
+            t.start()
+            threads.append(t)
+    return threads
+
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _sizes.clear()
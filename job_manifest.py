@@ -0,0 +1,161 @@
+# ========================== #
+# 📒 Manifest tiến độ của job
+# ========================== #
+# Ghi lại từng đoạn: hash văn bản, trạng thái, key đã dùng, số byte và thời lượng.
+# Chạy lại với cùng đầu vào sẽ dùng lại các file đã xong thay vì tạo lại từ đầu.
+import hashlib
+import json
+import os
+import threading
+import time
+
+from synth_cache import atomic_write
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Đọc văn bản nguồn theo khối cho text_splitter và cộng dồn hash của nó, để nhận ra
+# lần chạy lại trên cùng nguồn mà không nạp cả file vào một chuỗi. extra là các thiết
+# lập chia đoạn (maxlen, kiểu chia) được tính vào hash.
+class HashedSource:
+    def __init__(self, source, *extra, chunk_size=64 * 1024):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.sha = hashlib.sha256(json.dumps(extra).encode("utf-8"))
+
+    def __iter__(self):
+        source, n = self.source, self.chunk_size
+        if isinstance(source, str):
+            pieces = (source[k:k + n] for k in range(0, len(source), n))
+        elif hasattr(source, "read"):
+            pieces = iter(lambda: source.read(n), "")
+        else:
+            pieces = source
+        for piece in pieces:
+            self.sha.update(piece.encode("utf-8"))
+            yield piece
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+def mask_key(api_key):
+    return f"{api_key[:6]}..." if api_key else None
+
+
+class JobManifest:
+    def __init__(self, folder, params, name="manifest.json"):
+        self.folder = folder
+        self.path = os.path.join(folder, name)
+        self.params_hash = text_hash(json.dumps(params, sort_keys=True, ensure_ascii=False))
+        self.lock = threading.Lock()
+        self.segments = []
+        old = self._load()
+        # Đổi giọng/model/thiết lập thì không dùng lại được đoạn nào
+        self.previous = old.get("segments", []) if old.get("params_hash") == self.params_hash else []
+        # Thông tin phụ của lần chạy (ví dụ hệ số độ trễ dùng để chia đoạn), giữ qua các lần chạy lại
+        self.meta = old.get("meta", {}) if self.previous else {}
+        # Đoạn đã xong theo hash văn bản, để nhận ra đoạn giữ nguyên nhưng đổi vị trí sau khi sửa
+        self.by_hash = {seg.get("hash"): seg for seg in self.previous if seg.get("status") == "done"}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _previous_done(self, i, text, path):
+        h = text_hash(text)
+        prev = self.previous[i] if i < len(self.previous) else None
+        if not prev or prev.get("hash") != h:
+            prev = self.by_hash.get(h)
+        # File phải trùng tên: đoạn đặt tên theo số thứ tự mà bị dời chỗ thì không dùng lại được
+        if (prev and prev.get("hash") == h and prev.get("status") == "done"
+                and prev.get("file") == os.path.basename(path)
+                and os.path.exists(path) and os.path.getsize(path) == prev.get("bytes")):
+            return prev
+        return None
+
+    # Chỉ số các đoạn sẽ được dùng lại, không ghi gì xuống đĩa
+    def reusable(self, texts, filename):
+        return {i for i, text in enumerate(texts) if self._previous_done(i, text, filename(i))}
+
+    # Lập danh sách đoạn cho lần chạy này. filename(i) là đường dẫn file của đoạn i.
+    # Trả về số đoạn được dùng lại.
+    def plan(self, texts, filename):
+        reused = 0
+        with self.lock:
+            self.segments = []
+            for i, text in enumerate(texts):
+                path = filename(i)
+                prev = self._previous_done(i, text, path)
+                if prev:
+                    self.segments.append(dict(prev, index=i + 1))
+                    reused += 1
+                else:
+                    self.segments.append({
+                        "index": i + 1, "file": os.path.basename(path), "hash": text_hash(text), "chars": len(text),
+                        "status": "pending", "key": None, "bytes": 0, "duration": None, "error": None,
+                    })
+            self._save()
+        return reused
+
+    def is_done(self, i):
+        with self.lock:
+            return self.segments[i]["status"] == "done"
+
+    def first_pending(self):
+        with self.lock:
+            for i, seg in enumerate(self.segments):
+                if seg["status"] != "done":
+                    return i
+        return None
+
+    def done(self, i, api_key, path, duration=None):
+        with self.lock:
+            self.segments[i].update(status="done", key=mask_key(api_key), bytes=os.path.getsize(path),
+                                    duration=duration, error=None, finished_at=time.time())
+            self._save()
+
+    def failed(self, i, api_key=None, error=None):
+        with self.lock:
+            self.segments[i].update(status="failed", key=mask_key(api_key), error=error)
+            self._save()
+
+    def duration(self, i):
+        with self.lock:
+            return self.segments[i].get("duration")
+
+    def set_duration(self, i, duration):
+        with self.lock:
+            self.segments[i]["duration"] = duration
+            self._save()
+
+    # File của lần chạy trước không còn đoạn nào dùng tới (đoạn đã bị sửa hoặc xóa)
+    def obsolete(self):
+        with self.lock:
+            keep = {seg["file"] for seg in self.segments}
+        return sorted({seg["file"] for seg in self.previous if seg.get("file")} - keep)
+
+    def has_progress(self):
+        return any(seg.get("status") == "done" for seg in self.previous)
+
+    # Danh sách đoạn cuối cùng (sau khi cân bằng và tách lại theo credit) của lần chạy trước
+    # trên cùng nguồn, để chạy lại giữ đúng ranh giới đoạn; None nếu khác nguồn hoặc chưa có đoạn nào xong
+    def saved_texts(self, source_hash):
+        plan = self.meta.get("plan") or {}
+        if plan.get("source") == source_hash and self.has_progress():
+            return plan.get("texts")
+        return None
+
+    # Được ghi xuống đĩa cùng lần plan() kế tiếp
+    def save_texts(self, source_hash, texts):
+        with self.lock:
+            self.meta["plan"] = {"source": source_hash, "texts": list(texts)}
+
+    def _save(self):
+        data = {"params_hash": self.params_hash, "updated_at": time.time(), "meta": self.meta, "segments": self.segments}
+        atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8"))
@@ -0,0 +1,525 @@
+# ========================== #
+# 📥 Hàng đợi job bền vững (SQLite)
+# ========================== #
+# Nhiều văn bản (text, voice_id, model, settings) được đưa vào một file SQLite cục bộ,
+# rồi một nhóm tiến trình worker lấy ra chạy theo độ ưu tiên, dùng chung danh sách key,
+# cache, mô hình độ trễ và ledger credit (key_health.CreditLedger).
+# Worker nhận job bằng "lease" có thời hạn và gia hạn định kỳ: worker chết giữa chừng thì
+# lease hết hạn, worker khác nhận lại job và manifest trong thư mục job giúp chạy tiếp
+# từ đoạn còn thiếu thay vì làm lại từ đầu.
+# Credit của từng key và phần đang giữ cho request chưa xong nằm trong cùng file SQLite
+# (CreditHolds), nên các tiến trình không cùng lúc tiêu một số dư cho nhiều job.
+# API key không bao giờ được ghi vào file hàng đợi (chỉ hash), chỉ truyền cho worker lúc khởi động.
+#   python job_queue.py submit script.txt --voice VOICE_ID --priority 5
+#   python job_queue.py work --processes 4 --keys keys.txt --drain
+#   python job_queue.py status
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+LEASE = 120.0           # giây một worker giữ job nếu không gia hạn
+POLL = 2.0              # giây chờ giữa hai lần hỏi hàng đợi khi rỗng
+MAX_ATTEMPTS = 3        # số lần nhận lại một job bị bỏ dở trước khi đánh dấu failed
+HOLD_TTL = 600.0        # giây phần credit giữ của một tiến trình còn hiệu lực nếu không được làm mới
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL DEFAULT 'tts',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS credits (
+    key TEXT PRIMARY KEY,
+    credit INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS holds (
+    owner TEXT NOT NULL,
+    key TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (owner, key)
+);
+"""
+
+
+class JobQueue:
+    def __init__(self, path="tts_jobs.db"):
+        self.path = path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    # Mỗi lần gọi một kết nối riêng: dùng được từ nhiều luồng và nhiều tiến trình
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return _Closing(db)
+
+    # kind "tts": payload như app3 (run_job); kind "voices": như app4 (run_voices).
+    # options là tham số thêm cho run_job/run_voices (maxlen, output_format, lang...).
+    def submit(self, text, voice_id, model, settings=None, priority=0, kind="tts", **options):
+        if kind not in JOB_TYPES:
+            raise ValueError(f"kind không hợp lệ: {kind}")
+        # Job kiểu app4 chỉ nhận tên model của app4 hoặc model_id, không rơi về model mặc định
+        if kind == "voices":
+            from tts_engine import APP4_MODELS
+            if model not in APP4_MODELS and not model.startswith("eleven_"):
+                raise ValueError(f"model không hợp lệ cho kind voices: {model} (dùng model_id hoặc {', '.join(APP4_MODELS)})")
+        payload = {"text": text, "voice_id": voice_id, "model": model, "settings": settings or {}, "options": options}
+        with self._connect() as db:
+            cur = db.execute("INSERT INTO jobs (kind, priority, payload, created) VALUES (?, ?, ?, ?)",
+                             (kind, int(priority), json.dumps(payload, ensure_ascii=False), time.time()))
+            return cur.lastrowid
+
+    # Nhận job ưu tiên cao nhất (cùng ưu tiên thì job cũ trước), kể cả job "running" có lease
+    # đã hết hạn. BEGIN IMMEDIATE giữ khóa ghi nên hai worker không thể nhận cùng một job.
+    def claim(self, worker, lease=LEASE, kinds=None):
+        now = time.time()
+        kinds = tuple(kinds or JOB_TYPES)
+        marks = ",".join("?" * len(kinds))
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = db.execute(
+                        f"SELECT * FROM jobs WHERE kind IN ({marks}) AND (status = 'queued' OR "
+                        "(status = 'running' AND lease_until < ?)) ORDER BY priority DESC, id LIMIT 1",
+                        kinds + (now,)).fetchone()
+                    if row is None:
+                        db.execute("COMMIT")
+                        return None
+                    if row["attempts"] >= MAX_ATTEMPTS:
+                        db.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ?, worker = NULL WHERE id = ?",
+                                   (f"worker dừng giữa chừng {row['attempts']} lần", now, row["id"]))
+                        continue
+                    db.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                               "started = COALESCE(started, ?) WHERE id = ?", (worker, now + lease, now, row["id"]))
+                    db.execute("COMMIT")
+                    job = dict(row)
+                    job["payload"] = json.loads(job["payload"])
+                    job["attempts"] += 1
+                    return job
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    # Gia hạn lease; False nếu job không còn thuộc worker này (bị hủy hoặc đã bị nhận lại)
+    def heartbeat(self, job_id, worker, lease=LEASE):
+        with self._connect() as db:
+            cur = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                             (time.time() + lease, job_id, worker))
+            return cur.rowcount == 1
+
+    def finish(self, job_id, worker, result=None, error=None):
+        with self._connect() as db:
+            cur = db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL "
+                             "WHERE id = ? AND worker = ? AND status = 'running'",
+                             ("failed" if error else "done", json.dumps(result, ensure_ascii=False),
+                              error, time.time(), job_id, worker))
+            return cur.rowcount == 1
+
+    # Job đang chạy bị hủy vẫn chạy nốt ở worker, nhưng kết quả không được ghi đè trạng thái
+    def cancel(self, job_id):
+        with self._connect() as db:
+            cur = db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? "
+                             "AND status IN ('queued', 'running')", (time.time(), job_id))
+            return cur.rowcount == 1
+
+    # Đưa job failed/cancelled về hàng đợi (ví dụ sau khi nạp thêm credit)
+    def retry(self, job_id):
+        with self._connect() as db:
+            cur = db.execute("UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, worker = NULL, "
+                             "lease_until = NULL, finished = NULL WHERE id = ? AND status IN ('failed', 'cancelled')",
+                             (job_id,))
+            return cur.rowcount == 1
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def jobs(self, status=None, limit=100):
+        query, args = "SELECT * FROM jobs", ()
+        if status:
+            query, args = query + " WHERE status = ?", (status,)
+        with self._connect() as db:
+            rows = db.execute(query + " ORDER BY id DESC LIMIT ?", args + (limit,)).fetchall()
+        return [_job(row) for row in rows]
+
+    def counts(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+class _Closing:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *exc):
+        self.db.close()
+
+
+# ========================== #
+# 🔒 Credit giữ chung giữa các tiến trình
+# ========================== #
+# SynthPool (tham số shared) gọi hold() trước khi dùng credit của một key và release()
+# khi request xong; mọi kiểm tra và thay đổi nằm trong BEGIN IMMEDIATE nên hai tiến trình
+# không cùng giữ một phần số dư. Phần giữ của tiến trình chết hết hiệu lực sau HOLD_TTL.
+class CreditHolds:
+    def __init__(self, path="tts_jobs.db", owner=None, ttl=HOLD_TTL):
+        from key_health import key_id
+        self.key_id = key_id
+        self.path = path
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = ttl
+        JobQueue(path)
+
+    def _connect(self):
+        return _Closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    # Credit còn dùng được (số dư trừ phần mọi tiến trình đang giữ), None nếu chưa biết số dư
+    def _available(self, db, kid, now):
+        row = db.execute("SELECT credit FROM credits WHERE key = ?", (kid,)).fetchone()
+        if row is None:
+            return None
+        held = db.execute("SELECT COALESCE(SUM(chars), 0) FROM holds WHERE key = ? AND updated > ?",
+                          (kid, now - self.ttl)).fetchone()[0]
+        return row[0] - held
+
+    # credit: số dư vừa hỏi từ server (ghi đè) hoặc từ ledger (chỉ dùng khi chưa có).
+    # Trả về credit còn dùng được cho tiến trình này.
+    def available(self, api_key, credit=None, fresh=False):
+        kid, now = self.key_id(api_key), time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if credit is not None:
+                db.execute("INSERT INTO credits (key, credit, updated) VALUES (?, ?, ?) ON CONFLICT(key) DO "
+                           + ("UPDATE SET credit = excluded.credit, updated = excluded.updated" if fresh else "NOTHING"),
+                           (kid, int(credit), now))
+            avail = self._available(db, kid, now)
+            db.execute("COMMIT")
+        return avail
+
+    # (credit còn dùng được, phần các tiến trình khác đang giữ)
+    def state(self, api_key):
+        kid, now = self.key_id(api_key), time.time()
+        with self._connect() as db:
+            avail = self._available(db, kid, now)
+            others = db.execute("SELECT COALESCE(SUM(chars), 0) FROM holds WHERE key = ? AND owner != ? AND updated > ?",
+                                (kid, self.owner, now - self.ttl)).fetchone()[0]
+        return avail, others
+
+    # Giữ need ký tự trên key; False nếu các tiến trình khác đã giữ hết phần còn lại
+    def hold(self, api_key, need):
+        kid, now = self.key_id(api_key), time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            avail = self._available(db, kid, now)
+            ok = avail is None or avail >= need
+            if ok:
+                self._add(db, kid, need, now)
+            db.execute("COMMIT")
+        return ok
+
+    # Bỏ phần giữ; spent=True thì request đã tốn credit, trừ luôn vào số dư chung
+    def release(self, api_key, need, spent=False):
+        kid, now = self.key_id(api_key), time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self._add(db, kid, -need, now)
+            if spent:
+                db.execute("UPDATE credits SET credit = credit - ? WHERE key = ?", (need, kid))
+            db.execute("COMMIT")
+
+    # Hoàn credit cho request không thực sự bị tính (ví dụ lấy từ cache)
+    def refund(self, api_key, chars):
+        with self._connect() as db:
+            db.execute("UPDATE credits SET credit = credit + ? WHERE key = ?", (chars, self.key_id(api_key)))
+
+    def _add(self, db, kid, chars, now):
+        db.execute("INSERT OR IGNORE INTO holds (owner, key, chars, updated) VALUES (?, ?, 0, ?)", (self.owner, kid, now))
+        db.execute("UPDATE holds SET chars = MAX(0, chars + ?) WHERE owner = ? AND key = ?", (chars, self.owner, kid))
+        # Phần giữ đã hết hạn của tiến trình này (job treo lâu) được làm mới cùng lúc
+        db.execute("UPDATE holds SET updated = ? WHERE owner = ?", (now, self.owner))
+
+    # Job xong (kể cả dừng giữa chừng): bỏ mọi phần giữ còn lại của tiến trình này
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM holds WHERE owner = ?", (self.owner,))
+
+
+def _job(row):
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+# ========================== #
+# 🛠️ Các loại job
+# ========================== #
+# Kiểu app3 (on_generate): văn bản -> đoạn + file gộp + phụ đề trong thư mục của job
+def _run_tts(payload, folder, env, log):
+    from tts_engine import run_job
+    result = run_job(payload["text"], env["api_keys"], payload["voice_id"], payload["model"], payload["settings"],
+                     folder=folder, log=log, **env["engine"], **payload["options"])
+    if result["stopped"]:
+        return None, "không còn API đủ quota"
+    if not result["ok"]:
+        return None, "tạo file gộp thất bại"
+    return {"audio": result["audio"], "srt": result["srt"], "segments": len(result["files"])}, None
+
+
+# Kiểu app4 (run_tool): settings dùng tên của voice_settings API
+def _run_voices(payload, folder, env, log):
+    from tts_engine import run_voices
+    s = payload["settings"]
+    options = dict(payload["options"])
+    max_chars = options.pop("max_chars", 500)
+    merged = os.path.join(folder, "merged_voice.mp3")
+    files = run_voices("\n".join(env["api_keys"]), payload["voice_id"], payload["model"], payload["text"],
+                       s.get("stability", 0.3), s.get("similarity_boost", 0.75), s.get("style", 0.0),
+                       s.get("speed", 1.0), s.get("use_speaker_boost", True), max_chars,
+                       zip_filename=os.path.join(folder, "voices.zip"), merged_filename=merged,
+                       folder=os.path.join(folder, "voices"), log=log, **env["engine"], **options)
+    if not files:
+        return None, "không tạo được đoạn nào"
+    audio = [os.path.join(folder, f) for f in os.listdir(folder) if f.startswith("merged_voice")]
+    zip_path = os.path.join(folder, "voices.zip")
+    return {"audio": audio[0] if audio else None, "zip": zip_path if os.path.exists(zip_path) else None,
+            "segments": len(files)}, None
+
+
+JOB_TYPES = {"tts": _run_tts, "voices": _run_voices}
+
+
+# ========================== #
+# 👷 Worker
+# ========================== #
+# Gia hạn lease ở nền trong lúc job chạy
+class _Lease:
+    def __init__(self, queue, job_id, worker, lease):
+        self.queue, self.job_id, self.worker, self.lease = queue, job_id, worker, lease
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self.stopped.wait(self.lease / 3):
+            if not self.queue.heartbeat(self.job_id, self.worker, self.lease):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+
+
+# Tài nguyên dùng chung trong một tiến trình worker; cache, độ trễ và ledger là file
+# dùng chung giữa các tiến trình (ghi nguyên tử)
+def _worker_env(api_keys, config, db_path="tts_jobs.db", worker=None):
+    from key_health import CreditLedger, REFRESH
+    from segment_planner import LatencyModel
+    from synth_cache import SynthCache
+    engine = {
+        "workers": config.get("workers", 4),
+        "per_key": config.get("per_key", 2),
+        "rate": config.get("rate") or None,
+        "latency": LatencyModel(config.get("latency_file", "tts_latency.json")),
+        "ledger": CreditLedger(config.get("ledger_file", "tts_credit_ledger.json")),
+        "refresh": config.get("refresh", REFRESH),
+        "shared": CreditHolds(db_path, worker),
+    }
+    cache_mb = config.get("cache_mb", 2048)
+    if cache_mb > 0:
+        engine["cache"] = SynthCache(config.get("cache_dir", "tts_cache"), max_bytes=cache_mb * 1024 * 1024)
+    return {"api_keys": api_keys, "engine": engine}
+
+
+def run_one(queue, worker, env, out="jobs", lease=LEASE, kinds=None, log=print):
+    job = queue.claim(worker, lease, kinds)
+    if job is None:
+        return None
+    folder = os.path.join(out, f"job_{job['id']}")
+    os.makedirs(folder, exist_ok=True)
+    log(f"▶️ [{worker}] job #{job['id']} ({job['kind']}, ưu tiên {job['priority']}, lần {job['attempts']})")
+    with open(os.path.join(folder, "job.log"), "a", encoding="utf-8") as f, _Lease(queue, job["id"], worker, lease) as hold:
+        def job_log(*args):
+            f.write(" ".join(str(a) for a in args) + "\n")
+            f.flush()
+        try:
+            result, error = JOB_TYPES[job["kind"]](job["payload"], folder, env, job_log)
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+            job_log(f"❌ {error}")
+        finally:
+            # Phần credit giữ cho đoạn chưa chạy (job dừng giữa chừng) trả lại cho tiến trình khác
+            if env["engine"].get("shared"):
+                env["engine"]["shared"].clear()
+    if hold.lost or not queue.finish(job["id"], worker, result, error):
+        log(f"⚠️ [{worker}] job #{job['id']} đã bị hủy hoặc nhận lại, bỏ kết quả")
+    else:
+        log(f"{'❌' if error else '✅'} [{worker}] job #{job['id']}: {error or result.get('audio')}")
+    return job["id"]
+
+
+def worker_main(db_path, api_keys, config, worker=None, drain=False, poll=POLL, log=print):
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    queue = JobQueue(db_path)
+    env = _worker_env(api_keys, config, db_path, worker)
+    while True:
+        job_id = run_one(queue, worker, env, config.get("out", "jobs"), config.get("lease", LEASE),
+                         config.get("kinds"), log)
+        if job_id is None:
+            if drain:
+                return
+            time.sleep(poll)
+
+
+# processes tiến trình cùng rút một hàng đợi; mỗi tiến trình chạy tối đa config["workers"]
+# request song song, nên tổng số luồng trên mỗi key là processes * per_key
+def work(db_path, api_keys, processes=2, drain=False, poll=POLL, **config):
+    JobQueue(db_path)
+    if processes <= 1:
+        return worker_main(db_path, api_keys, config, drain=drain, poll=poll)
+    procs = [multiprocessing.Process(target=worker_main, args=(db_path, api_keys, config),
+                                     kwargs={"drain": drain, "poll": poll}, daemon=False)
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+# ========================== #
+# 🖥️ Chạy từ dòng lệnh
+# ========================== #
+def main(argv=None):
+    import sys
+    from key_health import REFRESH
+    from tts_engine import _read_keys
+    import audio_formats
+    parser = argparse.ArgumentParser(description="Hàng đợi job tạo giọng nói (SQLite)")
+    parser.add_argument("--db", default="tts_jobs.db", help="file SQLite của hàng đợi")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("submit", help="thêm một hoặc nhiều văn bản vào hàng đợi")
+    p.add_argument("inputs", nargs="+", help="file văn bản, '-' để đọc từ stdin")
+    p.add_argument("--voice", required=True, help="Voice ID")
+    p.add_argument("--model", default="eleven_flash_v2_5", help="model_id (kind tts) hoặc tên model của app4 (kind voices)")
+    p.add_argument("--kind", choices=tuple(JOB_TYPES), default="tts")
+    p.add_argument("--priority", type=int, default=0, help="số lớn hơn chạy trước")
+    p.add_argument("--stability", type=float, default=0.3)
+    p.add_argument("--similarity", type=float, default=0.75)
+    p.add_argument("--style", type=float, default=0.0)
+    p.add_argument("--speed", type=float, default=1.0)
+    p.add_argument("--boost", action="store_true", help="optimize_streaming_latency = 4 / use_speaker_boost")
+    p.add_argument("--maxlen", type=int, default=500)
+    p.add_argument("--format", default=audio_formats.DEFAULT_FORMAT, choices=audio_formats.FORMATS)
+    p.add_argument("--lang", default="en", help="ngôn ngữ phụ đề (kind tts)")
+    p.add_argument("--hedge", type=float, default=0, help="tỉ lệ ký tự được gửi thêm cho đoạn chậm, 0 = tắt")
+    p.add_argument("--rebalance", action="store_true",
+                   help="khi job được chạy lại, chia đoạn lại theo số key/luồng của worker thay vì giữ danh sách đoạn cũ")
+
+    p = sub.add_parser("work", help="chạy các tiến trình worker rút hàng đợi")
+    p.add_argument("--keys", default=os.environ.get("ELEVENLABS_API_KEYS", ""),
+                   help="file chứa API key hoặc danh sách cách nhau bởi dấu phẩy; mặc định $ELEVENLABS_API_KEYS")
+    p.add_argument("--processes", type=int, default=2)
+    p.add_argument("--workers", type=int, default=4, help="số request song song mỗi tiến trình")
+    p.add_argument("--per-key", type=int, default=2, help="số request song song mỗi key trong một tiến trình")
+    p.add_argument("--rate", type=float, default=0)
+    p.add_argument("--out", default="jobs", help="thư mục chứa kết quả từng job")
+    p.add_argument("--kind", action="append", choices=tuple(JOB_TYPES), help="chỉ nhận loại job này")
+    p.add_argument("--lease", type=float, default=LEASE)
+    p.add_argument("--drain", action="store_true", help="dừng khi hàng đợi rỗng")
+    p.add_argument("--cache-dir", default="tts_cache")
+    p.add_argument("--cache-mb", type=int, default=2048)
+    p.add_argument("--ledger-file", default="tts_credit_ledger.json")
+    p.add_argument("--refresh", type=float, default=REFRESH)
+    p.add_argument("--latency-file", default="tts_latency.json")
+
+    p = sub.add_parser("status", help="xem trạng thái các job")
+    p.add_argument("--status", choices=STATUSES)
+    p.add_argument("--limit", type=int, default=20)
+    for name in ("cancel", "retry"):
+        sub.add_parser(name, help=f"{name} một job").add_argument("job_id", type=int)
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.db)
+
+    if args.command == "submit":
+        for path in args.inputs:
+            if path == "-":
+                text = sys.stdin.read()
+            else:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+            if args.kind == "tts":
+                settings = {"stability": args.stability, "similarity_boost": args.similarity, "style": args.style,
+                            "speed": args.speed, "optimize_streaming_latency": 4 if args.boost else 0}
+                options = {"maxlen": args.maxlen, "lang": args.lang, "output_format": args.format, "hedge": args.hedge,
+                           "rebalance": args.rebalance}
+            else:
+                settings = {"stability": args.stability, "similarity_boost": args.similarity, "style": args.style,
+                            "speed": args.speed, "use_speaker_boost": args.boost}
+                options = {"max_chars": args.maxlen, "output_format": args.format, "hedge": args.hedge,
+                           "rebalance": args.rebalance}
+            try:
+                job_id = queue.submit(text, args.voice, args.model, settings, args.priority, args.kind, **options)
+            except ValueError as e:
+                parser.error(str(e))
+            print(f"📥 job #{job_id}: {path}")
+        return 0
+    if args.command == "work":
+        api_keys = _read_keys(args.keys)
+        if not api_keys:
+            parser.error("cần ít nhất một API key (--keys hoặc $ELEVENLABS_API_KEYS)")
+        work(args.db, api_keys, processes=args.processes, drain=args.drain, workers=args.workers,
+             per_key=args.per_key, rate=args.rate, out=args.out, kinds=args.kind, lease=args.lease,
+             cache_dir=args.cache_dir, cache_mb=args.cache_mb, ledger_file=args.ledger_file,
+             refresh=args.refresh, latency_file=args.latency_file)
+        return 0
+    if args.command in ("cancel", "retry"):
+        ok = getattr(queue, args.command)(args.job_id)
+        print(f"{'✅' if ok else '⚠️ Không đổi được'} job #{args.job_id}")
+        return 0 if ok else 1
+    print("  ".join(f"{s}: {n}" for s, n in sorted(queue.counts().items())) or "Hàng đợi rỗng")
+    for job in queue.jobs(args.status, args.limit):
+        detail = job["error"] or (job["result"] or {}).get("audio") or ""
+        print(f"#{job['id']:<5} {job['kind']:<7} p{job['priority']:<3} {job['status']:<10} "
+              f"lần {job['attempts']}  {job['payload']['text'][:40]!r}  {detail}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,209 @@
+# ========================== #
+# 🩺 Sức khỏe và credit của từng API key
+# ========================== #
+# CircuitBreaker: mỗi key có trạng thái closed / open / half_open theo loại lỗi.
+#   - 401/403: mở "cứng", không thử lại cho tới khi kiểm tra credit thành công.
+#   - 5xx/timeout/lỗi khác: mở sau THRESHOLD lần lỗi liên tiếp, nghỉ có thời hạn
+#     (tăng gấp đôi mỗi lần mở lại), hết hạn thì cho một request thử (half_open).
+#   - 429 không làm mở mạch: key vẫn tốt, chỉ phải nghỉ theo Retry-After.
+#   - 400/404/422... (fatal) do chính request gây ra, không tính vào sức khỏe của key.
+# CreditLedger: credit của các key lưu giữa các lần chạy, khóa là hash của key
+# (không bao giờ ghi key gốc xuống đĩa), để lúc khởi động không phải hỏi lại từng key.
+# CreditRefresher: luồng nền hỏi /v1/user song song cho mọi key theo chu kỳ, cập nhật
+# credit trong SynthPool và đóng/mở mạch theo kết quả, không chặn luồng tổng hợp.
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from job_manifest import mask_key
+from synth_cache import atomic_write
+
+THRESHOLD = 3           # số lỗi tạm thời liên tiếp trước khi mở mạch
+COOLDOWN = 15.0         # giây nghỉ lần mở đầu tiên
+MAX_COOLDOWN = 600.0
+LEDGER_TTL = 600.0      # giây credit trong ledger còn được tin dùng khi khởi động
+REFRESH = 60.0          # chu kỳ làm mới credit trong lúc chạy
+
+
+def key_id(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=THRESHOLD, cooldown=COOLDOWN, max_cooldown=MAX_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self.hard = False           # mở do 401/403: chỉ kiểm tra credit mới mở lại được
+        self.failures = 0
+        self.cooldown = cooldown
+        self.until = 0.0
+        self.trial = False          # đang có request thử ở trạng thái half_open
+
+    # Key có được nhận request lúc này không (không thay đổi trạng thái trừ open -> half_open)
+    def allow(self, now):
+        if self.state == "open" and not self.hard and now >= self.until:
+            self.state, self.trial = "half_open", False
+        return self.state == "closed" or (self.state == "half_open" and not self.trial)
+
+    # Mở cứng thì coi như không dùng được, bộ lập lịch không chờ key này
+    def blocked(self):
+        return self.state == "open" and self.hard
+
+    # Thời điểm sớm nhất key có thể nhận request trở lại (None nếu không biết)
+    def reopens_at(self):
+        return None if self.hard else self.until
+
+    def on_take(self):
+        if self.state == "half_open":
+            self.trial = True
+
+    def _open(self, now, hard=False):
+        if self.state == "half_open" and not hard:
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+        self.state, self.hard, self.trial = "open", hard, False
+        self.until = now + self.cooldown
+
+    # Ghi kết quả một request (kind theo rate_limit.classify). Trả về trạng thái mới.
+    def record(self, kind, now=None):
+        now = time.time() if now is None else now
+        if kind == "ok":
+            self.state, self.hard, self.failures, self.trial = "closed", False, 0, False
+            self.cooldown = self.base_cooldown
+        elif kind == "auth":
+            self._open(now, hard=True)
+        elif kind in ("rate_limit", "fatal"):
+            self.trial = False
+        else:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self._open(now)
+        return self.state
+
+    # Kết quả kiểm tra credit ở nền: /v1/user trả 200 thì key mở cứng được thử lại một lần
+    def probe(self, ok, now=None):
+        now = time.time() if now is None else now
+        if ok and self.blocked():
+            self.state, self.hard, self.trial = "half_open", False, False
+        elif not ok and self.state != "open":
+            self._open(now, hard=True)
+        return self.state
+
+
+# ========================== #
+# 📒 Credit lưu giữa các lần chạy
+# ========================== #
+class CreditLedger:
+    def __init__(self, path="tts_credit_ledger.json", ttl=LEDGER_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}           # key_id -> {"credit": int, "at": timestamp}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    # Credit còn hạn của key, None nếu chưa có hoặc đã quá ttl
+    def get(self, api_key, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(key_id(api_key))
+        if entry and entry.get("credit") is not None and now - entry.get("at", 0) < self.ttl:
+            return entry["credit"]
+        return None
+
+    # Nhiều tiến trình (job_queue) dùng chung file: đọc lại và giữ bản ghi mới hơn trước khi ghi
+    def update(self, credits):
+        now = time.time()
+        with self.lock:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    for kid, entry in json.load(f).items():
+                        if entry.get("at", 0) > self.entries.get(kid, {}).get("at", 0):
+                            self.entries[kid] = entry
+            except (OSError, ValueError):
+                pass
+            for api_key, credit in credits:
+                if credit is not None:
+                    self.entries[key_id(api_key)] = {"credit": int(credit), "at": now}
+            atomic_write(self.path, json.dumps(self.entries).encode("utf-8"))
+
+
+# Hỏi credit một key: trả về (status, credit); status None khi lỗi kết nối
+def fetch_credit(api_key):
+    import http_pool
+    try:
+        r = http_pool.get(api_key, "/v1/user")
+    except Exception:
+        return None, None
+    if r.status_code != 200:
+        return r.status_code, None
+    try:
+        sub = r.json().get("subscription", {})
+        return 200, sub.get("character_limit", 0) - sub.get("character_count", 0)
+    except ValueError:
+        return 200, None
+
+
+# Credit của nhiều key: lấy từ ledger nếu còn hạn, các key còn lại hỏi song song.
+# Trả về [(credit, status)] theo thứ tự key; status là "cache" với giá trị từ ledger.
+def load_credits(api_keys, ledger=None):
+    out = [(ledger.get(key), "cache") if ledger else (None, None) for key in api_keys]
+    missing = [i for i, (credit, _) in enumerate(out) if credit is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(16, len(missing))) as ex:
+            for i, (status, credit) in zip(missing, ex.map(fetch_credit, [api_keys[i] for i in missing])):
+                out[i] = (credit, status)
+        if ledger:
+            ledger.update([(api_keys[i], out[i][0]) for i in missing])
+    return out
+
+
+# ========================== #
+# 🔄 Làm mới credit ở nền
+# ========================== #
+class CreditRefresher:
+    def __init__(self, pool, ledger=None, interval=REFRESH):
+        self.pool = pool
+        self.ledger = ledger
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval and self.interval > 0:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+        return self
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.refresh()
+
+    def refresh(self):
+        keys = [key for key, _ in self.pool.credit_pool]
+        if not keys:
+            return
+        with ThreadPoolExecutor(max_workers=min(16, len(keys))) as ex:
+            results = list(ex.map(fetch_credit, keys))
+        for j, (status, credit) in enumerate(results):
+            if status is None:
+                continue            # lỗi mạng: không kết luận gì về key
+            self.pool.update_health(j, status == 200, credit)
+        if self.ledger:
+            self.ledger.update([(key, credit) for key, (status, credit) in zip(keys, results) if status == 200])
+        metrics.event("credit_refresh", keys=[mask_key(k) for k in keys],
+                      credits=[credit for _, credit in results])
+
+    def stop(self):
+        self.stopped.set()
+        if self.ledger:
+            # Ghi lại credit còn lại (kể cả phần đã giữ nhưng chưa dùng) cho lần chạy sau
+            self.ledger.update([(self.pool.credit_pool[j][0], self.pool.available(j))
+                                for j in range(len(self.pool.credit_pool))])
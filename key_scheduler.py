@@ -0,0 +1,67 @@
+# ========================== #
+# 🗂️ Phân bổ đoạn cho các API key
+# ========================== #
+# Lập kế hoạch trước khi tổng hợp: xếp đoạn dài nhất trước vào key có credit
+# còn lại vừa khít nhất (best-fit decreasing). Đoạn không vừa key nào sẽ được tách
+# lại theo ranh giới câu để lấp phần credit còn thừa của nhiều key.
+from text_splitter import iter_sentences
+
+
+# Tách câu mà vẫn giữ nguyên khoảng trắng, ghép lại sẽ ra đúng văn bản ban đầu
+def sentences(text):
+    return list(iter_sentences(text))
+
+
+def _best_fit(free, need):
+    best = None
+    for j, credit in enumerate(free):
+        if credit is not None and credit >= need and (best is None or credit < free[best]):
+            best = j
+    return best
+
+
+# Tách text thành các phần lần lượt vừa với credit lớn nhất còn lại.
+# Trả về [(phần, key)] hoặc None nếu có câu dài hơn mọi key.
+def _resplit(text, free):
+    free = list(free)
+    parts, sents = [], sentences(text)
+    while sents:
+        j = max((k for k, c in enumerate(free) if c), key=lambda k: free[k], default=None)
+        if j is None:
+            return None
+        chunk = []
+        while sents and len((''.join(chunk) + sents[0]).strip()) <= free[j]:
+            chunk.append(sents.pop(0))
+        if not chunk:
+            return None
+        piece = ''.join(chunk).strip()
+        free[j] -= len(piece)
+        parts.append((piece, j))
+    return parts
+
+
+# texts: danh sách đoạn theo thứ tự; credits: credit còn lại của từng key (None = key lỗi);
+# skip: chỉ số các đoạn không cần tạo lại (đã có file), không tốn credit.
+# Trả về (plan, số đoạn bị tách) với plan = [(text, key hoặc None)] theo đúng thứ tự văn bản.
+def plan_keys(texts, credits, skip=(), resplit=True):
+    free = list(credits)
+    slots = [[(text, None)] for text in texts]
+    order = sorted((i for i in range(len(texts)) if i not in skip), key=lambda i: -len(texts[i]))
+    # Lượt 1: xếp nguyên đoạn; lượt 2: tách các đoạn còn lại vào phần credit thừa
+    leftover, split_count = [], 0
+    for i in order:
+        need = len(texts[i])
+        j = _best_fit(free, need)
+        if j is None:
+            leftover.append(i)
+            continue
+        free[j] -= need
+        slots[i] = [(texts[i], j)]
+    for i in leftover:
+        parts = _resplit(texts[i], free) if resplit else None
+        if parts and len(parts) > 1:
+            for piece, k in parts:
+                free[k] -= len(piece)
+            slots[i] = parts
+            split_count += 1
+    return [item for slot in slots for item in slot], split_count
@@ -0,0 +1,145 @@
+# ========================== #
+# 📡 Nghe dần file gộp trong lúc còn tổng hợp
+# ========================== #
+# Mỗi đoạn xong (theo đúng thứ tự, qua Pipeline) được thêm vào:
+#   - playlist HLS kiểu EVENT (live.m3u8) trỏ tới các file đoạn, cho Safari/VLC/hls.js;
+#   - một luồng âm thanh nối tiếp phát qua file_server.stream_url: MP3 là các frame âm
+#     thanh của từng đoạn (bỏ ID3 và frame Xing/Info để không chèn khoảng lặng), PCM là
+#     một WAV có header "dài vô hạn". Người nghe bắt đầu ngay khi có đoạn đầu tiên,
+#     luồng chờ đoạn kế tiếp và chỉ kết thúc khi job xong.
+# Opus (Ogg) không có cả hai dạng này: chỉ dùng được trình phát từng đoạn như cũ.
+import math
+import mmap
+import os
+import struct
+import threading
+from urllib.parse import quote
+
+import audio_formats
+from mp3_tools import audio_end, first_frame, id3v2_size, vbr_header
+from synth_cache import atomic_write
+
+CHUNK = 64 * 1024
+# Cận trên thời lượng đọc: giọng đọc thường 12-15 ký tự/giây, lấy rộng ~6,5 ký tự/giây
+# ở tốc độ 1.0 để đoạn đọc chậm (hay có <break>) vẫn không vượt TARGETDURATION
+SECONDS_PER_CHAR = 0.15
+MIN_TARGET = 4
+
+
+# TARGETDURATION cho cả job, tính một lần từ đoạn dài nhất trước khi có file nào.
+# speed là tốc độ đọc gửi kèm request (ngoài 0.5-2.0 thì API bỏ qua, coi như 1.0).
+def target_duration(texts, speed=None):
+    if not speed or not 0.5 <= speed <= 2.0:
+        speed = 1.0
+    longest = max((len(t) for t in texts), default=0)
+    return max(MIN_TARGET, math.ceil(longest * SECONDS_PER_CHAR / speed))
+
+
+class LiveOutput:
+    def __init__(self, folder, output_format=None, name="live.m3u8", target=MIN_TARGET):
+        self.folder = folder
+        self.output_format = output_format
+        self.codec = audio_formats.codec(output_format)
+        self.target = target
+        self.playlist = os.path.join(folder, name) if self.codec == "mp3" else None
+        self.segments = []          # [(đường dẫn, thời lượng)] theo thứ tự
+        self.done = False
+        self.cond = threading.Condition()
+        if self.playlist:
+            self._write_playlist()
+
+    def streamable(self):
+        return self.codec in ("mp3", "pcm")
+
+    def content_type(self):
+        return "audio/wav" if self.codec == "pcm" else "audio/mpeg"
+
+    def duration(self):
+        with self.cond:
+            return sum(d for _, d in self.segments)
+
+    # ==== Stage của Pipeline ====
+    def append(self, path):
+        seconds = audio_formats.duration(path, self.output_format)
+        with self.cond:
+            self.segments.append((path, seconds))
+            self.cond.notify_all()
+        if self.playlist:
+            self._write_playlist()
+
+    def close(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+        if self.playlist:
+            self._write_playlist()
+        return self.playlist
+
+    def discard(self):
+        self.close()
+
+    # TARGETDURATION không được đổi giữa các lần ghi playlist (RFC 8216), nên dùng
+    # self.target cố định từ lúc tạo thay vì theo đoạn dài nhất đã có
+    def _write_playlist(self):
+        with self.cond:
+            segments, done = list(self.segments), self.done
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-PLAYLIST-TYPE:EVENT",
+                 f"#EXT-X-TARGETDURATION:{self.target}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for path, seconds in segments:
+            lines += [f"#EXTINF:{seconds:.3f},", quote(os.path.relpath(path, self.folder).replace(os.sep, "/"))]
+        if done:
+            lines.append("#EXT-X-ENDLIST")
+        atomic_write(self.playlist, ("\n".join(lines) + "\n").encode("utf-8"))
+
+    # ==== Luồng nối tiếp cho file_server ====
+    # Lần lượt trả về các khối byte; chờ đoạn kế tiếp cho tới khi job xong
+    def iter_bytes(self):
+        if self.codec == "pcm":
+            yield _wav_header(audio_formats.pcm_rate(self.output_format))
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.segments) and not self.done:
+                    self.cond.wait()
+                if i >= len(self.segments):
+                    return
+                path = self.segments[i][0]
+            i += 1
+            if self.codec == "mp3":
+                yield from _mp3_audio(path)
+            else:
+                yield from _file_chunks(path, 0, os.path.getsize(path) // 2 * 2)
+
+
+def _file_chunks(path, start=0, end=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = (end if end is not None else os.path.getsize(path)) - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+# Phần frame âm thanh của một file MP3: bỏ ID3v2, frame Xing/Info và ID3v1 ở cuối
+def _mp3_audio(path):
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        pos, info = first_frame(buf, id3v2_size(buf))
+        if pos is None:
+            return
+        if vbr_header(buf, pos, info):
+            pos += info["length"]
+        end = audio_end(buf)
+    yield from _file_chunks(path, pos, end)
+
+
+# Header WAV PCM 16-bit mono với kích thước tối đa: trình duyệt phát dần cho tới khi hết dữ liệu
+def _wav_header(rate):
+    size = 0xFFFFFFFF - 36
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", size))
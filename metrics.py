@@ -0,0 +1,212 @@
+# ========================== #
+# 📊 Số liệu vận hành
+# ========================== #
+# Bộ đếm và histogram dùng chung cho cả tiến trình: mọi request API đi qua http_pool
+# được ghi độ trễ theo key/model, số byte nhận, mã trạng thái và số ký tự bị tính;
+# SynthPool ghi số lần thử lại; các stage hậu xử lý và bước đọc thời lượng ghi thời gian.
+# Xuất ra JSON lines (mỗi sự kiện một dòng) và file Prometheus dạng text.
+import bisect
+import html
+import json
+import math
+import threading
+import time
+
+from synth_cache import atomic_write
+
+BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, math.inf)
+
+HELP = {
+    "tts_request_seconds": ("histogram", "Thời gian mỗi request API theo key và model"),
+    "tts_ttfa_seconds": ("histogram", "Thời gian tới byte âm thanh đầu tiên (streaming)"),
+    "tts_step_seconds": ("histogram", "Thời gian các bước hậu xử lý: merge, srt, zip, decode, encode"),
+    "tts_requests_total": ("counter", "Số request API theo key, model, endpoint và mã trạng thái"),
+    "tts_bytes_received_total": ("counter", "Số byte âm thanh/JSON nhận về"),
+    "tts_chars_billed_total": ("counter", "Số ký tự đã bị tính credit (request thành công)"),
+    "tts_retries_total": ("counter", "Số lần thử lại do 429/lỗi tạm thời"),
+    "tts_cache_hits_total": ("counter", "Số đoạn lấy từ cache, không tốn credit"),
+    "tts_hedges_total": ("counter", "Số lần gửi thêm request cho đoạn chậm (launched) và số lần bản gửi thêm thắng (won)"),
+    "tts_breaker_transitions_total": ("counter", "Số lần ngắt mạch của key đổi trạng thái (closed/open/half_open)"),
+}
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+class Metrics:
+    def __init__(self, events_path=None):
+        self.events_path = events_path      # None = không ghi JSON lines
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}              # (tên, nhãn) -> giá trị
+            self.hists = {}                 # (tên, nhãn) -> [đếm theo bucket..., tổng, số mẫu]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = [0] * len(BUCKETS) + [0.0, 0]
+            h[bisect.bisect_left(BUCKETS, value)] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    # Ghi một sự kiện ra file JSON lines (nếu có cấu hình events_path)
+    def event(self, kind, **fields):
+        if not self.events_path:
+            return
+        line = json.dumps(dict(ts=round(time.time(), 3), type=kind, **fields), ensure_ascii=False)
+        with self.lock:
+            with open(self.events_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    # Ước lượng phân vị từ histogram bằng nội suy tuyến tính trong bucket
+    def quantile(self, name, q, **labels):
+        with self.lock:
+            rows = [h[:] for (n, l), h in self.hists.items()
+                    if n == name and all((k, str(v)) in l for k, v in labels.items())]
+        if not rows:
+            return None
+        counts = [sum(r[b] for r in rows) for b in range(len(BUCKETS))]
+        total = sum(counts)
+        if not total:
+            return None
+        rank, seen, lower = q * total, 0, 0.0
+        for b, c in enumerate(counts):
+            if c and seen + c >= rank:
+                upper = BUCKETS[b] if BUCKETS[b] != math.inf else lower * 2 or 1.0
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+            lower = BUCKETS[b] if BUCKETS[b] != math.inf else lower
+        return lower
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "histograms": [{"name": n, "labels": dict(l), "buckets": dict(zip(map(str, BUCKETS), h[:-2])),
+                                "sum": h[-2], "count": h[-1]} for (n, l), h in sorted(self.hists.items())],
+            }
+
+    def prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            hists = sorted((k, h[:]) for k, h in self.hists.items())
+        out, declared = [], set()
+
+        def declare(name):
+            if name not in declared:
+                kind, text = HELP.get(name, ("untyped", name))
+                out.append(f"# HELP {name} {text}")
+                out.append(f"# TYPE {name} {kind}")
+                declared.add(name)
+
+        for (name, labels), value in counters:
+            declare(name)
+            out.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), h in hists:
+            declare(name)
+            cumulative = 0
+            for b, c in zip(BUCKETS, h[:-2]):
+                cumulative += c
+                le = "+Inf" if b == math.inf else repr(b)
+                out.append(f"{name}_bucket{_fmt_labels(labels, [('le', le)])} {cumulative}")
+            out.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]}")
+            out.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path):
+        atomic_write(path, self.prometheus().encode("utf-8"))
+
+    # Bảng tóm tắt theo key/model cho widget: số request, lỗi, p50/p95, MB nhận, ký tự tính phí
+    def summary_rows(self):
+        with self.lock:
+            counters = list(self.counters.items())
+        rows = {}
+        for (name, labels), value in counters:
+            l = dict(labels)
+            row = rows.setdefault((l.get("key", "-"), l.get("model", "-")),
+                                  {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "retries": 0, "bytes": 0, "chars": 0})
+            if name == "tts_requests_total" and l.get("endpoint") == "tts":
+                row["requests"] += value
+                status = l.get("status", "")
+                row["ok"] += value if status == "200" else 0
+                row["429"] += value if status == "429" else 0
+                row["5xx"] += value if status.startswith("5") else 0
+            elif name == "tts_bytes_received_total":
+                row["bytes"] += value
+            elif name == "tts_chars_billed_total":
+                row["chars"] += value
+            elif name == "tts_retries_total":
+                row["retries"] += value
+        out = []
+        for (key, model), row in sorted(rows.items()):
+            # Bỏ dòng chỉ có request kiểm tra credit (/v1/user), không có request TTS nào
+            if not row["requests"] and not row["retries"]:
+                continue
+            labels = {"key": key} if model == "-" else {"key": key, "model": model}
+            row.update(key=key, model=model,
+                       p50=self.quantile("tts_request_seconds", 0.5, **labels),
+                       p95=self.quantile("tts_request_seconds", 0.95, **labels))
+            out.append(row)
+        return out
+
+    # Key và model có thể do người dùng nhập (model_id tự gõ), nên mọi ô đều được escape
+    def summary_html(self):
+        fmt = lambda v: "-" if v is None else f"{v:.2f}s"
+        rows = "".join(
+            "<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in (
+                r["key"], r["model"], r["requests"], r["ok"], r["429"], r["5xx"], r["retries"],
+                fmt(r["p50"]), fmt(r["p95"]), f"{r['bytes'] / 1024 / 1024:.1f}", f"{r['chars']:,}")) + "</tr>"
+            for r in self.summary_rows())
+        return ("<table style='font-size:12px'><tr><th>Key</th><th>Model</th><th>Req</th><th>OK</th><th>429</th>"
+                "<th>5xx</th><th>Thử lại</th><th>p50</th><th>p95</th><th>MB</th><th>Ký tự</th></tr>"
+                + rows + "</table>")
+
+
+# Bộ số liệu mặc định của tiến trình
+REGISTRY = Metrics()
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def event(kind, **fields):
+    REGISTRY.event(kind, **fields)
+
+
+# Bấm giờ một bước: with timed("merge"): ...
+class timed:
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.time() - self.t0
+        observe("tts_step_seconds", seconds, step=self.step)
+        event("step", step=self.step, seconds=round(seconds, 4))
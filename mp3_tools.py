@@ -0,0 +1,337 @@
+# ========================== #
+# 🎼 Đọc thông tin MP3 không cần giải mã
+# ========================== #
+# Thời lượng lấy từ header Xing/Info (kèm delay/padding của LAME) hoặc VBRI;
+# nếu không có thì đi qua từng header frame. Không gọi ffmpeg, không giải mã PCM.
+import mmap
+import os
+import threading
+
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+# Trả về dict thông tin frame tại vị trí pos, hoặc None nếu không phải header hợp lệ
+def parse_header(buf, pos=0):
+    if pos + 4 > len(buf):
+        return None
+    b0, b1, b2, b3 = buf[pos], buf[pos + 1], buf[pos + 2], buf[pos + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = {0: 25, 2: 2, 3: 1}.get((b1 >> 3) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((b1 >> 1) & 3)
+    br_index, sr_index = b2 >> 4, (b2 >> 2) & 3
+    if version is None or layer is None or br_index in (0, 15) or sr_index == 3:
+        return None
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][br_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sr_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {"version": version, "layer": layer, "bitrate": bitrate, "sample_rate": sample_rate,
+            "samples": samples, "length": length, "mono": (b3 >> 6) == 3}
+
+
+# Kích thước tag ID3v2 ở đầu file (0 nếu không có)
+def id3v2_size(buf):
+    if len(buf) >= 10 and buf[:3] == b"ID3":
+        size = (buf[6] & 0x7F) << 21 | (buf[7] & 0x7F) << 14 | (buf[8] & 0x7F) << 7 | (buf[9] & 0x7F)
+        return 10 + size + (10 if buf[5] & 0x10 else 0)
+    return 0
+
+
+# Vị trí kết thúc dữ liệu âm thanh, bỏ tag ID3v1 / APE ở cuối file
+def audio_end(buf):
+    end = len(buf)
+    if end >= 128 and buf[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end >= 32 and buf[end - 32:end - 24] == b"APETAGEX":
+        size = int.from_bytes(buf[end - 20:end - 16], "little")
+        end -= size + (32 if buf[end - 9] & 0x80 else 0)
+    return max(0, end)
+
+
+# Tìm frame đầu tiên: header hợp lệ và frame kế tiếp cũng hợp lệ (tránh nhận nhầm sync)
+def first_frame(buf, start=0, limit=65536):
+    end = min(len(buf), start + limit)
+    pos = start
+    while pos < end:
+        pos = buf.find(b"\xff", pos, end)
+        if pos < 0:
+            return None, None
+        info = parse_header(buf, pos)
+        if info:
+            nxt = pos + info["length"]
+            if nxt >= len(buf) or parse_header(buf, nxt):
+                return pos, info
+        pos += 1
+    return None, None
+
+
+def _side_info(info):
+    if info["version"] == 1:
+        return 17 if info["mono"] else 32
+    return 9 if info["mono"] else 17
+
+
+# Đọc header Xing/Info hoặc VBRI trong frame đầu. Trả về dict
+# {"frames", "bytes", "delay", "padding"} hoặc None nếu frame đầu là frame âm thanh thường.
+def vbr_header(buf, pos, info):
+    x = pos + 4 + _side_info(info)
+    tag = bytes(buf[x:x + 4])
+    if tag in (b"Xing", b"Info"):
+        flags = int.from_bytes(buf[x + 4:x + 8], "big")
+        p = x + 8
+        result = {"tag": tag, "frames": None, "bytes": None, "delay": 0, "padding": 0}
+        if flags & 1:
+            result["frames"] = int.from_bytes(buf[p:p + 4], "big")
+            p += 4
+        if flags & 2:
+            result["bytes"] = int.from_bytes(buf[p:p + 4], "big")
+            p += 4
+        if flags & 4:
+            p += 100
+        if flags & 8:
+            p += 4
+        # Phần mở rộng LAME: 9 byte tên encoder ... 3 byte delay/padding ở byte 21..23
+        if buf[p:p + 4] in (b"LAME", b"Lavf", b"Lavc", b"L3.9") and p + 24 <= len(buf):
+            d = buf[p + 21:p + 24]
+            result["delay"] = (d[0] << 4) | (d[1] >> 4)
+            result["padding"] = ((d[1] & 0x0F) << 8) | d[2]
+        return result
+    v = pos + 4 + 32
+    if bytes(buf[v:v + 4]) == b"VBRI":
+        return {"tag": b"VBRI", "delay": int.from_bytes(buf[v + 6:v + 8], "big"), "padding": 0,
+                "bytes": int.from_bytes(buf[v + 10:v + 14], "big"),
+                "frames": int.from_bytes(buf[v + 14:v + 18], "big")}
+    return None
+
+
+# Đi qua từng header frame từ pos tới end, yield (vị trí, info)
+def iter_frames(buf, pos, end):
+    while pos + 4 <= end:
+        info = parse_header(buf, pos)
+        if not info:
+            nxt, info = first_frame(buf, pos + 1, 4096)
+            if nxt is None or nxt >= end:
+                return
+            pos = nxt
+        if pos + info["length"] > end:
+            return
+        yield pos, info
+        pos += info["length"]
+
+
+def duration_from_buffer(buf):
+    start = id3v2_size(buf)
+    pos, info = first_frame(buf, start)
+    if pos is None:
+        return 0.0
+    vbr = vbr_header(buf, pos, info)
+    if vbr and vbr.get("frames"):
+        samples = vbr["frames"] * info["samples"] - vbr["delay"] - vbr["padding"]
+        return max(0, samples) / info["sample_rate"]
+    if vbr:
+        pos += info["length"]
+    samples = sum(f["samples"] for _, f in iter_frames(buf, pos, audio_end(buf)))
+    return samples / info["sample_rate"]
+
+
+def mp3_duration(path):
+    if os.path.getsize(path) == 0:
+        return 0.0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return duration_from_buffer(buf)
+
+
+# Cache thời lượng theo (đường dẫn, kích thước, mtime) để mỗi đoạn chỉ đọc một lần
+_durations = {}
+_durations_lock = threading.Lock()
+
+
+def duration_of(path):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _durations_lock:
+        if key in _durations:
+            return _durations[key]
+    duration = mp3_duration(path)
+    with _durations_lock:
+        _durations[key] = duration
+    return duration
+
+
+# ========================== #
+# 🔗 Nối MP3 theo frame, không mã hóa lại
+# ========================== #
+# Mỗi file được bỏ tag ID3/APE và frame Xing/Info/VBRI riêng, chỉ chép các frame âm thanh.
+# Đầu file kết quả là một frame Info/Xing duy nhất với tổng số frame, số byte và TOC,
+# được ghi lại sau cùng. Bộ nhớ dùng cố định, không phụ thuộc số đoạn.
+TOC_POINTS = 512        # số điểm (frame, byte) tối đa giữ lại để dựng TOC
+
+
+def _crc16(data, crc=0):
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def _xing_header_bytes(info, min_length):
+    version_bits = {1: 3, 2: 2, 25: 0}[info["version"]]
+    sr_index = _SAMPLE_RATES[info["version"]].index(info["sample_rate"])
+    for br_index in range(1, 15):
+        header = bytes([0xFF, 0xE0 | version_bits << 3 | (4 - info["layer"]) << 1 | 1,
+                        br_index << 4 | sr_index << 2, 0xC4 if info["mono"] else 0x44])
+        if parse_header(header)["length"] >= min_length:
+            return header
+    raise ValueError("Không đủ chỗ cho header Xing")
+
+
+class Mp3Concat:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.out = open(output_file, "wb")
+        self.info = None            # định dạng frame đầu tiên
+        self.header_len = 0
+        self.frames = 0
+        self.audio_bytes = 0
+        self.bitrates = set()
+        self.delay = None
+        self.padding = 0
+        self.encoder = b"LAME3.100"
+        self.points = []            # [(frame, byte)] đã lấy mẫu thưa để dựng TOC
+        self.stride = 1
+
+    def _start(self, info):
+        self.info = info
+        xing_at = 4 + _side_info(info)
+        # Info/Xing (120 byte) + phần mở rộng LAME (36 byte)
+        self.header = _xing_header_bytes(info, xing_at + 120 + 36)
+        self.header_len = parse_header(self.header)["length"]
+        self.out.write(bytes(self.header_len))
+
+    def _same_format(self, info):
+        return all(info[k] == self.info[k] for k in ("version", "layer", "sample_rate", "mono"))
+
+    def append(self, path):
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            self.append_buffer(buf)
+
+    def append_buffer(self, buf):
+        pos, info = first_frame(buf, id3v2_size(buf))
+        if pos is None:
+            return
+        if self.info is None:
+            self._start(info)
+        elif not self._same_format(info):
+            raise ValueError("Các file MP3 khác định dạng (sample rate/kênh), không thể nối trực tiếp")
+        vbr = vbr_header(buf, pos, info)
+        if vbr:
+            if self.delay is None:
+                self.delay = vbr["delay"]
+                x = pos + 4 + _side_info(info) + 8
+                flags = int.from_bytes(buf[x - 4:x], "big")
+                x += 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+                if buf[x:x + 4] in (b"LAME", b"Lavf", b"Lavc"):
+                    self.encoder = bytes(buf[x:x + 9])
+            self.padding = vbr["padding"]
+            pos += info["length"]
+        else:
+            if self.delay is None:
+                self.delay = 0
+            self.padding = 0
+        run_start = run_end = None
+        for fpos, finfo in iter_frames(buf, pos, audio_end(buf)):
+            if not self._same_format(finfo):
+                continue
+            if run_end != fpos:
+                if run_start is not None:
+                    self.out.write(buf[run_start:run_end])
+                run_start = fpos
+            run_end = fpos + finfo["length"]
+            self._add_frame(finfo)
+        if run_start is not None:
+            self.out.write(buf[run_start:run_end])
+
+    def _add_frame(self, finfo):
+        if self.frames % self.stride == 0:
+            self.points.append((self.frames, self.audio_bytes))
+            if len(self.points) >= TOC_POINTS:
+                self.points = self.points[::2]
+                self.stride *= 2
+        self.frames += 1
+        self.audio_bytes += finfo["length"]
+        self.bitrates.add(finfo["bitrate"])
+
+    def _toc(self, total_bytes):
+        toc, k = bytearray(100), 0
+        for i in range(100):
+            target = self.frames * i / 100
+            while k + 1 < len(self.points) and self.points[k + 1][0] <= target:
+                k += 1
+            byte = self.header_len + (self.points[k][1] if self.points else 0)
+            toc[i] = min(255, int(byte * 256 / total_bytes))
+        return bytes(toc)
+
+    def _xing_frame(self):
+        total = self.header_len + self.audio_bytes
+        frame = bytearray(self.header_len)
+        frame[:4] = self.header
+        x = 4 + _side_info(self.info)
+        frame[x:x + 4] = b"Xing" if len(self.bitrates) > 1 else b"Info"
+        frame[x + 4:x + 8] = (0x0F).to_bytes(4, "big")
+        frame[x + 8:x + 12] = self.frames.to_bytes(4, "big")
+        frame[x + 12:x + 16] = total.to_bytes(4, "big")
+        frame[x + 16:x + 116] = self._toc(total)
+        frame[x + 116:x + 120] = (0).to_bytes(4, "big")
+        lame = x + 120
+        frame[lame:lame + 9] = self.encoder.ljust(9, b" ")[:9]
+        delay, padding = min(self.delay or 0, 4095), min(self.padding, 4095)
+        frame[lame + 21:lame + 24] = ((delay << 12) | padding).to_bytes(3, "big")
+        frame[lame + 28:lame + 32] = total.to_bytes(4, "big")
+        frame[lame + 34:lame + 36] = _crc16(frame[:lame + 34]).to_bytes(2, "big")
+        return bytes(frame)
+
+    def close(self):
+        if self.info is not None:
+            self.out.seek(0)
+            self.out.write(self._xing_frame())
+        self.out.close()
+        return self.output_file
+
+    # Bỏ file đang ghi dở (job bị hủy giữa chừng)
+    def discard(self):
+        self.out.close()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.out.close()
+
+
+def concat_mp3(files, output_file):
+    with Mp3Concat(output_file) as merger:
+        for path in files:
+            merger.append(path)
+    return output_file
@@ -0,0 +1,91 @@
+# ========================== #
+# 🔀 Pipeline hậu xử lý
+# ========================== #
+# Mỗi đoạn tổng hợp xong được đưa ngay vào các stage (nối MP3, phụ đề, đóng gói),
+# mỗi stage chạy trên luồng riêng với hàng đợi giới hạn. Hàng đợi đầy thì put()
+# chờ (backpressure), nên hậu xử lý chạy song song với tổng hợp thay vì nối đuôi.
+import queue
+import threading
+import time
+
+import metrics
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, handle, finish=None, discard=None, maxsize=4):
+        self.name = name
+        self.handle = handle        # handle(item) cho từng đoạn, theo đúng thứ tự đưa vào
+        self.finish = finish        # gọi một lần khi pipeline đóng, kết quả lưu ở self.result
+        self.discard = discard      # gọi thay cho finish khi job bị hủy
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.result = None
+        self.busy = 0.0             # tổng thời gian xử lý, để biết stage nào chậm
+        self.aborted = False
+        self.thread = threading.Thread(target=self._loop, name=f"stage-{name}", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                break
+            # Stage đã lỗi vẫn tiếp tục lấy khỏi hàng đợi để không chặn các stage khác
+            if self.error is None:
+                t0 = time.time()
+                try:
+                    with metrics.timed(self.name):
+                        self.handle(item)
+                except Exception as e:
+                    self.error = e
+                self.busy += time.time() - t0
+        try:
+            if self.aborted or self.error is not None:
+                if self.discard:
+                    self.discard()
+            elif self.finish:
+                self.result = self.finish()
+        except Exception as e:
+            self.error = self.error or e
+
+
+class Pipeline:
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.stages = []
+        self.results = None
+
+    def stage(self, name, handle, finish=None, discard=None):
+        s = Stage(name, handle, finish, discard, self.maxsize)
+        self.stages.append(s)
+        return s
+
+    # Đưa một đoạn vào tất cả các stage; chờ nếu stage nào đó đang đầy
+    def put(self, item):
+        for s in self.stages:
+            s.queue.put(item)
+
+    # Đợi các stage xử lý hết và chạy finish. abort=True thì bỏ kết quả dở dang.
+    # Trả về {tên stage: kết quả}; lỗi của từng stage nằm trong self.errors.
+    def close(self, abort=False):
+        if self.results is not None:
+            return self.results
+        for s in self.stages:
+            s.aborted = abort
+            s.queue.put(_DONE)
+        for s in self.stages:
+            s.thread.join()
+        self.results = {s.name: s.result for s in self.stages}
+        return self.results
+
+    @property
+    def errors(self):
+        return {s.name: s.error for s in self.stages if s.error is not None}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(abort=exc_type is not None)
@@ -0,0 +1,92 @@
+# ========================== #
+# ⏱️ Giới hạn tốc độ gọi API
+# ========================== #
+# Token bucket cho từng key, backoff lũy thừa có jitter, đọc Retry-After,
+# và điều chỉnh số luồng theo AIMD: tăng dần khi chạy ổn, giảm một nửa khi gặp 429.
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+# Phân loại lỗi theo mã HTTP (None = lỗi kết nối/timeout)
+def classify(status):
+    if status == 200:
+        return "ok"
+    if status == 429:
+        return "rate_limit"
+    if status in (401, 403):
+        return "auth"
+    if status is None or status == 408 or status >= 500:
+        return "transient"
+    return "fatal"
+
+
+# Retry-After có thể là số giây hoặc một mốc thời gian HTTP
+def retry_after(headers):
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# "Full jitter": chờ ngẫu nhiên trong [0, min(cap, base * 2^attempt)]
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate                     # token/giây, None hoặc 0 = không giới hạn
+        self.capacity = burst or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.time()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    # Số giây phải chờ trước khi lấy được 1 token (0 = lấy được ngay)
+    def wait_time(self, now):
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if self.rate:
+            self._refill(now)
+            self.tokens -= 1
+
+
+class AimdLimiter:
+    def __init__(self, maximum, minimum=1, start=None, cooldown=2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.value = float(start or self.maximum)
+        self.cooldown = cooldown             # không giảm liên tiếp trong cùng một đợt 429
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self.value)
+
+    def on_success(self):
+        with self.lock:
+            self.value = min(self.maximum, self.value + 1.0 / max(1.0, self.value))
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.time()
+            if now - self.last_decrease >= self.cooldown:
+                self.value = max(self.minimum, self.value / 2)
+                self.last_decrease = now
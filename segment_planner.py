@@ -0,0 +1,135 @@
+# ========================== #
+# ⚖️ Chia đoạn cân bằng cho tổng hợp song song
+# ========================== #
+# Khi chạy nhiều luồng, thời gian cả job bằng thời gian của luồng xong muộn nhất.
+# Gom câu tham lam tới split_length để lại một đoạn cuối ngắn/dài lệch hẳn, nên ở đây
+# chọn số đoạn và ranh giới câu sao cho các đoạn dài gần bằng nhau, dựa trên mô hình
+# độ trễ latency = a + b * số ký tự đo từ các request trước (LatencyModel).
+import heapq
+import json
+import threading
+
+from synth_cache import atomic_write
+from text_splitter import iter_sentences
+
+DEFAULT_COEF = (0.8, 0.004)     # giây cố định mỗi request, giây mỗi ký tự khi chưa có số đo
+MIN_SAMPLES = 5
+
+
+class LatencyModel:
+    def __init__(self, path="tts_latency.json", keep=200):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.samples = {}           # model -> [[chars, seconds], ...] mới nhất ở cuối
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.samples = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    # Ghi một request thành công thật sự gọi API (không tính lần lấy từ cache)
+    def record(self, model, chars, seconds):
+        with self.lock:
+            rows = self.samples.setdefault(model, [])
+            rows.append([int(chars), round(float(seconds), 4)])
+            del rows[:-self.keep]
+            atomic_write(self.path, json.dumps(self.samples).encode("utf-8"))
+
+    # Hồi quy tuyến tính seconds = a + b * chars, rơi về DEFAULT_COEF nếu thiếu số đo
+    def coef(self, model):
+        with self.lock:
+            rows = list(self.samples.get(model, []))
+        if len(rows) < MIN_SAMPLES:
+            return DEFAULT_COEF
+        n = len(rows)
+        mx = sum(c for c, _ in rows) / n
+        my = sum(s for _, s in rows) / n
+        var = sum((c - mx) ** 2 for c, _ in rows)
+        if var == 0:
+            return DEFAULT_COEF
+        b = sum((c - mx) * (s - my) for c, s in rows) / var
+        a = my - b * mx
+        if b <= 0:
+            return (max(my, 0.01), 1e-6)
+        return (max(a, 0.0), b)
+
+
+# Gom câu liên tiếp, mỗi nhóm không quá cap ký tự. Trả về số nhóm.
+def _count_groups(lengths, cap):
+    groups, size = 0, 0
+    for n in lengths:
+        if groups and size + n <= cap:
+            size += n
+        else:
+            groups, size = groups + 1, n
+    return groups
+
+
+def _groups(lengths, cap):
+    out, cur, size = [], [], 0
+    for i, n in enumerate(lengths):
+        if cur and size + n > cap:
+            out.append(cur)
+            cur, size = [], 0
+        cur.append(i)
+        size += n
+    if cur:
+        out.append(cur)
+    return out
+
+
+# Giới hạn nhỏ nhất sao cho gom được thành không quá k nhóm
+def _min_cap(lengths, k, maxlen):
+    lo, hi = max(lengths), maxlen
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _count_groups(lengths, mid) <= k:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+# Thời gian xong job khi các đoạn được phát lần lượt cho `workers` luồng
+def makespan(sizes, workers, coef=DEFAULT_COEF):
+    a, b = coef
+    finish = [0.0] * max(1, min(workers, len(sizes)))
+    for n in sizes:
+        t = heapq.heappop(finish)
+        heapq.heappush(finish, t + a + b * n)
+    return max(finish) if sizes else 0.0
+
+
+# Chia text thành các đoạn ≤ maxlen theo ranh giới câu, chọn số đoạn cho thời gian
+# dự kiến nhỏ nhất với `workers` luồng; gần bằng nhau (trong 2%) thì chọn ít request hơn.
+# Trả về danh sách đoạn đã bỏ khoảng trắng hai đầu.
+def balance_segments(text, maxlen=500, workers=4, coef=DEFAULT_COEF):
+    sents = [s for s in iter_sentences(text, maxlen)]
+    lengths = [len(s) for s in sents]
+    if not lengths:
+        return []
+    workers = max(1, int(workers))
+    k_min = _count_groups(lengths, maxlen)
+    rounds = -(-k_min // workers)
+    # Ít đoạn hơn số luồng thì thử mọi k tới số luồng; nhiều hơn thì làm tròn lên bội số luồng
+    candidates = set(range(k_min, workers + 1)) | {k_min, rounds * workers}
+    best = None
+    for k in sorted(c for c in candidates if c <= len(lengths)):
+        cap = _min_cap(lengths, k, maxlen)
+        groups = _groups(lengths, cap)
+        t = makespan([sum(lengths[i] for i in g) for g in groups], workers, coef)
+        if best is None or t < best[0] * 0.98:
+            best = (t, groups)
+    chunks = ("".join(sents[i] for i in g).strip() for g in best[1])
+    return [c for c in chunks if c]
+
+
+# Hệ số dùng để chia đoạn cho một job. Ranh giới đoạn còn phụ thuộc số luồng, nên job
+# chạy tiếp dùng lại cả danh sách đoạn lưu trong manifest (JobManifest.saved_texts);
+# hệ số này chỉ còn tác dụng khi chủ động chia lại (rebalance).
+def job_coef(manifest, latency, model):
+    coef = manifest.meta.get("latency_coef") if manifest.has_progress() else None
+    coef = tuple(coef) if coef else (latency.coef(model) if latency else DEFAULT_COEF)
+    manifest.meta["latency_coef"] = list(coef)
+    return coef
@@ -0,0 +1,180 @@
+# ========================== #
+# 💾 Cache âm thanh trên đĩa
+# ========================== #
+# Khóa là SHA-256 của toàn bộ request (voice_id + payload), nên cùng văn bản,
+# giọng, model và voice_settings sẽ không tốn credit lần thứ hai.
+# Dung lượng bị giới hạn bởi max_bytes, file ít dùng nhất bị xóa trước (LRU theo mtime).
+# Nhiều tiến trình (job_queue work) dùng chung một thư mục: trước khi xóa bớt, dung lượng
+# được tính lại từ thư mục dưới khóa file, nên giới hạn áp cho cả thư mục chứ không
+# phải cho từng tiến trình.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows: không khóa, các tiến trình chỉ có thể xóa thừa vài file
+    fcntl = None
+
+SCAN_EVERY = 30.0       # giây; quét lại thư mục để thấy file do tiến trình khác thêm vào
+
+
+def cache_key(voice_id, payload):
+    blob = json.dumps({"voice_id": voice_id, "payload": payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+# Ghi file qua file tạm cùng thư mục rồi os.replace, crash giữa chừng không để lại file hỏng
+def atomic_copy(src, dst):
+    folder = os.path.dirname(os.path.abspath(dst))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def atomic_write(dst, data):
+    folder = os.path.dirname(os.path.abspath(dst))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class SynthCache:
+    def __init__(self, folder="tts_cache", max_bytes=2 * 1024 ** 3, ext=".mp3"):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ext = ext
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+
+    # Dựng lại index từ thư mục: tên file -> kích thước, thứ tự từ cũ nhất đến mới dùng nhất
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith("."):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue    # tiến trình khác vừa xóa
+            entries.append((st.st_mtime, entry.name, st.st_size))
+        self.index = OrderedDict()
+        self.total = 0
+        for _, name, size in sorted(entries):
+            self.index[name] = size
+            self.total += size
+        self.scanned = time.time()
+
+    # ext khác mặc định dùng cho file đi kèm cùng khóa (ví dụ ".json" chứa timestamp)
+    def _name(self, key, ext=None):
+        return key + (ext or self.ext)
+
+    def path(self, key, ext=None):
+        return os.path.join(self.folder, self._name(key, ext))
+
+    # count=False cho file đi kèm, để mỗi đoạn chỉ tính một lần trúng/trượt
+    def _lookup(self, name, count=True):
+        with self.lock:
+            path = os.path.join(self.folder, name)
+            if name not in self.index or not os.path.exists(path):
+                self._forget(name)
+                self.misses += count
+                return None
+            self.hits += count
+            self.index.move_to_end(name)
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            return path
+
+    # Tính một lần trượt mà không tra file (ví dụ thiếu file alignment đi kèm)
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    # Chép bản cache ra outname nếu có. Trả về True khi trúng cache.
+    def fetch(self, key, outname, ext=None):
+        path = self._lookup(self._name(key, ext))
+        if not path:
+            return False
+        try:
+            atomic_copy(path, outname)
+        except OSError:
+            return False
+        return True
+
+    def read(self, key, ext=None, count=True):
+        path = self._lookup(self._name(key, ext), count)
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def store(self, key, src, ext=None):
+        size = os.path.getsize(src)
+        if size == 0 or size > self.max_bytes:
+            return
+        atomic_copy(src, self.path(key, ext))
+        self._added(self._name(key, ext), size)
+
+    def store_bytes(self, key, data, ext=None):
+        if not data or len(data) > self.max_bytes:
+            return
+        atomic_write(self.path(key, ext), data)
+        self._added(self._name(key, ext), len(data))
+
+    def _added(self, name, size):
+        with self.lock:
+            self._forget(name)
+            self.index[name] = size
+            self.total += size
+            if self.total <= self.max_bytes and time.time() - self.scanned < SCAN_EVERY:
+                return
+            with _file_lock(os.path.join(self.folder, ".lock")):
+                self._scan()
+                while self.total > self.max_bytes and self.index:
+                    old, old_size = self.index.popitem(last=False)
+                    self.total -= old_size
+                    try:
+                        os.remove(os.path.join(self.folder, old))
+                    except OSError:
+                        pass
+
+    def _forget(self, name):
+        size = self.index.pop(name, None)
+        if size is not None:
+            self.total -= size
+
+    def summary(self):
+        return f"💾 Cache: {self.hits} trúng / {self.misses} trượt ({self.total / 1024 / 1024:.1f} MB)"
@@ -0,0 +1,363 @@
+# ========================== #
+# 🧵 Tổng hợp song song nhiều đoạn
+# ========================== #
+# Chạy nhiều request cùng lúc nhưng vẫn trả kết quả theo đúng thứ tự đoạn.
+# credit_pool là danh sách [key, credit] dùng chung, mọi thay đổi credit đều đi qua khóa.
+# Tốc độ gọi được điều tiết bởi rate_limit: token bucket mỗi key, Retry-After,
+# backoff có jitter cho lỗi tạm thời và AIMD cho tổng số luồng. Key lỗi được ngắt
+# bằng circuit breaker (key_health) thay vì loại bỏ vĩnh viễn.
+# shared (job_queue.CreditHolds) là phần credit giữ chung giữa nhiều tiến trình: mỗi lần
+# giữ/trả credit ở đây cũng được ghi vào đó, giữ không được thì coi như key hết credit.
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from job_manifest import mask_key
+from hedging import Race
+from key_health import CircuitBreaker
+from rate_limit import AimdLimiter, TokenBucket, backoff_delay, classify
+
+MAX_RETRIES = 3     # số lần thử lại lỗi tạm thời/429 trên cùng một key
+HEDGE_RETRY = 0.5   # giây giữa hai lần tìm key rảnh cho bản gửi thêm
+SHARED_POLL = 1.0   # giây chờ credit do tiến trình khác giữ được trả lại
+
+
+class SynthPool:
+    def __init__(self, credit_pool, workers=4, per_key=2, rate=None, shared=None):
+        self.credit_pool = credit_pool
+        self.shared = shared
+        self.workers = max(1, int(workers))
+        self.per_key = max(1, int(per_key))
+        n = len(credit_pool)
+        self.busy = [0] * n
+        self.breakers = [CircuitBreaker() for _ in range(n)]
+        self.outstanding = [0] * n          # credit đang giữ cho đoạn chưa xong (để khớp với credit từ server)
+        self.cool_until = [0.0] * n         # key tạm nghỉ do 429/lỗi tạm thời
+        self.failures = [0] * n             # số lỗi tạm thời liên tiếp của từng key
+        self.buckets = [TokenBucket(rate, self.per_key) for _ in range(n)]
+        self.limiter = AimdLimiter(min(self.workers, self.per_key * max(1, n)))
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    # Giữ trước credit theo kế hoạch phân bổ (key_scheduler.plan_keys).
+    # False nếu phần credit đó đã bị tiến trình khác giữ.
+    def reserve(self, j, need):
+        with self.cond:
+            return self._hold(j, need)
+
+    def _hold(self, j, need):
+        if self.shared and not self.shared.hold(self.credit_pool[j][0], need):
+            # Tiến trình khác đã giữ phần credit này: hạ credit cục bộ theo số liệu chung
+            avail = self.shared.available(self.credit_pool[j][0])
+            if avail is not None:
+                self.credit_pool[j][1] = avail
+            return False
+        self.credit_pool[j][1] -= need
+        self.outstanding[j] += need
+        return True
+
+    def _unhold(self, j, need, spent=False):
+        self.outstanding[j] = max(0, self.outstanding[j] - need)
+        if not spent and self.credit_pool[j][1] is not None:
+            self.credit_pool[j][1] += need
+        if self.shared:
+            self.shared.release(self.credit_pool[j][0], need, spent)
+
+    def _usable(self, j):
+        return not self.breakers[j].blocked()
+
+    def _ready(self, j, now):
+        return (self.busy[j] < self.per_key and self.cool_until[j] <= now
+                and self.buckets[j].wait_time(now) == 0 and self.breakers[j].allow(now))
+
+    # Thời gian chờ ngắn nhất cho tới khi một trong các key có thể sẵn sàng
+    def _next_wakeup(self, keys, now):
+        waits = [max(self.cool_until[j] - now, self.buckets[j].wait_time(now),
+                     (self.breakers[j].reopens_at() or now) - now) for j in keys]
+        waits = [w for w in waits if w > 0]
+        return min(waits) if waits else None
+
+    def _take(self, j, now):
+        self.busy[j] += 1
+        self.buckets[j].take(now)
+        self.breakers[j].on_take()
+
+    # Lấy một key còn đủ credit và sẵn sàng gọi, trừ trước credit cho đoạn này.
+    # prefer là key đã được giữ credit từ kế hoạch; nếu key đó chưa sẵn sàng mà key khác
+    # sẵn sàng và đủ credit thì chuyển phần giữ chỗ sang key kia.
+    # Trả về None nếu không còn key nào có thể dùng.
+    def acquire(self, need, tried=(), prefer=None):
+        with self.cond:
+            while True:
+                if self.stopped:
+                    return None
+                now = time.time()
+                if prefer in tried or (prefer is not None and not self._usable(prefer)):
+                    if prefer is not None and prefer not in tried:
+                        self._unhold(prefer, need)
+                    prefer = None
+                if sum(self.busy) >= self.limiter.limit:
+                    self.cond.wait(0.5)
+                    continue
+                if prefer is not None:
+                    if self._ready(prefer, now):
+                        self._take(prefer, now)
+                        return prefer
+                    j = self._best_free(need, tried, now)
+                    if j is not None:
+                        if self._hold(j, need):
+                            self._unhold(prefer, need)
+                            self._take(j, now)
+                            return j
+                        continue
+                    self.cond.wait(self._next_wakeup([prefer], now))
+                    continue
+                eligible = [j for j, (key, credit) in enumerate(self.credit_pool)
+                            if j not in tried and self._usable(j) and credit and need <= credit]
+                j = self._best_free(need, tried, now)
+                if j is not None:
+                    if self._hold(j, need):
+                        self._take(j, now)
+                        return j
+                    continue
+                # Chưa có key sẵn sàng, hoặc credit đang bị giữ bởi request khác có thể được hoàn lại
+                if not eligible and not any(self.busy):
+                    if self._wait_shared(need, tried):
+                        continue
+                    return None
+                self.cond.wait(self._next_wakeup(eligible, now))
+
+    # Hết credit cục bộ nhưng tiến trình khác còn giữ phần có thể được trả lại: cập nhật
+    # credit theo số liệu chung và chờ. False nếu không còn gì để chờ.
+    def _wait_shared(self, need, tried):
+        if not self.shared:
+            return False
+        waiting = False
+        for j, (key, credit) in enumerate(self.credit_pool):
+            if j in tried or not self._usable(j) or credit is None:
+                continue
+            avail, others = self.shared.state(key)
+            if avail is None:
+                continue
+            self.credit_pool[j][1] = avail
+            if avail >= need:
+                return True
+            waiting = waiting or avail + others >= need
+        if waiting:
+            self.cond.wait(SHARED_POLL)
+        return waiting
+
+    # Lấy ngay một key khác cho bản gửi thêm (hedging), không chờ. Không tính vào giới hạn
+    # AIMD: đoạn chậm thường xảy ra đúng lúc mọi luồng đều bận.
+    def try_acquire(self, need, exclude):
+        with self.cond:
+            if self.stopped:
+                return None
+            now = time.time()
+            j = self._best_free(need, exclude, now)
+            if j is None or not self._hold(j, need):
+                return None
+            self._take(j, now)
+            return j
+
+    # Key sẵn sàng có credit còn lại nhỏ nhất mà vẫn đủ cho đoạn (best-fit)
+    def _best_free(self, need, tried, now):
+        best = None
+        for j, (key, credit) in enumerate(self.credit_pool):
+            if j in tried or not self._usable(j) or not credit or need > credit or not self._ready(j, now):
+                continue
+            if best is None or credit < self.credit_pool[best][1]:
+                best = j
+        return best
+
+    # Trả key về pool sau một request. kind là kết quả của rate_limit.classify.
+    # Trả về số giây key phải nghỉ (0 nếu không nghỉ).
+    def release(self, j, need, kind, wait=None):
+        with self.cond:
+            self.busy[j] -= 1
+            pause = 0.0
+            if kind == "cancelled":
+                # Bản thua của hedging: coi như đã tốn credit, không tính là lỗi của key
+                self._unhold(j, need, spent=True)
+                self.cond.notify_all()
+                return pause
+            before = self.breakers[j].state
+            state = self.breakers[j].record(kind)
+            if state != before:
+                key = mask_key(self.credit_pool[j][0])
+                metrics.inc("tts_breaker_transitions_total", key=key, state=state)
+                metrics.event("breaker", key=key, state=state, reason=kind)
+            if kind == "ok":
+                self.failures[j] = 0
+                self._unhold(j, need, spent=True)
+                self.limiter.on_success()
+            else:
+                # Request lỗi không tốn credit
+                self._unhold(j, need)
+                if kind in ("rate_limit", "transient"):
+                    self.failures[j] += 1
+                    pause = wait if wait is not None else backoff_delay(self.failures[j])
+                    self.cool_until[j] = max(self.cool_until[j], time.time() + pause)
+                if kind == "rate_limit":
+                    self.limiter.on_throttle()
+            self.cond.notify_all()
+            return pause
+
+    # Chạy call(j) cho tới khi thành công, tự chọn key và thử lại theo loại lỗi.
+    # call(j) trả về (ok, stats) với stats có thể chứa "status" và "retry_after".
+    # Trả về chỉ số key đã thành công hoặc None.
+    # Có hedge (hedging.HedgePolicy) thì call(j, race) được gọi với một hedging.Race chung
+    # cho các bản của cùng đoạn, xem _hedged.
+    def run(self, need, call, prefer=None, log=None, hedge=None):
+        tried, retries = set(), {}
+        while True:
+            j = self.acquire(need, tried, prefer)
+            if j is None:
+                return None
+            prefer = None
+            if hedge is not None:
+                j, ok, kind, pause = self._hedged(j, need, call, hedge, tried, log)
+            else:
+                try:
+                    ok, stats = call(j)
+                except Exception:
+                    self.release(j, need, "transient")
+                    raise
+                kind = "ok" if ok else classify(stats.get("status"))
+                pause = self.release(j, need, kind, stats.get("retry_after"))
+            if ok:
+                return j
+            if kind in ("rate_limit", "transient"):
+                retries[j] = retries.get(j, 0) + 1
+                if retries[j] <= MAX_RETRIES:
+                    key = mask_key(self.credit_pool[j][0])
+                    metrics.inc("tts_retries_total", key=key, reason=kind)
+                    metrics.event("retry", key=key, reason=kind, attempt=retries[j], pause=round(pause, 3))
+                    if log:
+                        log(f"⏳ API #{j+1} {'bị giới hạn (429)' if kind == 'rate_limit' else 'lỗi tạm thời'}, thử lại sau {pause:.1f}s")
+                    continue
+            tried.add(j)
+
+    # Chạy call(j, race) trên luồng riêng; quá hedge.delay(need) giây mà chưa xong thì gửi
+    # thêm một bản trên key khác (nếu còn ngân sách và có key rảnh). Có bản thắng thì các
+    # bản còn lại bị cắt (race.cancel) và trả key về pool ngay, không chờ luồng của chúng.
+    # Trả về (key, thắng?, kind, pause) của bản thắng, hoặc của bản lỗi cuối cùng nếu
+    # không bản nào thành công.
+    def _hedged(self, j, need, call, hedge, tried, log):
+        race, results = Race(), queue.Queue()
+        settled, lock = set(), threading.Lock()
+
+        # Trả key k về pool đúng một lần
+        def settle(k, kind, wait=None):
+            with lock:
+                if k in settled:
+                    return None
+                settled.add(k)
+            return self.release(k, need, kind, wait)
+
+        def attempt(k):
+            try:
+                ok, stats = call(k, race)
+            except Exception:
+                ok, stats = False, {}
+            status = stats.get("status")
+            # Lỗi thật từ server (5xx, 401...) tính theo mã lỗi dù cancel đã bật
+            if ok:
+                kind = "ok"
+            elif status not in (None, 200) or not race.cancel.is_set():
+                kind = classify(status)
+            else:
+                kind = "cancelled"
+            pause = settle(k, kind, stats.get("retry_after"))
+            if pause is not None:
+                results.put((k, ok and race.winner == k, kind, pause))
+
+        threading.Thread(target=attempt, args=(j,), daemon=True).start()
+        running, launched = 1, [j]
+        delay = hedge.delay(need)
+        deadline, hedged = time.time() + delay, False
+        while True:
+            try:
+                k, won, kind, pause = results.get(timeout=None if hedged else max(0.0, deadline - time.time()))
+            except queue.Empty:
+                # Hết ngân sách thì chỉ chờ bản chính; chưa có key rảnh thì thử lại sau HEDGE_RETRY
+                if not hedge.reserve(need):
+                    hedged = True
+                    continue
+                k = self.try_acquire(need, tried | {j})
+                if k is None:
+                    hedge.unreserve(need)
+                    deadline = time.time() + HEDGE_RETRY
+                    continue
+                key = mask_key(self.credit_pool[k][0])
+                metrics.inc("tts_hedges_total", key=key, outcome="launched")
+                metrics.event("hedge", key=key, primary=mask_key(self.credit_pool[j][0]),
+                              chars=need, delay=round(delay, 3))
+                if log:
+                    log(f"🪁 API #{j+1} chậm hơn {delay:.1f}s, gửi thêm trên API #{k+1}")
+                threading.Thread(target=attempt, args=(k,), daemon=True).start()
+                launched.append(k)
+                running, hedged = running + 1, True
+                continue
+            running -= 1
+            if won or running == 0:
+                if won:
+                    # Bản thua đã bị cắt socket; slot, giới hạn AIMD và credit giữ được trả ngay
+                    for other in launched:
+                        settle(other, "cancelled")
+                if won and k != j:
+                    hedge.record_win()
+                    metrics.inc("tts_hedges_total", key=mask_key(self.credit_pool[k][0]), outcome="won")
+                return k, won, kind, pause
+
+    # Hoàn lại credit đã giữ khi đoạn không thực sự tốn credit (ví dụ lấy từ cache)
+    def refund(self, j, need):
+        with self.cond:
+            if self.credit_pool[j][1] is not None:
+                self.credit_pool[j][1] += need
+            if self.shared:
+                self.shared.refund(self.credit_pool[j][0], need)
+            self.cond.notify_all()
+
+    # Credit còn lại kể cả phần đang giữ cho các đoạn chưa chạy
+    def available(self, j):
+        with self.cond:
+            credit = self.credit_pool[j][1]
+            return None if credit is None else credit + self.outstanding[j]
+
+    # Kết quả kiểm tra /v1/user ở nền: ok=False là 401/403. credit từ server trừ đi phần
+    # đang giữ cho các đoạn chưa xong, để kế hoạch phân bổ vẫn đúng.
+    def update_health(self, j, ok, credit=None):
+        with self.cond:
+            before = self.breakers[j].state
+            state = self.breakers[j].probe(ok)
+            if state != before:
+                key = mask_key(self.credit_pool[j][0])
+                metrics.inc("tts_breaker_transitions_total", key=key, state=state)
+                metrics.event("breaker", key=key, state=state, reason="probe")
+            if ok and credit is not None and self.shared:
+                avail = self.shared.available(self.credit_pool[j][0], credit, fresh=True)
+                self.credit_pool[j][1] = credit - self.outstanding[j] if avail is None else avail
+            elif ok and credit is not None:
+                self.credit_pool[j][1] = credit - self.outstanding[j]
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    # fn(i, item) chạy trên các luồng; kết quả được yield theo đúng thứ tự i
+    def map_ordered(self, fn, items):
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=self.workers) as ex:
+            futures = [ex.submit(fn, i, item) for i, item in enumerate(items)]
+            try:
+                for i, fut in enumerate(futures):
+                    yield i, fut.result()
+            finally:
+                self.stop()
+                for fut in futures:
+                    fut.cancel()
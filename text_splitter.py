@@ -0,0 +1,127 @@
+# ========================== #
+# ✂️ Tách văn bản theo luồng
+# ========================== #
+# Đọc từng khối từ chuỗi, file hoặc iterator, cắt câu bằng một lần quét regex
+# nên thời gian tỉ lệ tuyến tính với độ dài văn bản và bộ nhớ chỉ giữ phần câu
+# đang dở. Giữ nguyên mọi ký tự và khoảng trắng; câu dài hơn giới hạn được cắt
+# tại dấu phẩy/khoảng trắng gần nhất, không bao giờ vượt maxlen.
+import re
+import zlib
+
+CHUNK = 64 * 1024
+
+_CLOSERS = "\"'”’»)]}」』）】〕》〉"
+# Dấu câu CJK kết thúc câu ngay, không cần khoảng trắng phía sau;
+# dấu câu kiểu Latin (và Hindi, Ả Rập, Armenia, Ethiopia...) phải theo sau bởi khoảng trắng
+# để không cắt nhầm "3.14" hay "v2.5".
+_END = re.compile(
+    r"(?:[。！？｡]+[" + re.escape(_CLOSERS) + r"]*\s*)"
+    r"|(?:[.!?…‼⁇⁈⁉।॥؟۔։።]+[" + re.escape(_CLOSERS) + r"]*(?:\s+|$))"
+)
+_SOFT = re.compile(r"[,;:，、；：—–]\s*|\s+")
+
+
+def _pieces(source, chunk_size):
+    if isinstance(source, str):
+        for k in range(0, len(source), chunk_size):
+            yield source[k:k + chunk_size]
+    elif hasattr(source, "read"):
+        while True:
+            piece = source.read(chunk_size)
+            if not piece:
+                return
+            yield piece
+    else:
+        yield from source
+
+
+# Vị trí cắt cho đoạn không có dấu kết thúc câu: sau dấu phẩy/khoảng trắng cuối cùng
+# trong giới hạn, hoặc cắt cứng đúng max_len (ví dụ văn bản CJK không có khoảng trắng)
+def _hard_cut(buf, max_len):
+    cut = 0
+    for m in _SOFT.finditer(buf, 0, max_len):
+        cut = m.end()
+    return cut if cut > max_len // 2 else max_len
+
+
+# Sinh ra từng câu (kèm khoảng trắng theo sau), ghép lại đúng bằng văn bản gốc.
+# max_len: câu dài hơn sẽ được chia nhỏ.
+def iter_sentences(source, max_len=None, chunk_size=CHUNK):
+    buf, scan = "", 0
+    for piece in _pieces(source, chunk_size):
+        buf += piece
+        start, pending = 0, None
+        for m in _END.finditer(buf, scan):
+            # Match chạm cuối buffer có thể còn kéo dài sang khối sau, quét lại từ đầu match
+            if m.end() >= len(buf):
+                pending = m.start()
+                break
+            while max_len and m.end() - start > max_len:
+                cut = start + _hard_cut(buf[start:start + max_len], max_len)
+                yield buf[start:cut]
+                start = cut
+            yield buf[start:m.end()]
+            start = m.end()
+        while max_len and len(buf) - start > max_len:
+            cut = start + _hard_cut(buf[start:start + max_len], max_len)
+            yield buf[start:cut]
+            start = cut
+        buf = buf[start:]
+        scan = max(0, pending - start) if pending is not None else max(0, len(buf) - 8)
+    while max_len and len(buf) > max_len:
+        cut = _hard_cut(buf[:max_len], max_len)
+        yield buf[:cut]
+        buf = buf[cut:]
+    if buf:
+        yield buf
+
+
+# Gom câu thành các đoạn không quá maxlen ký tự (sau khi bỏ khoảng trắng hai đầu).
+# Không sinh đoạn rỗng.
+def iter_chunks(source, maxlen=500, chunk_size=CHUNK):
+    parts, size = [], 0
+    for s in iter_sentences(source, maxlen, chunk_size):
+        if parts and size + len(s.rstrip()) > maxlen:
+            yield "".join(parts).strip()
+            parts, size = [], 0
+        if not parts:
+            s = s.lstrip()
+            if not s:
+                continue
+        parts.append(s)
+        size += len(s)
+    if parts:
+        yield "".join(parts).strip()
+
+
+# Gom câu thành đoạn với ranh giới neo theo nội dung: chỉ cắt sau câu "neo" (hết đoạn
+# văn, hoặc crc32 của câu chia hết cho ANCHOR_EVERY) khi đoạn đã đủ min_len, hoặc khi
+# câu kế tiếp làm vượt maxlen. Ranh giới chỉ phụ thuộc các câu từ lần cắt trước, nên
+# sửa một chỗ chỉ làm đổi vài đoạn quanh đó; các đoạn sau lần neo kế tiếp giữ nguyên.
+ANCHOR_EVERY = 4
+
+
+def _is_anchor(sentence):
+    if sentence[len(sentence.rstrip()):].count("\n") >= 2:
+        return True
+    return zlib.crc32(sentence.strip().encode("utf-8")) % ANCHOR_EVERY == 0
+
+
+def iter_anchored(source, maxlen=500, min_len=None, chunk_size=CHUNK):
+    min_len = maxlen // 2 if min_len is None else min_len
+    parts, size = [], 0
+    for s in iter_sentences(source, maxlen, chunk_size):
+        if parts and size + len(s.rstrip()) > maxlen:
+            yield "".join(parts).strip()
+            parts, size = [], 0
+        if not parts:
+            s = s.lstrip()
+            if not s:
+                continue
+        parts.append(s)
+        size += len(s)
+        if size >= min_len and _is_anchor(s):
+            yield "".join(parts).strip()
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts).strip()
@@ -0,0 +1,782 @@
+# ========================== #
+# ⚙️ Lõi tổng hợp giọng nói (không cần notebook)
+# ========================== #
+# Tách văn bản, kiểm tra credit, gọi API, dựng phụ đề và nối file dùng chung cho
+# app3/app4 và chạy được từ dòng lệnh trên server:
+#   python tts_engine.py input.txt --keys keys.txt --voice VOICE_ID --out output_audio
+# Không import IPython/ipywidgets/google.colab; http_pool (requests) chỉ được import
+# khi thực sự gọi API để khởi động nhanh.
+import base64
+import json
+import os
+import re
+import threading
+import time
+
+import audio_formats
+import metrics
+from alignment import save_alignment, load_alignment, alignment_path, alignment_cues
+from mp3_tools import concat_mp3
+from rate_limit import retry_after
+from synth_cache import SynthCache, cache_key
+from job_manifest import text_hash
+from text_splitter import iter_chunks, iter_anchored
+from segment_planner import LatencyModel, balance_segments, job_coef
+from hedging import HedgePolicy
+from key_health import CreditLedger, CreditRefresher, REFRESH, load_credits
+from live_output import LiveOutput, target_duration
+
+CJK_LANGS = ('ja', 'zh', 'ko')
+
+
+# ========================== #
+# ✂️ Tách văn bản
+# ========================== #
+# text có thể là chuỗi, file đang mở hoặc iterator các khối chuỗi (xem text_splitter)
+def split_text(text, maxlen=500):
+    return list(iter_chunks(text, maxlen))
+
+def split_text_to_blocks(text, max_chars=5000):
+    return list(iter_chunks(text, max_chars))
+
+
+# ========================== #
+# 🔉 Gọi API ElevenLabs
+# ========================== #
+# Kiểu app3: trả về True hoặc (False, thông báo lỗi)
+def gen_audio(text, api_key, voice_id, model_id, settings, outname, stream=False, stats=None, cache=None, align=False, ssml=False,
+              output_format=None, cancel=None):
+    import http_pool
+    payload = {
+        "text": text,
+        "model_id": model_id,
+        "voice_settings": settings,
+        "text_type": "ssml" if ssml or text.strip().lower().startswith("<speak>") else "plain"
+    }
+    # output_format đi theo query string; định dạng mặc định giữ nguyên khóa cache cũ
+    params = audio_formats.request_params(output_format)
+    key = cache_key(voice_id, dict(payload, **params) if params else payload)
+    ext = audio_formats.extension(output_format)
+    # Ở chế độ timestamp chỉ dùng cache khi có cả file alignment đi kèm
+    cached_align = cache.read(key, ".json", count=False) if cache and align else None
+    if cache and align and not cached_align:
+        cache.miss()
+    if cache and (cached_align or not align) and cache.fetch(key, outname, ext):
+        if cached_align: save_alignment(outname, json.loads(cached_align))
+        if stats is not None: stats["cached"] = True
+        return True
+    alignment = None
+    if stream and align:
+        r, ttfa, alignment = http_pool.stream_timestamps_to_file(api_key, f"/v1/text-to-speech/{voice_id}/stream/with-timestamps", outname, json=payload, params=params, cancel=cancel)
+        if stats is not None: stats["ttfa"] = ttfa
+    elif stream:
+        r, ttfa = http_pool.stream_to_file(api_key, f"/v1/text-to-speech/{voice_id}/stream", outname, json=payload, params=params, cancel=cancel)
+        if stats is not None: stats["ttfa"] = ttfa
+    elif align:
+        r = http_pool.post(api_key, f"/v1/text-to-speech/{voice_id}/with-timestamps", json=payload, params=params, cancel=cancel)
+    else:
+        r = http_pool.post(api_key, f"/v1/text-to-speech/{voice_id}", json=payload, params=params, cancel=cancel)
+    if stats is not None:
+        stats["status"], stats["retry_after"] = r.status_code, retry_after(r.headers)
+    if r.status_code == 200:
+        if align and not stream:
+            data = r.json()
+            alignment = data.get("alignment")
+            with open(outname, "wb") as f: f.write(base64.b64decode(data["audio_base64"]))
+        elif not stream:
+            with open(outname, "wb") as f: f.write(r.content)
+        if alignment and alignment.get("characters"):
+            save_alignment(outname, alignment)
+        elif os.path.exists(alignment_path(outname)):
+            os.remove(alignment_path(outname))
+        if cache:
+            cache.store(key, outname, ext)
+            if alignment and alignment.get("characters"): cache.store_bytes(key, json.dumps(alignment, ensure_ascii=False).encode("utf-8"), ".json")
+        return True
+    else:
+        try: return False, r.json().get("detail", {}).get("message", "Unknown error")
+        except: return False, "Unknown error"
+
+# Tên model hiển thị trong app4; generate_voice cũng nhận thẳng model_id ("eleven_...")
+APP4_MODELS = ("Zilankhulo zambiri v2", "Flash v2.5", "Turbo v2.5")
+
+# Kiểu app4: trả về đường dẫn (có outname) hoặc bytes, None nếu lỗi
+def generate_voice(text, api_key, voice_id, model_version, stability=0.3, similarity=0.75, style=None, speed=None, speaker_boost=True, log=print, outname=None, stream=False, stats=None, cache=None,
+                   output_format=None, cancel=None):
+    import http_pool
+    # Xác định model dựa trên phiên bản đã chọn
+    models = {
+        "Zilankhulo zambiri v2": "eleven_multilingual_v2",
+        "Zilankhulo zambiri v2": "eleven_v3",
+        "Turbo v2.5": "eleven_turbo_v2"
+    }
+    model_id = model_version if model_version.startswith("eleven_") else models.get(model_version, "eleven_multilingual_v2")
+
+    voice_settings = {
+        "stability": float(stability),
+        "similarity_boost": float(similarity),
+        "use_speaker_boost": bool(speaker_boost)
+    }
+
+    if style is not None and 0.0 <= style <= 1.0:
+        voice_settings["style"] = float(style)
+    if speed is not None and 0.5 <= speed <= 2.0:
+        voice_settings["speed"] = float(speed)
+
+    payload = {
+        "text": text,
+        "model_id": model_id,
+        "voice_settings": voice_settings
+    }
+
+    params = audio_formats.request_params(output_format)
+    key = cache_key(voice_id, dict(payload, **params) if params else payload)
+    ext = audio_formats.extension(output_format)
+    if cache:
+        if outname and cache.fetch(key, outname, ext):
+            log("💾 Lấy từ cache")
+            if stats is not None:
+                stats["cached"] = True
+            return outname
+        if not outname:
+            data = cache.read(key, ext)
+            if data:
+                log("💾 Lấy từ cache")
+                if stats is not None:
+                    stats["cached"] = True
+                return data
+
+    try:
+        start_time = time.time()
+        ttfa = None
+        if stream and outname:
+            response, ttfa = http_pool.stream_to_file(api_key, f"/v1/text-to-speech/{voice_id}/stream", outname, json=payload, params=params, cancel=cancel)
+        else:
+            response = http_pool.post(api_key, f"/v1/text-to-speech/{voice_id}", json=payload, params=params, cancel=cancel)
+        elapsed_time = time.time() - start_time
+        if stats is not None:
+            stats["status"], stats["retry_after"] = response.status_code, retry_after(response.headers)
+
+        if response.status_code != 200:
+            error_msg = f"Lỗi API ({response.status_code}): "
+            try:
+                error_data = response.json()
+                error_msg += error_data.get('detail', {}).get('message', 'Unknown error')
+            except:
+                error_msg += response.text[:200]
+            log(error_msg)
+
+            if response.status_code == 401:
+                log("\n⚠️ QUAN TRỌNG: API key của bạn có thể đã bị chặn")
+                log("→ Giải pháp: Tạo API key mới hoặc nâng cấp tài khoản trả phí")
+
+            return None
+
+        if ttfa is not None:
+            log(f"✅ Tạo thành công trong {elapsed_time:.2f}s (âm thanh đầu tiên sau {ttfa:.2f}s)")
+        else:
+            log(f"✅ Tạo thành công trong {elapsed_time:.2f}s")
+        # Có outname thì ghi thẳng ra file và trả về đường dẫn, không thì trả về bytes như cũ
+        if outname:
+            if not stream:
+                with open(outname, "wb") as f:
+                    f.write(response.content)
+            if cache:
+                cache.store(key, outname, ext)
+            return outname
+        if cache:
+            cache.store_bytes(key, response.content, ext)
+        return response.content
+    except Exception as e:
+        log(f"Lỗi kết nối: {str(e)}")
+        return None
+
+
+# ========================== #
+# 📜 Phụ đề
+# ========================== #
+def convert_time(t):
+    ms = int((t - int(t)) * 1000)
+    h, m, s = int(t // 3600), int(t % 3600 // 60), int(t % 60)
+    return f"{h:02}:{m:02}:{s:02},{ms:03}"
+
+def ultra_split(text, max_unit=5, lang='en'):
+    items = list(text.strip()) if lang in CJK_LANGS else text.strip().split()
+    chunks, temp = [], []
+    for item in items:
+        temp.append(item)
+        if len(temp) >= max_unit:
+            chunks.append(''.join(temp) if lang in CJK_LANGS else ' '.join(temp))
+            temp = []
+    if temp:
+        chunks.append(''.join(temp) if lang in CJK_LANGS else ' '.join(temp))
+    return chunks
+
+def write_cue(srt, index, start, end, text):
+    srt.write(f"{index}\n{convert_time(start)} --> {convert_time(end)}\n{text}\n\n")
+
+# Đọc thời lượng từ header MP3, có bấm giờ vào số liệu (bước "decode")
+def probe_duration(path, output_format=None):
+    with metrics.timed("decode"):
+        return audio_formats.duration(path, output_format)
+
+# Ghi phụ đề dần theo từng đoạn, đoạn sau nối tiếp thời gian của đoạn trước.
+# Đoạn có file timestamp (segN.json) dùng thời gian thật của từng từ,
+# đoạn không có thì chia thời lượng theo số ký tự như trước.
+class SubtitleWriter:
+    def __init__(self, srt_path, lang="en", unit=3, manifest=None, output_format=None):
+        self.srt_path = srt_path
+        self.output_format = output_format
+        self.lang, self.unit, self.manifest = lang, unit, manifest
+        self.srt = open(srt_path, "w", encoding="utf-8")
+        self.current_time, self.index = 0.0, 1
+
+    def add(self, i, para, path):
+        aligned = load_alignment(path)
+        duration = self.manifest.duration(i) if self.manifest else None
+        if duration is None:
+            duration = probe_duration(path, self.output_format)
+            if self.manifest: self.manifest.set_duration(i, duration)
+        if aligned:
+            for u, start, end in alignment_cues(aligned, self.unit, self.lang):
+                write_cue(self.srt, self.index, self.current_time + start, self.current_time + end, u)
+                self.index += 1
+        else:
+            units = ultra_split(para, self.unit, self.lang)
+            total_chars = sum(len(u) for u in units)
+            t = self.current_time
+            for u in units:
+                du = duration * (len(u) / total_chars)
+                write_cue(self.srt, self.index, t, t + du, u)
+                t += du
+                self.index += 1
+        self.current_time += duration
+
+    def close(self):
+        self.srt.close()
+        return self.srt_path
+
+    def discard(self):
+        self.srt.close()
+        if os.path.exists(self.srt_path):
+            os.remove(self.srt_path)
+
+def generate_subtitles(paragraphs, folder="output_audio", file="output.srt", lang="en", unit=3, manifest=None):
+    writer = SubtitleWriter(os.path.join(folder, file), lang, unit, manifest)
+    for i, para in enumerate(paragraphs):
+        writer.add(i, para, os.path.join(folder, f"seg{i+1}.mp3"))
+    return writer.close()
+
+
+# ========================== #
+# 🔊 Gộp file âm thanh
+# ========================== #
+def merge_audio_files(files, output_file="merged_voice.mp3"):
+    # Nối trực tiếp các frame MP3, không giải mã/mã hóa lại
+    return concat_mp3(files, output_file)
+
+
+# ========================== #
+# 🚀 Chạy cả job (app3 và dòng lệnh)
+# ========================== #
+# Tên file theo hash văn bản (chế độ incremental). Đoạn trùng nội dung (tiêu đề lặp,
+# điệp khúc) được đánh số theo lần xuất hiện để mỗi đoạn có file riêng, không ghi đè nhau;
+# lần xuất hiện đầu giữ tên seg_<hash> như cũ.
+def hashed_names(texts, folder, ext):
+    seen, names = {}, []
+    for text in texts:
+        h = text_hash(text)[:16]
+        k = seen.get(h, 0)
+        seen[h] = k + 1
+        names.append(os.path.join(folder, f"seg_{h}_{k}{ext}" if k else f"seg_{h}{ext}"))
+    return names
+
+# Tạo folder/seg{i}.mp3 (seg_<hash>[_k].mp3 khi incremental), full.mp3 và output.srt.
+# Chạy lại trên cùng văn bản dùng lại đúng danh sách đoạn của lần trước (lưu trong manifest),
+# kể cả khi đổi số key/luồng; rebalance=True để chia lại từ đầu.
+# on_plan(paragraphs) được gọi khi danh sách đoạn thay đổi, on_segment(i, para, path)
+# khi mỗi đoạn xong theo thứ tự, on_keys(credit_pool) sau khi kiểm tra credit
+# (danh sách [key, credit] được cập nhật trong lúc chạy).
+# Trả về dict gồm paragraphs, files (file từng đoạn), audio, srt, stopped (hết quota giữa chừng) và ok.
+def run_job(text, api_keys, voice_id, model_id, settings, folder="output_audio", maxlen=500,
+            ssml=False, stream=False, align=True, workers=4, per_key=2, rate=None, cache=None,
+            lang="en", unit=3, log=print, on_plan=None, on_segment=None, balance=True, latency=None,
+            incremental=False, output_format=None, on_keys=None, ledger=None, refresh=REFRESH, hedge=0,
+            live=False, on_live=None, rebalance=False, shared=None):
+    import http_pool
+    from job_manifest import HashedSource, JobManifest
+    from key_scheduler import plan_keys
+    from pipeline import Pipeline
+    from synth_pool import SynthPool
+
+    os.makedirs(folder, exist_ok=True)
+    params = {"voice_id": voice_id, "model_id": model_id, "settings": settings, "ssml": ssml}
+    if audio_formats.request_params(output_format):
+        params["output_format"] = output_format
+    manifest = JobManifest(folder, params)
+    # Sửa văn bản rồi chạy lại: ranh giới neo theo nội dung nên chỉ vài đoạn quanh chỗ sửa
+    # thay đổi, file đặt tên theo hash nên đoạn giữ nguyên được dùng lại dù đổi vị trí.
+    # Không thì chia đoạn cân bằng theo số luồng và độ trễ đo được, hoặc gom tham lam như cũ.
+    mode = "incremental" if incremental else "balance" if balance else "greedy"
+    source = HashedSource(text, maxlen, mode)
+    if incremental:
+        paragraphs = list(iter_anchored(source, maxlen))
+    elif balance:
+        concurrency = min(workers, per_key * max(1, len(api_keys)))
+        paragraphs = balance_segments(source, maxlen, concurrency, job_coef(manifest, latency, model_id))
+    else:
+        paragraphs = split_text(source, maxlen)
+    saved = None if rebalance else manifest.saved_texts(source.hexdigest())
+    if saved:
+        paragraphs = saved
+        log(f"📋 Giữ cách chia {len(paragraphs)} đoạn của lần chạy trước")
+    if on_plan: on_plan(paragraphs)
+    result = {"paragraphs": paragraphs, "files": [], "audio": None, "srt": None, "stopped": False, "ok": False}
+
+    log("🔍 Kiểm tra API:")
+    http_pool.prewarm(api_keys, per_key)
+    # Credit còn hạn trong ledger được dùng ngay, các key còn lại được hỏi song song
+    credit_pool = []
+    for i, (key, (credit, status)) in enumerate(zip(api_keys, load_credits(api_keys, ledger))):
+        # shared (job_queue): trừ phần credit các tiến trình worker khác đang giữ
+        if shared and credit is not None:
+            credit = shared.available(key, credit, fresh=status == 200)
+        credit_pool.append([key, credit])
+        cached = " (ledger)" if status == "cache" else ""
+        log(f"🔑 API #{i+1}: {credit:,} ký tự{cached}" if credit else f"❌ API #{i+1} lỗi ({status or 'kết nối'})")
+    if on_keys: on_keys(credit_pool)
+
+    ext = audio_formats.extension(output_format)
+    if incremental:
+        names = hashed_names(paragraphs, folder, ext)
+        filename = lambda i: names[i]
+    else:
+        filename = lambda i: os.path.join(folder, f"seg{i+1}{ext}")
+
+    # Lập kế hoạch key cho từng đoạn trước khi chạy, tách lại đoạn nếu cần để vừa credit còn thừa
+    plan, split_count = plan_keys(paragraphs, [c for _, c in credit_pool], skip=manifest.reusable(paragraphs, filename))
+    paragraphs = result["paragraphs"] = [t for t, _ in plan]
+    assigned = [j for _, j in plan]
+    manifest.save_texts(source.hexdigest(), paragraphs)
+    if incremental and split_count:
+        names = hashed_names(paragraphs, folder, ext)
+    if split_count:
+        log(f"✂️ Tách lại {split_count} đoạn theo câu để vừa credit còn lại của các key")
+        if on_plan: on_plan(paragraphs)
+    for j in range(len(credit_pool)):
+        mine = [len(paragraphs[i]) for i, k in enumerate(assigned) if k == j]
+        if mine:
+            log(f"🗂️ API #{j+1}: {len(mine)} đoạn / {sum(mine):,} ký tự")
+    # Không đủ credit cho mọi đoạn còn thiếu: vẫn tạo lần lượt các đoạn có key trước đoạn
+    # thiếu đầu tiên (stop) và ghi vào manifest, nhưng không đụng tới file gộp/phụ đề cũ;
+    # lần chạy sau (thêm key) tiếp tục từ đó
+    done = manifest.reusable(paragraphs, filename)
+    missing = [i for i, j in enumerate(assigned) if j is None and i not in done]
+    stop = missing[0] if missing else len(paragraphs)
+    if missing:
+        log(f"⛔ Không còn API đủ quota cho {len(missing)} đoạn ({sum(len(paragraphs[i]) for i in missing):,} ký tự)!")
+        if all(i in done for i in range(stop)):
+            log("💾 Tiến độ đã được lưu, thêm key rồi chạy lại để tiếp tục.")
+            result["stopped"] = True
+            return result
+        log(f"⏩ Vẫn tạo các đoạn tới đoạn {stop}, giữ nguyên file gộp và phụ đề cũ")
+
+    reused = manifest.plan(paragraphs, filename)
+    result["files"] = [filename(i) for i in range(len(paragraphs))]
+    first = manifest.first_pending()
+    if incremental:
+        # Xóa file của các đoạn đã bị sửa/xóa; cache (nếu bật) vẫn giữ bản cũ
+        obsolete = manifest.obsolete()
+        for name in obsolete:
+            for path in (os.path.join(folder, name), alignment_path(os.path.join(folder, name))):
+                if os.path.exists(path):
+                    os.remove(path)
+        if manifest.previous:
+            log(f"✏️ Giữ nguyên {reused}/{len(paragraphs)} đoạn, tạo lại {len(paragraphs) - reused} đoạn"
+                f", bỏ {len(obsolete)} đoạn cũ")
+    elif reused and first is not None:
+        log(f"♻️ Dùng lại {reused}/{len(paragraphs)} đoạn đã tạo, tiếp tục từ đoạn {first + 1}")
+    elif reused:
+        log(f"♻️ Cả {reused} đoạn đã có sẵn, chỉ tạo lại file gộp và phụ đề")
+
+    # Chỉ xóa file gộp/phụ đề; các đoạn đã xong được giữ lại để chạy tiếp
+    if not missing:
+        for f in ("full.mp3", "full.opus", "full.wav", "output.srt", "list.txt"):
+            if os.path.exists(os.path.join(folder, f)):
+                os.remove(os.path.join(folder, f))
+
+    pool = SynthPool(credit_pool, workers=workers, per_key=per_key, rate=rate, shared=shared)
+    # hedge: tỉ lệ ký tự của job được phép gửi thêm cho đoạn chậm (0 = tắt)
+    policy = HedgePolicy(latency, model_id, int(hedge * sum(len(p) for p in paragraphs))) if hedge else None
+    for i, j in enumerate(assigned[:stop]):
+        if j is not None and not manifest.is_done(i) and not pool.reserve(j, len(paragraphs[i])):
+            assigned[i] = None
+
+    def synth(i, para):
+        if manifest.is_done(i):
+            return True, ["♻️ Dùng lại file đã tạo"]
+        logs, stats = [], {}
+        outname = filename(i)
+
+        # race (hedging.Race) có khi bật hedge: mỗi bản ghi ra file tạm riêng, bản thua bị bỏ qua
+        def call(j, race=None):
+            st = {}
+            out = race.path(outname, j) if race else outname
+            # Bản hedge thắng vẫn tính từ lúc gửi bản đầu tiên của đoạn
+            t0 = race.started if race else time.time()
+            try:
+                success = gen_audio(para, credit_pool[j][0], voice_id, model_id, settings, out, stream=stream, stats=st, cache=cache, align=align, ssml=ssml,
+                                    output_format=output_format, cancel=race.cancel if race else None)
+            except Exception as e:
+                success = False, str(e)
+            if race and not race.finish(j, success is True, out, outname):
+                return success is True, st
+            if success is not True:
+                logs.append(f"❌ API #{j+1} lỗi: {success[1]}")
+            elif latency and not st.get("cached"):
+                latency.record(model_id, len(para), time.time() - t0)
+            stats.clear()
+            stats.update(st)
+            return success is True, st
+
+        j = pool.run(len(para), call, prefer=assigned[i], log=logs.append, hedge=policy)
+        if j is None:
+            manifest.failed(i, error="no quota")
+            return False, logs
+        manifest.done(i, credit_pool[j][0], outname, duration=probe_duration(outname, output_format))
+        if stats.get("cached"):
+            metrics.inc("tts_cache_hits_total")
+            pool.refund(j, len(para))
+            logs.append("💾 Lấy từ cache")
+        if stats.get("ttfa") is not None:
+            logs.append(f"📡 Âm thanh đầu tiên sau {stats['ttfa']:.2f}s")
+        return True, logs
+
+    # Nối âm thanh và ghi phụ đề chạy song song với tổng hợp, mỗi đoạn xong là xử lý ngay.
+    # PCM được nối thành full.wav rồi mã hóa một lần sau cùng. Chỉ tạo một phần (missing)
+    # thì pipeline không có stage nào.
+    pipe = Pipeline()
+    if not missing:
+        merger = audio_formats.open_concat(output_format, os.path.join(folder, "full" + audio_formats.merged_extension(output_format)))
+        subs = SubtitleWriter(os.path.join(folder, "output.srt"), lang, unit, manifest, output_format)
+        pipe.stage("merge", lambda item: merger.append(item[2]), merger.close, merger.discard)
+        pipe.stage("srt", lambda item: subs.add(*item), subs.close, subs.discard)
+    # live: nghe dần file gộp (playlist HLS + luồng nối tiếp) trong lúc các đoạn sau còn đang tạo
+    if live and not missing:
+        speed = settings.get("speed") if isinstance(settings, dict) else None
+        live_out = LiveOutput(folder, output_format, target=target_duration(paragraphs, speed))
+        pipe.stage("live", lambda item: live_out.append(item[2]), live_out.close, live_out.discard)
+        if on_live: on_live(live_out)
+
+    # Credit và trạng thái key được làm mới ở nền trong lúc tổng hợp
+    # Lỗi bất ngờ hoặc Ctrl+C giữa chừng: with pipe dừng các stage và bỏ file gộp/phụ đề dở
+    refresher = CreditRefresher(pool, ledger, refresh).start()
+    with pipe:
+        try:
+            for i, (ok, logs) in pool.map_ordered(synth, paragraphs[:stop]):
+                log(f"\n📘 Đoạn {i+1}: {paragraphs[i][:40]}...")
+                for line in logs: log(line)
+                if not ok:
+                    pool.stop()
+                    pipe.close(abort=True)
+                    log("⛔ Không còn API đủ quota!")
+                    log("💾 Tiến độ đã được lưu, chạy lại để tiếp tục từ đoạn còn thiếu.")
+                    result["stopped"] = True
+                    return result
+                pipe.put((i, paragraphs[i], filename(i)))
+                if on_segment: on_segment(i, paragraphs[i], filename(i))
+        finally:
+            refresher.stop()
+    if policy and policy.launched:
+        log(policy.summary())
+    if missing:
+        pipe.close()
+        log(f"💾 Đã lưu {stop} đoạn đầu, thêm key rồi chạy lại để tạo tiếp từ đoạn {stop + 1}.")
+        result["stopped"] = True
+        return result
+
+    results = pipe.close()
+    for name, e in pipe.errors.items():
+        log(f"❌ Lỗi {'nối file' if name == 'merge' else 'tạo phụ đề'}: {e}")
+    with metrics.timed("encode"):
+        audio = audio_formats.encode_final(results["merge"], log=log)
+    result.update(audio=audio, srt=results["srt"], ok=not pipe.errors)
+    return result
+
+
+# ========================== #
+# 🚀 Chạy cả job kiểu app4 (voices/voice_N.mp3, ZIP và file gộp)
+# ========================== #
+# on_segment(i, path) được gọi khi mỗi đoạn xong theo thứ tự, on_plan(texts) khi đã chia
+# đoạn xong, on_keys(credit_list) sau khi kiểm tra credit. Trả về danh sách file đã tạo.
+def run_voices(api_keys, voice_id, model_version, text_raw, st, sm, sty, spd, boost, max_chars, workers=4, per_key=2, stream=False, cache=None, rate=None, zip_filename="voices.zip", merged_filename="merged_voice.mp3", balance=True, latency=None,
+               folder="voices", log=print, on_segment=None, output_format=None, on_plan=None, on_keys=None,
+               ledger=None, refresh=REFRESH, hedge=0, live=False, on_live=None, rebalance=False, shared=None):
+    import http_pool
+    from job_manifest import HashedSource, JobManifest
+    from key_scheduler import plan_keys
+    from pipeline import Pipeline
+    from synth_pool import SynthPool
+    from zip_stream import ZipStream
+
+    api_keys = [key.strip() for key in api_keys.splitlines() if key.strip()]
+    voice_id = voice_id.strip()
+    text_raw = text_raw.strip()
+    
+    if not api_keys or not voice_id or not text_raw:
+        log("❌ Vui lòng nhập đầy đủ thông tin")
+        return None
+    
+    log("🔐 Tín dụng còn lại:")
+    http_pool.prewarm(api_keys, per_key)
+    credit_list = []
+    for key, (r, status) in zip(api_keys, load_credits(api_keys, ledger)):
+        if shared and r is not None:
+            r = shared.available(key, r, fresh=status == 200)
+        if r is None:
+            log(f"- {key[:6]}...: lỗi ({status or 'kết nối'})")
+        else:
+            log(f"- {key[:6]}...: {r}" + (" (ledger)" if status == "cache" else ""))
+        credit_list.append([key, r])
+    if on_keys:
+        on_keys(credit_list)
+
+    os.makedirs(folder, exist_ok=True)
+    generated_files = []
+    params = {"voice_id": voice_id, "model_version": model_version, "settings": [st, sm, sty, spd, boost]}
+    if audio_formats.request_params(output_format):
+        params["output_format"] = output_format
+    manifest = JobManifest(folder, params)
+
+    source = HashedSource(text_raw, max_chars, "balance" if balance else "greedy")
+    if balance:
+        # Chia đoạn sao cho các luồng xong gần cùng lúc, theo độ trễ đo được ở các lần trước
+        concurrency = min(workers, per_key * len(api_keys))
+        texts = balance_segments(source, max_chars, concurrency, job_coef(manifest, latency, model_version))
+    else:
+        texts = split_text_to_blocks(source, max_chars)
+    # Chạy lại giữ nguyên danh sách đoạn của lần trước (kể cả đoạn đã tách theo credit)
+    saved = None if rebalance else manifest.saved_texts(source.hexdigest())
+    if saved:
+        texts = saved
+    log(f"\n📄 Phát hiện {len(texts)} đoạn văn cần xử lý.")
+    
+    # Hiển thị thông tin phiên bản đã chọn
+    model_info = {
+        "Zilankhulo zambiri v2": "Đa ngôn ngữ, chất lượng cao",
+        "Flash v2.5": "Tốc độ cực nhanh, độ trễ thấp",
+        "Turbo v2.5": "Cân bằng giữa tốc độ và chất lượng"
+    }
+    log(f"⚡ Phiên bản: {model_version} - {model_info.get(model_version, model_version)}\n")
+    
+    ext = audio_formats.extension(output_format)
+    filename = lambda i: os.path.join(folder, f"voice_{i+1}{ext}")
+
+    # Phân bổ đoạn cho key trước khi chạy song song
+    plan, split_count = plan_keys(texts, [r for _, r in credit_list], skip=manifest.reusable(texts, filename))
+    texts = [t for t, _ in plan]
+    assigned = [j for _, j in plan]
+    manifest.save_texts(source.hexdigest(), texts)
+    if split_count:
+        log(f"✂️ Tách lại {split_count} đoạn theo câu để vừa credit còn lại, tổng cộng {len(texts)} đoạn")
+    reused = manifest.plan(texts, filename)
+    if on_plan:
+        on_plan(texts)
+    if reused:
+        log(f"♻️ Dùng lại {reused}/{len(texts)} đoạn đã tạo ở lần chạy trước")
+
+    # Key lỗi bị ngắt mạch tạm thời (401/403: tới khi kiểm tra credit ở nền thành công)
+    pool = SynthPool(credit_list, workers=workers, per_key=per_key, rate=rate, shared=shared)
+    policy = HedgePolicy(latency, model_version, int(hedge * sum(len(t) for t in texts))) if hedge else None
+    for i, j in enumerate(assigned):
+        if j is not None and not manifest.is_done(i) and not pool.reserve(j, len(texts[i])):
+            assigned[i] = None
+
+    def synth(i, text):
+        if manifest.is_done(i):
+            return filename(i), ["  ♻️ Dùng lại file đã tạo"]
+        logs, stats = [], {}
+        outname = filename(i)
+
+        def call(j, race=None):
+            attempt_stats, lines = {}, []
+            key = credit_list[j][0]
+            lines.append(f"  Sử dụng API key: {key[:6]}...")
+            out = race.path(outname, j) if race else outname
+            t0 = race.started if race else time.time()
+            fname = generate_voice(text, key, voice_id, model_version, st, sm, sty, spd, boost,
+                                   log=lines.append, outname=out, stream=stream,
+                                   stats=attempt_stats, cache=cache, output_format=output_format,
+                                   cancel=race.cancel if race else None)
+            if race and not race.finish(j, bool(fname), out, outname):
+                return bool(fname), attempt_stats
+            logs.extend(lines)
+            if fname and latency and not attempt_stats.get("cached"):
+                latency.record(model_version, len(text), time.time() - t0)
+            stats.clear()
+            stats.update(attempt_stats)
+            return bool(fname), attempt_stats
+
+        j = pool.run(len(text), call, prefer=assigned[i], log=logs.append, hedge=policy)
+        if j is None:
+            manifest.failed(i, error=logs[-1] if logs else "no key")
+            return None, logs
+        manifest.done(i, credit_list[j][0], outname, duration=probe_duration(outname, output_format))
+        if stats.get("cached"):
+            metrics.inc("tts_cache_hits_total")
+            pool.refund(j, len(text))
+        return outname, logs
+
+    # Đoạn xong được đưa ngay vào ZIP và file gộp theo thứ tự, song song với tổng hợp.
+    # ZIP của lần chạy trước bị xóa trước: ZipStream không ghi đè khi không thêm được đoạn nào.
+    if os.path.exists(zip_filename):
+        os.remove(zip_filename)
+    pipe = Pipeline()
+    zipf = ZipStream(zip_filename)
+    # merged_filename giữ tên gốc, phần mở rộng theo định dạng (PCM: .wav rồi mã hóa ở cuối)
+    merger = audio_formats.open_concat(output_format, os.path.splitext(merged_filename)[0] + audio_formats.merged_extension(output_format))
+    pipe.stage("zip", zipf.add, zipf.close, zipf.discard)
+    pipe.stage("merge", merger.append, merger.close, merger.discard)
+    if live:
+        live_out = LiveOutput(folder, output_format, target=target_duration(texts, spd))
+        pipe.stage("live", live_out.append, live_out.close, live_out.discard)
+        if on_live: on_live(live_out)
+    refresher = CreditRefresher(pool, ledger, refresh).start()
+    with pipe:
+        try:
+            for i, (fname, logs) in pool.map_ordered(synth, texts):
+                log(f"⏳ Đang xử lý đoạn {i+1}/{len(texts)}...")
+                for line in logs:
+                    log(line)
+                if fname:
+                    log(f"✅ Đoạn {i+1} tạo thành công!")
+                    pipe.put(fname)
+                    if on_segment: on_segment(i, fname)
+                    generated_files.append(fname)
+                else:
+                    log(f"❌ Đoạn {i+1} lỗi: không có API hoạt động hoặc tạo thất bại.")
+                    log("  → Gợi ý khắc phục:")
+                    log("    1. Kiểm tra lại Voice ID")
+                    log("    2. Giảm Stability/Similarity")
+                    log("    3. Tạo API key mới hoặc nâng cấp tài khoản")
+        finally:
+            refresher.stop()
+    if policy and policy.launched:
+        log(policy.summary())
+    for name, e in pipe.errors.items():
+        log(f"❌ Lỗi {'tạo ZIP' if name == 'zip' else 'gộp file'}: {e}")
+    if pipe.results.get("merge"):
+        with metrics.timed("encode"):
+            audio_formats.encode_final(pipe.results["merge"], log=log)
+
+    if cache:
+        log(cache.summary())
+    return generated_files
+
+
+# ========================== #
+# 💻 Dòng lệnh
+# ========================== #
+def _read_keys(value):
+    if value and os.path.exists(value):
+        with open(value, encoding="utf-8") as f:
+            value = f.read()
+    return [k.strip() for k in re.split(r'[\s,]+', value or "") if k.strip()]
+
+def _print_live(live_out):
+    import file_server
+    if live_out.streamable():
+        print(f"📡 Nghe dần: {file_server.stream_url(live_out, 'live' + audio_formats.merged_extension(live_out.output_format))}")
+    if live_out.playlist:
+        print(f"📡 Playlist HLS: {file_server.dir_url(live_out.folder, os.path.basename(live_out.playlist))}")
+    if not live_out.streamable():
+        print("ℹ️ Opus không phát dần được, dùng --format mp3_* hoặc pcm_*")
+
+
+def main(argv=None):
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Tạo giọng nói + phụ đề bằng ElevenLabs (không cần notebook)")
+    parser.add_argument("input", help="file văn bản, '-' để đọc từ stdin")
+    parser.add_argument("--keys", default=os.environ.get("ELEVENLABS_API_KEYS", ""),
+                        help="file chứa API key (mỗi dòng một key) hoặc danh sách key cách nhau bởi dấu phẩy; mặc định lấy từ $ELEVENLABS_API_KEYS")
+    parser.add_argument("--voice", required=True, help="Voice ID")
+    parser.add_argument("--model", default="eleven_flash_v2_5")
+    parser.add_argument("--out", default="output_audio", help="thư mục kết quả")
+    parser.add_argument("--maxlen", type=int, default=500, help="số ký tự tối đa mỗi đoạn")
+    parser.add_argument("--stability", type=float, default=0.3)
+    parser.add_argument("--similarity", type=float, default=0.75)
+    parser.add_argument("--style", type=float, default=0.0)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--boost", action="store_true", help="optimize_streaming_latency = 4")
+    parser.add_argument("--ssml", action="store_true")
+    parser.add_argument("--stream", action="store_true", help="ghi dần âm thanh ra file")
+    parser.add_argument("--no-align", action="store_true", help="không lấy timestamp, phụ đề chia theo số ký tự")
+    parser.add_argument("--lang", default="en", help="ngôn ngữ phụ đề")
+    parser.add_argument("--unit", type=int, default=3, help="số từ (hoặc ký tự với ja/zh/ko) mỗi dòng phụ đề")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--per-key", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=0, help="số request/giây mỗi key, 0 = không giới hạn")
+    parser.add_argument("--cache-dir", default="tts_cache")
+    parser.add_argument("--cache-mb", type=int, default=2048, help="0 = tắt cache")
+    parser.add_argument("--no-balance", action="store_true", help="gom câu tham lam tới --maxlen thay vì chia đoạn cân bằng")
+    parser.add_argument("--format", default=audio_formats.DEFAULT_FORMAT, choices=audio_formats.FORMATS,
+                        help="output_format của API; pcm_* nối thẳng byte và mã hóa MP3 một lần ở cuối")
+    parser.add_argument("--rebalance", action="store_true",
+                        help="chạy lại job dở mà vẫn chia đoạn lại theo số key/luồng hiện tại (tạo lại các đoạn bị đổi ranh giới)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="chạy lại sau khi sửa văn bản: chỉ tạo lại các đoạn đã thay đổi")
+    parser.add_argument("--ledger-file", default="tts_credit_ledger.json", help="nơi lưu credit của key (khóa là hash)")
+    parser.add_argument("--refresh", type=float, default=REFRESH, help="số giây giữa hai lần làm mới credit ở nền, 0 = tắt")
+    parser.add_argument("--hedge", type=float, default=0,
+                        help="tỉ lệ ký tự được gửi thêm cho đoạn chậm hơn p95 (ví dụ 0.05), 0 = tắt")
+    parser.add_argument("--live", action="store_true",
+                        help="phục vụ luồng nghe dần (và playlist HLS với MP3) trong lúc tạo, in URL khi bắt đầu")
+    parser.add_argument("--latency-file", default="tts_latency.json", help="nơi lưu độ trễ đo được để chia đoạn")
+    parser.add_argument("--metrics-jsonl", help="ghi từng request/bước xử lý ra file JSON lines")
+    parser.add_argument("--metrics-prom", help="ghi số liệu cuối job ra file Prometheus dạng text")
+    args = parser.parse_args(argv)
+
+    api_keys = _read_keys(args.keys)
+    if not api_keys:
+        parser.error("cần ít nhất một API key (--keys hoặc $ELEVENLABS_API_KEYS)")
+    # Văn bản được đọc và tách theo từng khối, không nạp cả file vào một chuỗi
+    text = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    settings = {
+        "stability": args.stability,
+        "similarity_boost": args.similarity,
+        "style": args.style,
+        "speed": args.speed,
+        "optimize_streaming_latency": 4 if args.boost else 0
+    }
+    metrics.REGISTRY.events_path = args.metrics_jsonl
+    cache = SynthCache(args.cache_dir, max_bytes=args.cache_mb * 1024 * 1024) if args.cache_mb > 0 else None
+    result = run_job(text, api_keys, args.voice, args.model, settings, folder=args.out, maxlen=args.maxlen,
+                     ssml=args.ssml, stream=args.stream, align=not args.no_align, workers=args.workers,
+                     per_key=args.per_key, rate=args.rate or None, cache=cache, lang=args.lang, unit=args.unit,
+                     balance=not args.no_balance, latency=LatencyModel(args.latency_file),
+                     incremental=args.incremental, output_format=args.format,
+                     ledger=CreditLedger(args.ledger_file), refresh=args.refresh, hedge=args.hedge,
+                     live=args.live, on_live=_print_live, rebalance=args.rebalance)
+    if text is not sys.stdin:
+        text.close()
+    if cache:
+        print(cache.summary())
+    if args.metrics_prom:
+        metrics.REGISTRY.write_prometheus(args.metrics_prom)
+    if result["audio"]:
+        print(f"✅ Âm thanh: {result['audio']}")
+    if result["srt"]:
+        print(f"✅ Phụ đề: {result['srt']}")
+    if args.live:
+        # Người nghe thường chậm hơn tốc độ tạo: giữ server cho tới khi người dùng dừng
+        print("📡 Job xong, luồng nghe vẫn được phục vụ — Ctrl+C để thoát")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
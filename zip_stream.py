@@ -0,0 +1,55 @@
+# ========================== #
+# 🗜️ ZIP ghi dần trong lúc tổng hợp
+# ========================== #
+# Mỗi đoạn xong được thêm ngay vào archive đang mở, lưu không nén (ZIP_STORED)
+# vì MP3 đã nén sẵn. Khi đoạn cuối xong thì ZIP cũng xong, không phải đọc lại
+# toàn bộ file ở cuối job. Ghi vào file .part rồi os.replace khi đóng.
+import os
+import threading
+import zipfile
+
+
+class ZipStream:
+    def __init__(self, zip_filename="voices.zip"):
+        self.zip_filename = zip_filename
+        self.part = zip_filename + ".part"
+        self.names = set()
+        self.lock = threading.Lock()
+        self.zipf = zipfile.ZipFile(self.part, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    # Thêm một file vào archive; gọi được từ nhiều luồng
+    def add(self, file, arcname=None):
+        arcname = arcname or os.path.basename(file)
+        with self.lock:
+            if self.zipf is None or arcname in self.names or not os.path.exists(file):
+                return False
+            self.zipf.write(file, arcname)
+            self.names.add(arcname)
+            return True
+
+    # Đóng archive và đưa về tên chính thức. Trả về đường dẫn ZIP hoặc None nếu rỗng.
+    def close(self):
+        with self.lock:
+            if self.zipf is None:
+                return self.zip_filename if os.path.exists(self.zip_filename) else None
+            self.zipf.close()
+            self.zipf = None
+            if not self.names:
+                os.remove(self.part)
+                return None
+            os.replace(self.part, self.zip_filename)
+            return self.zip_filename
+
+    # Bỏ archive đang ghi dở
+    def discard(self):
+        with self.lock:
+            if self.zipf is not None:
+                self.zipf.close()
+                self.zipf = None
+                os.remove(self.part)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()